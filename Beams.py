@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Locates objects from where the beams of tracks through the clusters
+# of different detectors cross, without filling voxel volumes as
+# ObjectView -> GroupOverlaps -> ScaleGroups do.
+#
+# The tracks of each cluster (from ClusteredHittingPoints) are summarised
+# as a beam: its axis x = X + TX z, y = Y + TY z (the mean of the tracks),
+# the spread of the track slopes and the RMS distance of the tracks from
+# the axis at any height, which is exactly sqrt(a + b z + c z^2). Every
+# pair of beams from different detectors then gives the point of closest
+# approach of their axes, which is a candidate object position if the
+# axes pass within the beam radii of each other there. All of this is
+# O(beams^2), independent of the number of voxels
+#--------------------------------------------------------------------
+
+import numpy as np
+from scipy.spatial import cKDTree
+import ThreeD_Tracking as td
+import Tracks
+import Profiling
+
+
+
+# ---------------------------------- Beams -----------------------------------------
+
+
+
+def BeamSummary(Points):
+
+    #--------------------------------------------------------------------
+    # Beam of the tracks with hitting points Points ((N, 3, 3) as
+    # HittingArray, [Image, Up, Surf] of each track): the axis through
+    # Centre (on the image plane) with Direction, Spread (RMS deviation of
+    # the track slopes from the axis) and Radius coefficients [a, b, c]
+    # of the RMS distance of the tracks from the axis at height z,
+    # sqrt(a + b z + c z^2) (see BeamRadius)
+    #--------------------------------------------------------------------
+
+    Points = np.asarray(Points, dtype=float).reshape((-1, 3, 3))
+
+    Up, Surf = Points[:,1], Points[:,2]
+
+    Slopes = (Surf[:,:2] - Up[:,:2]) / (Surf[:,2] - Up[:,2])[:,None] # [TX, TY] of x = X + TX z
+    Intercepts = Up[:,:2] - Slopes * Up[:,2,None]                   # [X, Y]
+
+    Intercept, Slope = Intercepts.mean(axis=0), Slopes.mean(axis=0)
+    dIntercepts, dSlopes = Intercepts - Intercept, Slopes - Slope
+
+    Radius = [float(np.mean(np.sum(dIntercepts**2, axis=1))), \
+              float(2 * np.mean(np.sum(dIntercepts * dSlopes, axis=1))), \
+              float(np.mean(np.sum(dSlopes**2, axis=1)))]
+
+    ZImage = float(np.mean(Points[:,0,2]))
+    Direction = np.append(Slope, 1) / np.linalg.norm(np.append(Slope, 1))
+
+    Beam = {'Intercept':Intercept, \
+            'Slope':Slope, \
+            'Centre':np.append(Intercept + Slope * ZImage, ZImage), \
+            'Direction':Direction, \
+            'Spread':float(np.sqrt(Radius[2])), \
+            'Radius':Radius, \
+            'Footprint':float(np.sqrt(max(Radius[0] + Radius[1] * ZImage + Radius[2] * ZImage**2, 0))), \
+            'Tracks':len(Points)}
+
+    return Beam
+
+
+
+def BeamRadius(Beam, Z):
+    # RMS distance [cm] of the tracks of Beam from its axis at heights Z
+    a, b, c = Beam['Radius']
+    Z = np.asarray(Z, dtype=float)
+
+    return np.sqrt(np.maximum(a + b * Z + c * Z**2, 0))
+
+
+
+def DetectorBeams(PixelHits, ClusterDicts, DetectorPos, Detector=0, MinTracks=10, Config=None):
+
+    #--------------------------------------------------------------------
+    # BeamSummary of the tracks through each cluster of one detector, the
+    # tracks (ClusteredHittingPoints output) being sorted into clusters by
+    # the cluster layer pixel they cross (as ClusteredHittingPoints
+    # selects them). The pixels are taken from the Pixel column of a
+    # Tracks.TrackBundle, which is kept from before any detector pose,
+    # else from the image points. Clusters with fewer than MinTracks
+    # tracks are left out
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Points = td.HittingArray(PixelHits)
+
+    Labels = np.full(Config.ProjectionPixel[:2], -1)
+
+    for c in range(len(ClusterDicts) - 1, -1, -1): # the first cluster a pixel is in wins
+        Indices = np.array([Index for Layer in ClusterDicts[c]['Active Indices'] for Index in Layer], dtype=np.int64).reshape((-1, 2))
+        Labels[Indices[:,0], Indices[:,1]] = c
+
+    Track = np.full(len(Points), -1)
+
+    if Tracks.IsTrackBundle(PixelHits) and np.all(PixelHits.Pixel >= 0):
+        Track = Labels.ravel()[PixelHits.Pixel]
+
+    else:
+        Iind, Jind = Config.LayerGrid.Centred(DetectorPos).WorldToIndex(Points[:,0,0], Points[:,0,1])
+        Inside = Config.LayerGrid.InBounds(Iind, Jind)
+        Track[Inside] = Labels[Iind[Inside], Jind[Inside]]
+
+    Beams = []
+
+    for c in range(len(ClusterDicts)):
+        Selected = Track == c
+
+        if np.count_nonzero(Selected) >= MinTracks:
+            Beam = BeamSummary(Points[Selected])
+            Beam['Detector'] = Detector
+            Beam['Cluster'] = c
+
+            Beams.append(Beam)
+
+    return Beams
+
+
+
+# ---------------------------------- Intersections -----------------------------------------
+
+
+
+def ClosestApproach(First, Second):
+
+    #--------------------------------------------------------------------
+    # Points on the axes of two beams where they come closest, as (point
+    # on First, point on Second, distance), or None if they are parallel
+    #--------------------------------------------------------------------
+
+    P = np.append(First['Intercept'], 0)
+    Q = np.append(Second['Intercept'], 0)
+    u = np.append(First['Slope'], 1)
+    v = np.append(Second['Slope'], 1)
+
+    w = P - Q
+    a, b, c = u @ u, u @ v, v @ v
+    d, e = u @ w, v @ w
+
+    Denominator = a * c - b * b
+
+    if Denominator <= 1e-12 * a * c:
+        return None
+
+    s = (b * e - c * d) / Denominator
+    t = (a * e - b * d) / Denominator
+
+    OnFirst, OnSecond = P + s * u, Q + t * v
+
+    return OnFirst, OnSecond, float(np.linalg.norm(OnFirst - OnSecond))
+
+
+
+def BeamIntersections(Beams, ZRange, Config=None):
+
+    #--------------------------------------------------------------------
+    # Candidate object positions from each pair of beams of different
+    # detectors whose axes come within the sum of their radii of each
+    # other at a height in ZRange. Each candidate has the midpoint of the
+    # closest approach (Position), its Depth below the surface, the Miss
+    # Distance, the Radius (the sum of the beam radii there), Overlap
+    # (1 - Miss Distance / Radius) and a Weight (Overlap times the tracks
+    # of the smaller beam)
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Candidates = []
+
+    for i in range(len(Beams)):
+        for j in range(i + 1, len(Beams)):
+            if Beams[i]['Detector'] == Beams[j]['Detector']:
+                continue
+
+            Closest = ClosestApproach(Beams[i], Beams[j])
+
+            if Closest is None:
+                continue
+
+            OnFirst, OnSecond, Miss = Closest
+            Position = (OnFirst + OnSecond) / 2
+
+            if not ZRange[0] <= Position[2] <= ZRange[1]:
+                continue
+
+            Radius = float(BeamRadius(Beams[i], OnFirst[2]) + BeamRadius(Beams[j], OnSecond[2]))
+
+            if Miss > Radius:
+                continue
+
+            Overlap = 1 - Miss / Radius if Radius > 0 else 1.0
+
+            Candidates.append({'Position':Position, \
+                               'Depth':float(Config.TopDepth - Position[2]), \
+                               'Miss Distance':Miss, \
+                               'Radius':Radius, \
+                               'Overlap':Overlap, \
+                               'Weight':Overlap * min(Beams[i]['Tracks'], Beams[j]['Tracks']), \
+                               'Beams':(i, j)})
+
+    return Candidates
+
+
+
+def CandidateObjects(Candidates, Config=None):
+
+    #--------------------------------------------------------------------
+    # Merges candidates closer to each other than half the sum of their
+    # radii into objects, with the Weight averaged Position and Depth,
+    # total Weight, and the beams involved. Sorted by Weight, largest first.
+    # Only the pairs within the largest radius of each other (found with a
+    # k-d tree) are compared
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Parent = list(range(len(Candidates)))
+
+    def Root(k):
+        while Parent[k] != k:
+            Parent[k] = Parent[Parent[k]]
+            k = Parent[k]
+
+        return k
+
+    if Candidates:
+        Positions = np.array([Candidate['Position'] for Candidate in Candidates], dtype=float)
+        Radii = np.array([Candidate['Radius'] for Candidate in Candidates], dtype=float)
+
+        for i, j in sorted(cKDTree(Positions).query_pairs(np.max(Radii))):
+            if np.linalg.norm(Positions[i] - Positions[j]) < (Radii[i] + Radii[j]) / 2:
+                Parent[Root(i)] = Root(j)
+
+    Groups = {}
+
+    for k in range(len(Candidates)):
+        Groups.setdefault(Root(k), []).append(Candidates[k])
+
+    Objects = []
+
+    for Group in Groups.values():
+        Weights = np.array([Candidate['Weight'] for Candidate in Group])
+        Weights = Weights if Weights.sum() > 0 else np.ones(len(Group))
+
+        Position = np.average([Candidate['Position'] for Candidate in Group], axis=0, weights=Weights)
+
+        Objects.append({'Position':Position, \
+                        'Depth':float(Config.TopDepth - Position[2]), \
+                        'Weight':float(sum(Candidate['Weight'] for Candidate in Group)), \
+                        'Candidates':len(Group), \
+                        'Beams':sorted(set(Beam for Candidate in Group for Beam in Candidate['Beams']))})
+
+    return sorted(Objects, key=lambda Object: -Object['Weight'])
+
+
+
+def LocateObjects(ReadDict, AnalyseDict, Config=None, MinTracks=10):
+
+    #--------------------------------------------------------------------
+    # Beams of the clusters of every detector (AnalyseDict 'Hitting Data'
+    # and 'Cluster Dict List'), their pairwise intersections between the
+    # top of the detectors and the surface, and the objects these give
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Beams = []
+
+    with Profiling.Stage('LocateObjects'):
+        for i in range(len(AnalyseDict['Hitting Data'])):
+            DetectorPos = ReadDict['Row Sky List'][i]['DetectorPos']
+
+            Beams += DetectorBeams(AnalyseDict['Hitting Data'][i], AnalyseDict['Cluster Dict List'][i], DetectorPos, i, MinTracks, Config)
+
+        ZRange = (min(Config.ZUp(Seperation) for Seperation in ReadDict['Seperations']), Config.TopDepth)
+
+        Candidates = BeamIntersections(Beams, ZRange, Config)
+
+        BeamDict = {'Beams':Beams, \
+                    'Candidates':Candidates, \
+                    'Objects':CandidateObjects(Candidates, Config)}
+
+        Profiling.Count('Beams', len(Beams))
+
+    return BeamDict
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Count images built up from batches of RowData events, for detector
+# runs which are still taking data, count images binned in time and
+# count images of very large runs made by several processes
+#--------------------------------------------------------------------
+
+import numpy as np
+import datetime
+from joblib import dump, load
+import ThreeD_Tracking as td
+from Pipeline import ParallelMap
+
+
+TimeFormats = ['%a %b %d %H:%M:%S %Y',    # eg. Sat Jun 19 19:59:51 2021
+               '%a_%b_%d_%H-%M-%S_%Y',    # eg. Sat_Jun_19_19-59-51_2021 (RowData directory names)
+               '%Y-%m-%d %H:%M:%S',
+               '%Y-%m-%dT%H:%M:%S',
+               '%Y-%m-%d %H:%M:%S.%f',
+               '%Y-%m-%dT%H:%M:%S.%f']
+
+
+
+def ImageLayers(Seperation, Iterate, Config=None):
+    # Heights of the image layers of PazAnalysis(..., Iterate)
+    Config = td.GetConfig(Config)
+    
+    if Iterate == True:
+        return Config.LayerZ(Seperation)
+    
+    return Config.ZUp(Seperation) + Config.ClusterOffset
+
+
+
+def TrackDeposits(Lines, Seperation, Iterate, DetectorPos, Config=None, Chunk=2**12):
+    
+    #--------------------------------------------------------------------
+    # Yields (Rows, Flat, Weights) for the counts the trajectories Lines
+    # add to PazAnalysis(..., Iterate): the flat index of each count, the
+    # row of Lines giving it and its weight (None for one count each).
+    # These are one per image layer at the nearest pixel, or, if Iterate
+    # and Config.Projection is 'Count' or 'Length', every voxel crossed
+    # (as DepositSegments, Chunk segments at a time)
+    #--------------------------------------------------------------------
+    
+    Config = td.GetConfig(Config)
+    
+    if Iterate == True and Config.Projection != 'Nearest':
+        Start, End = td.LineSegments(Lines, Config.LayerGrid, Config.ZUp(Seperation), DetectorPos)
+        
+        for First in range(0, len(Start), Chunk):
+            Rows, Flat, Lengths = td.TraceSegments(Start[First:First+Chunk], End[First:First+Chunk], Config.LayerGrid, Config.ZUp(Seperation))
+            
+            yield Rows + First, Flat, Lengths if Config.Projection == 'Length' else None
+        
+        return
+    
+    Flat, Rows = td.LineIndices(Lines, Config.LayerGrid, ImageLayers(Seperation, Iterate, Config), DetectorPos, Rows=True)
+    
+    yield Rows, Flat, None
+
+
+
+class CountAccumulator:
+
+    #--------------------------------------------------------------------
+    # Keeps the sky, real and subtracted count images of one detector
+    # (as PazAnalysis and ReadDataFiles make them) up to date as batches
+    # of events arrive. Adding a batch only touches the pixels its events
+    # cross, so the cost is proportional to the new events rather than
+    # the length of the run. The state can be saved with Save and resumed
+    # with CountAccumulator.Load
+    #--------------------------------------------------------------------
+
+    def __init__(self, DetectorPos, Seperation, Iterate=False, SkyMinusReal=True, Config=None):
+        # SkyMinusReal: Subtracted is Sky - Real as in ReadDataFiles, else Real - Sky as in view.py
+
+        Config = td.GetConfig(Config)
+
+        self.Config = Config
+        self.DetectorPos = list(DetectorPos)
+        self.Seperation = Seperation
+        self.Iterate = Iterate
+        self.SkyMinusReal = SkyMinusReal
+
+        self.ZImages = ImageLayers(Seperation, Iterate, Config)
+
+        Shape = Config.LayerGrid.Shape[:2] + np.shape(self.ZImages)
+
+        self.Counts = {'Sky':np.zeros(Shape), 'Real':np.zeros(Shape)}
+        self.Subtracted = np.zeros(Shape)
+        self.Events = {'Sky':0, 'Real':0}   # number of events added
+        self.Rejected = {'Sky':0, 'Real':0} # events without a trajectory
+        self.Offsets = {}                    # FileName: byte offset reached by Follow
+
+    def Add(self, Kind, RowData):
+
+        #--------------------------------------------------------------------
+        # Adds the events of RowData (eg. from ReadRowDataIncrement) to the
+        # 'Sky' or 'Real' counts
+        #--------------------------------------------------------------------
+
+        Lines, Quality = td.EventLines(RowData, self.Seperation, self.Config, Quality=True)
+        Valid = Quality == td.QualityOK
+
+        self.Events[Kind] += len(Lines)
+        self.Rejected[Kind] += int(np.count_nonzero(~Valid))
+
+        for Rows, Flat, Weights in TrackDeposits(Lines[Valid], self.Seperation, self.Iterate, self.DetectorPos, self.Config):
+            self.AddIndices(Kind, Flat, Weights)
+
+    def AddSky(self, RowData):
+        self.Add('Sky', RowData)
+
+    def AddReal(self, RowData):
+        self.Add('Real', RowData)
+
+    def AddIndices(self, Kind, Flat, Weights=None):
+
+        #--------------------------------------------------------------------
+        # Adds one count (or Weights) to Kind at each flat index in Flat and
+        # updates the subtracted image at those pixels only
+        #--------------------------------------------------------------------
+
+        Pixels, Inverse = np.unique(Flat, return_inverse=True)
+        Counts = np.bincount(Inverse.ravel(), weights=Weights, minlength=len(Pixels))
+
+        self.Counts[Kind].flat[Pixels] += Counts
+
+        Diff = self.Counts['Sky'].flat[Pixels] - self.Counts['Real'].flat[Pixels]
+
+        self.Subtracted.flat[Pixels] = np.maximum(Diff if self.SkyMinusReal else -Diff, 0)
+
+    def Follow(self, SkyFile=None, RealFile=None):
+
+        #--------------------------------------------------------------------
+        # Adds the events written to SkyFile and RealFile since the last
+        # call (or since the start of the files). Returns the number of
+        # new events read from each
+        #--------------------------------------------------------------------
+
+        New = {}
+
+        for Kind, FileName in [('Sky', SkyFile), ('Real', RealFile)]:
+            if FileName is None:
+                continue
+
+            RowData, self.Offsets[FileName] = td.ReadRowDataIncrement(FileName, self.DetectorPos, self.Offsets.get(FileName, 0))
+
+            self.Add(Kind, RowData)
+            New[Kind] = len(RowData['BarsReadout'][0])
+
+        return New
+
+    def Save(self, FileName):
+        # Checkpoints the accumulated counts and file offsets
+        dump(self.__dict__, FileName)
+
+    @classmethod
+    def Load(cls, FileName):
+        # Resumes from a checkpoint written by Save
+        Accumulator = cls.__new__(cls)
+        Accumulator.__dict__.update(load(FileName))
+
+        return Accumulator
+
+
+
+# ---------------------------------- Time Slices -----------------------------------------
+
+
+
+def ParseEventTime(DateAndTime):
+    
+    #--------------------------------------------------------------------
+    # Converts one RowData DateAndTime string to seconds since the epoch,
+    # trying each of TimeFormats, then a plain number of seconds. NaN if
+    # it can't be read
+    #--------------------------------------------------------------------
+    
+    String = str(DateAndTime).strip()
+    
+    for Format in TimeFormats:
+        try:
+            return datetime.datetime.strptime(String, Format).replace(tzinfo=datetime.timezone.utc).timestamp()
+        
+        except ValueError:
+            continue
+    
+    try:
+        return float(String)
+    
+    except ValueError:
+        return np.nan
+
+
+
+def EventTimes(DateAndTime):
+    # ParseEventTime of each string, parsing each distinct string once
+    Strings, Inverse = np.unique(np.asarray(DateAndTime, dtype=str), return_inverse=True)
+    
+    return np.array([ParseEventTime(String) for String in Strings], dtype=float)[Inverse.ravel()]
+
+
+
+def TimeEdges(Windows, Times):
+    
+    #--------------------------------------------------------------------
+    # Window edges in seconds since the epoch. Windows is a number of 
+    # equal windows spanning Times, or a sequence of edges given as 
+    # datetimes, DateAndTime style strings or seconds
+    #--------------------------------------------------------------------
+    
+    if np.ndim(Windows) == 0:
+        Start, Stop = np.nanmin(Times), np.nanmax(Times)
+        
+        return np.linspace(Start, Stop + 1e-6 * max(Stop - Start, 1), int(Windows) + 1) # last event is inside the last window
+    
+    Edges = []
+    
+    for Edge in Windows:
+        if isinstance(Edge, datetime.datetime):
+            Edge = Edge.replace(tzinfo=datetime.timezone.utc).timestamp() if Edge.tzinfo is None else Edge.timestamp()
+            
+        elif isinstance(Edge, str):
+            Edge = ParseEventTime(Edge)
+            
+        Edges.append(float(Edge))
+    
+    return np.array(Edges)
+
+
+
+def TimeSlicedCounts(RowData, Seperation, Windows, Iterate=False, Config=None):
+    
+    #--------------------------------------------------------------------
+    # Counts as PazAnalysis makes them, separately for each time window 
+    # (see TimeEdges), in one pass over the events of RowData. Exposure is
+    # the time [s] each window overlaps the run (first to last event) and
+    # Rates the counts per second of exposure
+    #--------------------------------------------------------------------
+    
+    Config = td.GetConfig(Config)
+    
+    Lines, Quality = td.EventLines(RowData, Seperation, Config, Quality=True)
+    Times = EventTimes(RowData['DateAndTime'][:len(Lines)])
+    
+    Edges = TimeEdges(Windows, Times)
+    NumWindows = len(Edges) - 1
+    
+    Window = np.searchsorted(Edges, Times, side='right') - 1
+    Window[np.isnan(Times)] = -1
+    
+    Valid = (Quality == td.QualityOK) & (Window >= 0) & (Window < NumWindows)
+    
+    Shape = Config.LayerGrid.Shape[:2] + np.shape(ImageLayers(Seperation, Iterate, Config))
+    Size = int(np.prod(Shape))
+    
+    Counts = np.zeros(NumWindows * Size)
+    
+    for Rows, Flat, Weights in TrackDeposits(Lines[Valid], Seperation, Iterate, RowData['DetectorPos'], Config):
+        Counts += np.bincount(Window[Valid][Rows] * Size + Flat, weights=Weights, minlength=NumWindows * Size)
+    
+    Counts = Counts.reshape((NumWindows,) + Shape)
+    
+    RunStart, RunStop = np.nanmin(Times), np.nanmax(Times)
+    Exposure = np.clip(np.minimum(Edges[1:], RunStop) - np.maximum(Edges[:-1], RunStart), 0, None)
+    
+    Scale = np.divide(1, Exposure, out=np.zeros(NumWindows), where=Exposure > 0)
+    Rates = Counts * Scale.reshape((-1,) + (1,) * len(Shape))
+    
+    SliceDict = {'Counts':Counts, \
+                 'Rates':Rates, \
+                 'Exposure':Exposure, \
+                 'Edges':Edges, \
+                 'Events':np.bincount(Window[Valid], minlength=NumWindows)}
+    
+    return SliceDict
+
+
+
+def SubtractedRates(Slices, Reference, SkyMinusReal=True):
+    
+    #--------------------------------------------------------------------
+    # Difference of the rates in each window of Slices (TimeSlicedCounts 
+    # of a real run) and the mean rate of Reference (TimeSlicedCounts of a
+    # sky run, which can be of any length), negative values set to zero. 
+    # SkyMinusReal as in CountAccumulator
+    #--------------------------------------------------------------------
+    
+    MeanRate = np.sum(Reference['Counts'], axis=0) / np.sum(Reference['Exposure'])
+    
+    Diff = MeanRate[None] - Slices['Rates'] if SkyMinusReal else Slices['Rates'] - MeanRate[None]
+    Diff[Slices['Exposure'] == 0] = 0
+    Diff[Diff < 0] = 0
+    
+    return Diff
+
+
+
+# ---------------------------------- Parallel Counting -----------------------------------------
+
+
+
+def CountChunk(Shared, i):
+    
+    #--------------------------------------------------------------------
+    # PazAnalysis counts of the events Shared['Bounds'][i] to 
+    # Shared['Bounds'][i+1], as a flat array
+    #--------------------------------------------------------------------
+    
+    Config = Shared['Config']
+    Start, Stop = Shared['Bounds'][i], Shared['Bounds'][i+1]
+    
+    Chunk = {'BarsReadout':[Shared['Bars'][Start:Stop], Shared['Lengths'][Start:Stop]]}
+    
+    Lines, Quality = td.EventLines(Chunk, Shared['Seperation'], Config, Quality=True)
+    Lines = Lines[Quality == td.QualityOK]
+    
+    Counts = np.zeros(Shared['Size'])
+    
+    for Rows, Flat, Weights in TrackDeposits(Lines, Shared['Seperation'], Shared['Iterate'], Shared['DetectorPos'], Config):
+        Counts += np.bincount(Flat, weights=Weights, minlength=Shared['Size'])
+    
+    return Counts
+
+
+
+def ParallelPazAnalysis(RowData, Seperation, Iterate, Workers=None, Chunk=td.EventChunk, Config=None):
+    
+    #--------------------------------------------------------------------
+    # PazAnalysis with the events split into blocks of Chunk events which
+    # worker processes count into private arrays. The arrays are summed
+    # in block order, and the blocks do not depend on Workers, so the
+    # result has the same bits as PazAnalysis(..., Chunk) whatever the
+    # number of workers (with Projection 'Length' too)
+    #--------------------------------------------------------------------
+    
+    Config = td.GetConfig(Config)
+    
+    Bars, Lengths = RowData['BarsReadout']
+    
+    Shape = Config.LayerGrid.Shape[:2] + np.shape(ImageLayers(Seperation, Iterate, Config))
+    Bounds = td.EventBounds(len(Bars), Chunk)
+    
+    Shared = {'Bars':Bars, \
+              'Lengths':Lengths, \
+              'Bounds':Bounds, \
+              'DetectorPos':RowData['DetectorPos'], \
+              'Seperation':Seperation, \
+              'Iterate':Iterate, \
+              'Size':int(np.prod(Shape)), \
+              'Config':Config}
+    
+    DetectorCounts = np.zeros(Shared['Size'])
+    
+    for Counts in ParallelMap(CountChunk, len(Bounds) - 1, Shared, Workers):
+        DetectorCounts += Counts
+    
+    return DetectorCounts.reshape(Shape)
@@ -0,0 +1,786 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Unmodified copies of the original implementations of the stages which
+# have since been rewritten in ThreeD_Tracking (vectorized, RunConfig
+# based, parallel). They read the module globals below, set from a
+# RunConfig with UseConfig, and are only used by golden.py to check
+# that the current stages still give the same results
+#--------------------------------------------------------------------
+
+import numpy as np
+import datetime
+import math
+import ThreeD_Tracking as td
+
+
+ConfigNames = ['TriggerSize', 'BarWidth', 'BarHight', 'NumOfBars', 'TriggerWidth', 'TopDepth', 'ImageLayerSize', 'ObjectZ', \
+               'ImageVolume', 'ProjectionPixel', 'Cutoff', 'Divide', 'ClusterLayer', 'LocalCutoff', 'PercentCutoff', \
+               'OverlapCutoff', 'LocalCutoff3D', 'PercentCutoff3D', 'Iterate', 'Which']
+
+
+
+def UseConfig(Config=None):
+    # Sets the globals read by the functions below from Config (the ThreeD_Tracking globals if None)
+    Config = td.GetConfig(Config)
+    
+    for Name in ConfigNames:
+        Value = getattr(Config, Name)
+        globals()[Name] = list(Value) if isinstance(Value, tuple) else Value
+
+
+
+UseConfig()
+
+
+
+# --------------------------------- Original Implementations -----------------------------------------
+
+
+
+def CalcLocalPos(Bar,Length): #Arguments are BarsReadout elements from one event
+    # LocalPos == [LocalX or LocalY, LocalZ]
+    
+    #--------------------------------------------------------------------
+    # Determines position of the muon through each layer of scintillators
+    # as well as outputs list of which bars produced the signal for each
+    # event
+    #--------------------------------------------------------------------
+    
+    LengthLocal = [[],[],[],[]]
+    BarLocal = [[],[],[],[]]
+    LocalPos = [[],[],[],[]]
+    
+    for n in range(len(Bar)): #Sorts Bar and Length data into nested lists corresponding to each layer on the detector
+         LengthLocal[math.floor(Bar[n]/100)-1].append(Length[n])
+         BarLocal[math.floor(Bar[n]/100)-1].append(Bar[n])
+         
+    a = np.sqrt(BarHight**2+(BarWidth/2)**2)
+    Alpha = np.arctan(2*BarHight/BarWidth)
+    
+    for i in range(len(LengthLocal)):
+        NumOfBarsLocal = len(LengthLocal[i])
+        
+        if NumOfBarsLocal == 0: # No signal, return error
+            X,Z = -9999,-9999
+        
+        elif NumOfBarsLocal == 1: 
+            #X,Z = BarWidth/2, BarHight/2
+            
+            if BarLocal[i][0]%2 == 0: #The first bar's vertex is facing down
+                X,Z = 0, 0
+            
+            else:
+                X,Z = 0, BarHight
+            
+            #Takes tip instead of middle of bar
+            
+            
+        elif NumOfBarsLocal >= 2:
+            Readout = []
+            mxind = LengthLocal[i].index(max(LengthLocal[i]))
+            
+            if mxind == 0: #The first bar has the max readout so we take the first and second bars
+                Readout = [LengthLocal[i][mxind],LengthLocal[i][mxind+1]]
+            
+            elif mxind == len(LengthLocal[i])-1: #The last bar has the max readout so we take the last bar and the one before
+                Readout = [LengthLocal[i][mxind],LengthLocal[i][mxind-1]]
+            
+            else: #The max readout is somewhere at the middle, so we take this bar and it's highest neighbor
+                Readout = [LengthLocal[i][mxind], np.amax([LengthLocal[i][mxind+1], LengthLocal[i][mxind-1]])]
+            '''
+            else: #The max readout is somewhere at the middle, so we take this bar and it's highest neighbor
+                Readout = np.amax([[LengthLocal[i][mxind],LengthLocal[i][mxind+1]],\
+                                   [LengthLocal[i][mxind],LengthLocal[i][mxind-1]]],axis = 0) 
+            '''
+            if BarLocal[i][0]%2 == 0: #The first bar's vertex is facing down
+                X = BarWidth/2 - (a*Readout[0]/(Readout[0]+Readout[1]))*math.cos(Alpha)
+                Z = BarHight/2 - (a*Readout[0]/(Readout[0]+Readout[1]))*math.sin(Alpha)
+            
+            else: #The first bar's vertex is facing up
+                X = -BarWidth/2 + (a*Readout[1]/(Readout[0]+Readout[1]))*math.cos(Alpha)
+                Z = BarHight/2 - (a*Readout[1]/(Readout[0]+Readout[1]))*math.sin(Alpha)
+            
+        LocalPos[i] = [X,Z] #[X/2 + np.random.random()*X, Z/2 + np.random.random()*Z] #randomize 50% (increases computing time)
+            
+    return LocalPos, BarLocal 
+
+
+
+def CalcAbsPos(LocalPos,BarLocal, Seperation):
+    #AbsPos[i] == [AbsX or AbsY, AbsZ] 
+    
+    #--------------------------------------------------------------------
+    # Deterimines position relative to centre of the detector layer, 
+    # and height measured from the bottom of the detector
+    #--------------------------------------------------------------------
+    
+    AbsPos = [[0,0],[0,0],[0,0],[0,0]]
+    
+    if [-9999,-9999] in LocalPos:
+        return -9999
+        
+    else:    
+        for l in range(len(LocalPos)):  
+            FirstBarIndex = BarLocal[l][0]
+            i = math.floor(FirstBarIndex/100)
+            
+            if i == 1: #XUp
+                AbsPos[l][1] = LocalPos[l][1] + TriggerWidth + Seperation + 3.5 * BarHight
+                FirstBarIndex = FirstBarIndex - 100
+           
+            if i == 2: #YUp
+                AbsPos[l][1] = LocalPos[l][1] + TriggerWidth + Seperation + 2.5 * BarHight
+                FirstBarIndex = FirstBarIndex - 200
+            
+            if i == 3: #XDown
+                AbsPos[l][1] = LocalPos[l][1] + TriggerWidth + 1.5 * BarHight
+                FirstBarIndex = FirstBarIndex - 300
+            
+            if i == 4: #YDown
+                AbsPos[l][1] = LocalPos[l][1] + TriggerWidth + 0.5 * BarHight
+                FirstBarIndex = FirstBarIndex - 400
+            
+            
+            if FirstBarIndex%2 == 0 : #The first bar's vertex is facing down
+                AbsPos[l][0] = LocalPos[l][0] - (NumOfBars / 4 - 0.25) * BarWidth + BarWidth / 2 * FirstBarIndex
+                
+            else: #The first bar's vertex is facing up
+                AbsPos[l][0] = LocalPos[l][0] - (NumOfBars / 4 - 0.25) * BarWidth + BarWidth / 2 * (FirstBarIndex + 1) 
+                
+        return AbsPos 
+
+
+
+def CalcEventHittingPoints(Bar, Length, ZImage, DetectorPos, Seperation): #( <RowData>['BarsReadout'][0][i], <RowData>['BarsReadout'][1][i], ...)
+    
+    #--------------------------------------------------------------------
+    # Determines where on each plane (z = const.) the muon passed through 
+    #--------------------------------------------------------------------
+    
+    HittingPoints = np.zeros(9).reshape((3,3))
+    
+    [LocalPos,BarLocal] = CalcLocalPos(Bar,Length)
+    
+    AbsPos = CalcAbsPos(LocalPos,BarLocal, Seperation)
+    
+    if AbsPos == -9999:
+        HittingPoints = [[-9999]*3]*3
+    
+    else:    
+        AbsXUp = AbsPos[0]
+        AbsYUp = AbsPos[1]
+        AbsXDown = AbsPos[2]
+        AbsYDown = AbsPos[3]
+        
+        ZUp = 2 * TriggerWidth + 4 * BarHight + Seperation
+        ZSurf = TopDepth
+        
+        dZx = AbsXUp[1] - AbsXDown[1]
+        dX = AbsXUp[0] - AbsXDown[0]
+        
+        dZy = AbsYUp[1] - AbsYDown[1]
+        dY = AbsYUp[0] - AbsYDown[0]
+        
+        if dX != 0 and dY != 0:
+            ax = dZx / dX  
+            ay = dZy / dY
+        
+            bx = AbsXUp[1] - ax * AbsXUp[0]
+            by = AbsYUp[1] - ay * AbsYUp[0]
+            
+            HittingPoints[0][0] = (ZImage - bx) / ax + DetectorPos[0] #XImage
+            HittingPoints[0][1] = (ZImage - by) / ay + DetectorPos[1] #YImage
+            HittingPoints[0][2] = ZImage #ZImage
+            
+            HittingPoints[1][0] = (ZUp - bx) / ax + DetectorPos[0] #XUp
+            HittingPoints[1][1] = (ZUp - by) / ay + DetectorPos[1] #YUp
+            HittingPoints[1][2] = ZUp #ZUp
+            
+            HittingPoints[2][0] = (ZSurf - bx) / ax + DetectorPos[0] #XSurf
+            HittingPoints[2][1] = (ZSurf - by) / ay + DetectorPos[1] #YSurf
+            HittingPoints[2][2] = ZSurf #ZSurf
+            
+        else:
+            HittingPoints = [[-9999]*3]*3
+    
+    return HittingPoints 
+
+
+
+def PazAnalysis(RowData, Seperation, Iterate):
+    
+    #--------------------------------------------------------------------
+    # Creates a 3D array counting the number of trajectories passsing 
+    # through each pixel in the image layers specified by the global
+    # variables 
+    #--------------------------------------------------------------------
+    
+    begin_time = datetime.datetime.now()
+    
+    N = RowData['NumberOfEvents']
+    
+    if Iterate == True:
+        DetectorCounts = np.zeros((ProjectionPixel[0], ProjectionPixel[1], ProjectionPixel[2])) 
+        
+        for k in range(N-1):
+            for i in range(ProjectionPixel[2]):
+                ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + i*TopDepth/ProjectionPixel[2] #Z coordinate of Image Layer
+                HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, RowData['DetectorPos'], Seperation)
+                
+                if np.all(HittingPoints == -9999):
+                    DetectorCounts = -9999
+                    break
+                
+                else:  
+                    Iind = int(round((HittingPoints[0][0] + ImageLayerSize[0]/2)*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
+                    Jind = int(round((HittingPoints[0][1] + ImageLayerSize[1]/2)*(ProjectionPixel[1]-1)/ImageLayerSize[1]))
+                    
+                    if Iind>0 and Jind>0 and Iind<len(DetectorCounts[0]) and Jind<len(DetectorCounts[1]): 
+                            DetectorCounts[Iind,Jind,i] += 1 
+        
+    else:
+        DetectorCounts = np.zeros((ProjectionPixel[0], ProjectionPixel[1])) 
+        
+        for k in range(N-1):
+            ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + ClusterLayer*TopDepth/ProjectionPixel[2] #Z coordinate of Image Layer
+            HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, RowData['DetectorPos'], Seperation)
+            
+            if np.all(HittingPoints == -9999):
+                DetectorCounts = -9999
+                break
+            
+            else:  
+                Iind = int(round((HittingPoints[0][0] + ImageLayerSize[0]/2)*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
+                Jind = int(round((HittingPoints[0][1] + ImageLayerSize[1]/2)*(ProjectionPixel[1]-1)/ImageLayerSize[1]))
+                
+                if Iind>0 and Jind>0 and Iind<len(DetectorCounts[0]) and Jind<len(DetectorCounts[1]): 
+                        DetectorCounts[Iind,Jind] += 1 
+    
+    tictoc = datetime.datetime.now() - begin_time
+    print('It took ', tictoc,' to analyse the RowData from ', RowData['FileName'])
+    
+    return DetectorCounts 
+
+
+
+def ClusterAlgorithm(Data, Threshold, StartIndex):
+    #Expects 2D array
+    
+    #--------------------------------------------------------------------
+    # Isolates regions in Data above the threshold given the StartIndex
+    #--------------------------------------------------------------------
+    
+    def Check(ActiveIndices, Shift, Zeros, Temp): # Checks to see if the pixel Shift-ed relative to ActiveIndices[j][k] is above Threshold
+        
+        if 0 <= ActiveIndices[j][k][0] + Shift[0] < Shape[0] and 0 <= ActiveIndices[j][k][1] + Shift[1] < Shape[1]:
+            if Data[ActiveIndices[j][k][0] + Shift[0], ActiveIndices[j][k][1] + Shift[1]] < Threshold:   
+                if Data[ActiveIndices[j][k][0] + Shift[0], ActiveIndices[j][k][1] + Shift[1]] == 0:
+                    Zeros += 1
+                
+            elif not [ActiveIndices[j][k][0] + Shift[0], ActiveIndices[j][k][1] + Shift[1]] in ActiveIndices[j-1]:
+                if not [ActiveIndices[j][k][0] + Shift[0], ActiveIndices[j][k][1] + Shift[1]] in Temp:
+                    Temp.append([ActiveIndices[j][k][0] + Shift[0], ActiveIndices[j][k][1] + Shift[1]])
+            
+        return Zeros, Temp
+    
+    ActiveIndices = [[StartIndex]]  
+    Shape = np.shape(Data)
+    ClusteredData = np.zeros((Shape[0], Shape[1]))
+    
+    i = 0
+    j = 0
+    while i == 0:
+        Temp = []
+        LayerZeros = 0
+        
+        for k in range(len(ActiveIndices[j])):   
+                                             
+            Zeros = 0
+            
+            Zeros, Temp = Check(ActiveIndices, [1,0], Zeros, Temp)
+            Zeros, Temp = Check(ActiveIndices, [0,1], Zeros, Temp)
+            Zeros, Temp = Check(ActiveIndices, [-1,0], Zeros, Temp)
+            Zeros, Temp = Check(ActiveIndices, [0,-1], Zeros, Temp)
+            
+            if Zeros >= 2:
+                LayerZeros += 1
+        
+            if len(Temp) > 1000 or k > 1000:
+                i += 1
+                break
+        
+        if len(Temp) == 0:
+            i += 1
+            
+        elif LayerZeros <= len(ActiveIndices[j]):
+            ActiveIndices.append(Temp)
+            j += 1
+        
+        else: 
+            i += 1
+        
+    for layer in ActiveIndices:
+        for pixel in layer:
+            ClusteredData[pixel[0], pixel[1]] = Data[pixel[0], pixel[1]]
+    
+    ClusterDict = {'Active Indices':ActiveIndices, \
+                   'Clustered Array':ClusteredData, \
+                   'Start Index':StartIndex, \
+                   'Threshold Value':Threshold}
+        
+    return ClusterDict
+
+
+
+def LocalMaxIndices(Data, LocalCutoff, Divide):
+    #Expects 2D arrays for Data
+        
+    #--------------------------------------------------------------------
+    # Finds extrema above the LocalCutoff in the regions or Data 
+    # specified by Divide and outputs the corresponding Index and Value
+    #--------------------------------------------------------------------
+    
+    Shape = np.shape(Data)
+    
+    DivX = Divide[0]
+    DivY = Divide[1]
+    
+    IndListX = np.linspace(0, Shape[0], num=DivX).astype(int)
+    IndListY = np.linspace(0, Shape[1], num=DivY).astype(int)
+    
+    Value = []
+    Index = []
+    LayerMaxima = np.max(Data)
+    
+    for j in range(DivX -1):
+        for k in range(DivY - 1):
+            Max = np.max(Data[IndListX[j]:IndListX[j+1],IndListY[k]:IndListY[k+1]])  
+            
+            if  LayerMaxima * LocalCutoff: #Max > LocalCutoff: #
+#                Temp = []
+#                for l in range(len(np.where(Data[IndListX[j]:IndListX[j+1],IndListY[k]:IndListY[k+1]] == Max)[0])): 
+#                    TempInd = [IndListX[j] + np.where(Data[IndListX[j]:IndListX[j+1],IndListY[k]:IndListY[k+1]] == Max)[0][l], \
+#                               IndListY[k] + np.where(Data[IndListX[j]:IndListX[j+1],IndListY[k]:IndListY[k+1]] == Max)[1][l]] 
+#                                                                                                    
+#                    if not TempInd in Temp:
+#                        Temp.append(TempInd) 
+        
+                #only take first maxima in the region
+                
+                Temp = [IndListX[j] + np.where(Data[IndListX[j]:IndListX[j+1],IndListY[k]:IndListY[k+1]] == Max)[0][0], \
+                        IndListY[k] + np.where(Data[IndListX[j]:IndListX[j+1],IndListY[k]:IndListY[k+1]] == Max)[1][0]]
+        
+                Value.append(Max)
+                Index.append(Temp)
+    
+    return Value, Index
+
+
+
+def ClusterMaxima(Data, Value, Index, PercentCutoff):
+    #Expects 2D array
+    
+    #--------------------------------------------------------------------
+    # Runs the ClusterAlgorithm at each element of Index and provided the 
+    # results have more than five nonzero pixels, then combines them to  
+    # form one image
+    #--------------------------------------------------------------------
+    
+    AllClusters = []
+    Area = []
+    ActiveIndices = []
+    
+    LayerMaxima = np.max(Data)
+    
+    for i in range(len(Index)):
+        
+        for l in range(len(Index[i])):
+            Dict = ClusterAlgorithm(Data, LayerMaxima*PercentCutoff, [Index[i][l][0],Index[i][l][1]]) 
+            
+            if np.count_nonzero(Dict['Clustered Array']) > 5: # Requires two full layers of clustered Pixels 
+                AllClusters.append(Dict['Clustered Array']) # ( 1 start pixel + 4 adjacent to it) to be considered significant
+                n = np.count_nonzero(AllClusters)
+                
+                for layer in Dict['Active Indices']:
+                    for ind in layer:
+                        if not ind in ActiveIndices and len(Dict['Active Indices']) > 1:
+                            ActiveIndices.append(ind)
+                
+                Area.append(n)
+        
+    AllClusters = np.transpose(AllClusters)
+    
+    Shape = np.shape(Data)
+    
+    Maximized = np.zeros((Shape[1],Shape[0]))
+    
+    if len(AllClusters) != 0:
+        for k in range(Shape[0]):
+            for l in range(Shape[1]):  
+                Maximized[k][l] = np.max(AllClusters[k][l]) 
+                    
+    Maximized = np.transpose(Maximized) 
+    
+    LayerDict = {'Active Indices':ActiveIndices, \
+                 'Clustered Array':Maximized, \
+                 'Start Value':Value, \
+                 'Start Index':Index, \
+                 'Area':Area}
+    
+    return LayerDict
+
+
+
+def ClusteredHittingPoints(RowData, ClusterIndices, Layer, Seperation):  
+    #Expects ClusterDict['Active Indices'] for Indices
+    #Layer corresponds to the image layer used to create ClusterIndices
+
+    #-----------------------------------------------------------------
+    # Determines hitting points of trajectories that go through the 
+    # clustered image
+    #-----------------------------------------------------------------
+
+    begin_time = datetime.datetime.now()
+    
+    N = RowData['NumberOfEvents']
+    
+    Pos = RowData['DetectorPos'] #[cm]
+    
+#    IndexList = []
+#    for i in range(len(ClusterIndices)): 
+#        if Which == False:
+#            IndexList.append(ClusterIndices[i])
+#    
+#        else:
+#            for j in range(len(ClusterIndices[i])):
+#                IndexList.append(ClusterIndices[i][j])
+        
+    PixelHits = []
+    PixelIndex = []
+    
+    for k in range(N-1):  
+        ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + Layer * TopDepth / ProjectionPixel[2]
+        
+        HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, RowData['DetectorPos'], Seperation)
+#        HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, [0,0], Seperation)
+        
+#        print("Hitting points are: ",HittingPoints)
+        
+        if np.all(HittingPoints == -9999):
+            continue
+
+        else:
+#            Iind = int(round((HittingPoints[0][0] + ImageVolume[0]/2 )*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
+#            Jind = int(round((HittingPoints[0][1] + ImageVolume[0]/2 )*(ProjectionPixel[1]-1)/ImageLayerSize[1])) 
+            Iind = int(round((HittingPoints[0][0] - Pos[0] + ImageLayerSize[0]/2)*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
+            Jind = int(round((HittingPoints[0][1] - Pos[1] + ImageLayerSize[0]/2)*(ProjectionPixel[1]-1)/ImageLayerSize[1])) 
+
+
+#        if [Iind,Jind] in IndexList and Iind > 0 and Jind > 0:
+        if (Iind,Jind) in ClusterIndices and Iind > 0 and Jind > 0:
+            PixelIndex.append([Iind,Jind]) 
+            PixelHits.append([HittingPoints]) # + [RowData['DetectorPos'][0],RowData['DetectorPos'][1],0]])
+            
+            ##### use hitting points rotate and return thos instead
+            '''
+            y = lowest hitting point
+            y' = highest hitting point
+            x = y' - y # so traj is line segment through the origin
+            x' = R x # rotate the line segment according to detector orientation
+            x'' = x' + y # translate it back to original position
+            
+            x'' and y together give the track for the muon
+            
+            '''
+            
+            
+    
+    tictoc = datetime.datetime.now() - begin_time
+    print('It took ', tictoc,' to track the data')
+
+    return PixelHits 
+
+
+
+def ObjectView(Data, Resolution, ObjectZ, ImageVolume, Seperation):
+    
+    #-----------------------------------------------------------------
+    # Takes Data hitting points and counts hits in the ImageVolume at 
+    # ObjectZ above the detector with resolution Resolution
+    #-----------------------------------------------------------------
+    
+    DetectorCounts = np.zeros((Resolution[0],Resolution[1],Resolution[2]))
+    
+    for i in range(len(Data)):
+        AbsXUp = Data[i][0][2][0]
+        AbsYUp = Data[i][0][2][1]  
+        AbsXDown = Data[i][0][1][0]
+        AbsYDown = Data[i][0][1][1]
+        
+        ZUp = Data[i][0][2][2]             
+        ZDown = Data[i][0][1][2]
+        dZ = ZUp - ZDown
+        
+        if dZ == 0:
+            continue                    
+        
+        dX = AbsXUp - AbsXDown     
+        ax = dZ / dX                           
+        bx = ZUp - ax * AbsXUp         
+        
+        dY = AbsYUp - AbsYDown
+        ay = dZ / dY
+        by = ZUp - ay * AbsYUp
+        
+        for j in range(Resolution[2]):
+            ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + ObjectZ + j*ImageVolume[2]/Resolution[2]
+            
+            HittingPoints = np.zeros(3)
+            
+            HittingPoints[0] = (ZImage - bx) / ax #XImage  
+            HittingPoints[1] = (ZImage - by) / ay #YImage
+            HittingPoints[2] = ZImage #ZImage
+            
+            Iind = int(round((HittingPoints[0] + ImageVolume[0]/2)*(Resolution[0]-1)/ImageVolume[0]))
+            Jind = int(round((HittingPoints[1] + ImageVolume[1]/2)*(Resolution[1]-1)/ImageVolume[1]))
+#            Iind = int(round((HittingPoints[0] + ImageLayerSize[0]/2)*(Resolution[0]-1)/ImageLayerSize[0]))
+#            Jind = int(round((HittingPoints[1] + ImageLayerSize[1]/2)*(Resolution[1]-1)/ImageLayerSize[1]))
+#            Iind = int(round((HittingPoints[0])*(Resolution[0]-1)/ImageLayerSize[0]))
+#            Jind = int(round((HittingPoints[1])*(Resolution[1]-1)/ImageLayerSize[1]))
+        
+            if Iind > 0 and Jind > 0 and Iind < len(DetectorCounts[0]) and Jind < len(DetectorCounts[1]):
+                DetectorCounts[Iind][Jind][j] += 1
+                    
+    return DetectorCounts 
+
+
+
+def GroupOverlaps(Data):
+    #Expects 4D array for Data
+    
+    #--------------------------------------------------------------------
+    # Checks to see if each pair of object data arrays overlap by seeing 
+    # if subtracting one from the other changes any of the values in the 
+    # first array.  
+    # Then forms groups of overlapping sets of data (each of which is 
+    # interpretted as an object)
+    #--------------------------------------------------------------------
+    
+    Data = np.array(Data)       
+           
+    N = len(Data)
+    OverlapLists = []
+    
+    for i in range(N):
+        for j in range(N):
+            if i != j: 
+                Minus = (Data[i] - Data[j])
+                Minus[Minus < 0] = 0 # sets negative pixels to zero
+    
+                if np.any(Data[i] != Minus):
+                    OverlapLists.append([i,j])    
+    
+    ObjectGroups = []
+    
+    for i in range(len(OverlapLists)):
+        if len(ObjectGroups) == 0:
+            ObjectGroups.append([OverlapLists[i][0],OverlapLists[i][1]])
+    
+        Appended = 0 #Used to keep track of whether element is already in ObjectGroups across if gates
+    
+        for j in range(len(ObjectGroups)):
+            if not OverlapLists[i][0] in ObjectGroups[j]:
+                if OverlapLists[i][1] in ObjectGroups[j]:
+                    ObjectGroups[j].append(OverlapLists[i][0])
+                    Appended += 1                
+    
+            elif not OverlapLists[i][1] in ObjectGroups[j]:
+                if OverlapLists[i][0] in ObjectGroups[j]:
+                    ObjectGroups[j].append(OverlapLists[i][1])
+                    Appended += 1
+            
+            if OverlapLists[i][0] in ObjectGroups[j]:
+                if OverlapLists[i][1] in ObjectGroups[j]:
+                    Appended += 1
+                    
+        if Appended == 0:
+            ObjectGroups.append([OverlapLists[i][0],OverlapLists[i][1]])
+            
+    return ObjectGroups, OverlapLists
+
+
+
+def ScaleGroups(Counts, Groups, Maxima, OverlapCutoff):
+    
+    #--------------------------------------------------------------------
+    # Scales all beams identically so regions of interference can be            
+    # identified and decides whether pairs of 3D arrays overlap to 
+    # create Target. Removes the need for the classification algorithm 
+    # with this step.
+    #--------------------------------------------------------------------
+    
+    DetectorCounts = np.zeros((len(Groups),ProjectionPixel[0],ProjectionPixel[1],ProjectionPixel[2]))
+    AddedMaxima = []
+    Targets = np.zeros((len(Groups),ProjectionPixel[2]))
+    
+    for i in range(len(Groups)):
+        Temp = []
+        
+        for j in Groups[i]: # Decides how many pairs of beams overlap at each layer by permuting them within their groups
+            for k in Groups[i]:
+                if j != k: 
+                    for m in range(ProjectionPixel[2]):
+                        Minus = (Counts[j,:,:,m] - Counts[k,:,:,m])
+                        Minus[Minus < 0] = 0
+            
+                        #if np.any(Counts[j,:,:,m] != Minus):
+                        if abs(np.sum(Counts[j,:,:,m] - Minus)) > np.max(Counts[j,:,:,m]) * OverlapCutoff: 
+                            Targets[i,m] += 1
+                        
+                        else:
+                            Targets[i,m] += 2
+                        
+            if Maxima[j] != 0 and not Maxima[j] in Temp: # assumes that if maxima are the same then clustered array is a duplicate
+                ScaledData = Counts[j] * np.max(Maxima)/Maxima[j] 
+            
+                DetectorCounts[i] += ScaledData
+    
+                Temp.append(Maxima[j])
+        
+        AddedMaxima.append(Temp)
+        
+    return DetectorCounts, AddedMaxima, Targets
+
+
+
+def ScaleLayers(Counts, Scale):
+    
+    if Scale == True:
+        Shape = np.shape(Counts)
+        TempCounts = np.zeros(Shape)
+        '''
+        Counts[Counts > 0] = 100
+        
+        TempCounts = Counts
+        '''
+        for i in range(Shape[0]):
+            Max = np.max(Counts[i])
+            
+            for j in range(ProjectionPixel[2]):
+                    TempCounts[i,:,:,j] = Counts[i,:,:,j] * Max / np.max(Counts[i,:,:,j]) if np.max(Counts[i,:,:,j]) != 0 \
+                                                                                        else Counts[i,:,:,j]
+
+    else:
+        TempCounts = Counts
+    
+    return TempCounts
+
+
+
+def AnalyseData(ReadDict):   
+    
+    HittingData = []
+    ClusterList = []
+    
+    ValueList = []
+    IndexList = []
+    ObjectCounts = []
+    ObjectMax = []
+    #LayerDictList = []
+    ClusteredPixels = []
+    
+    '''
+    Shouldn't we just cluster object counts? 
+    Ie. cluster after they have been interfered
+    '''
+    
+    for i in range(len(ReadDict['Row Sky List'])):
+
+        TempHittingData = []
+        TempClusterList = []
+        TempObjectCounts = []
+        TempObjectMax = []
+        
+        
+        Value, Index = LocalMaxIndices(ReadDict['Subtracted Count List'][i], LocalCutoff, Divide)
+
+        ValueList.append(Value)
+        IndexList.append(Index)
+        
+        Clustered_pixels = set()
+        
+#        print("Max values shape is: ",np.shape(Value))
+#        print("Max values are: ",Value)
+        # print("Max indices shape is: ",np.shape(Index))
+        # print("Max indices are: ",Index)
+
+        for j in range(len(Value)): # Clusters each of the extrema in the List of local extrema (Indices / Values)
+            Max = np.max(Value)
+            
+#            print("Current array index:",i)
+#            print("Current indices ",[Index[j][0],Index[j][1]])
+#            print("clustered pixels are ",Clustered_pixels)
+            
+            if (Index[j][0],Index[j][1]) in Clustered_pixels:
+                continue # this region has already been clustered
+            
+            ClusterDict = ClusterAlgorithm(ReadDict['Subtracted Count List'][i][:,:], PercentCutoff * Max, [Index[j][0],Index[j][1]])
+            
+            if np.count_nonzero(ClusterDict['Clustered Array']) > 5:
+            # just did this
+                for lists in ClusterDict['Active Indices']:
+                    for indices in lists:
+                        Clustered_pixels.add(tuple(indices))
+                
+                
+#                print("Active indices shape is: ",np.shape(ClusterDict['Active Indices']))
+#                print("Active indices are: ",ClusterDict['Active Indices'])
+                
+#                PlotQuick(ClusterDict['Clustered Array'],False)
+        
+#                if dense:
+#                    PixelHits = ClusteredHittingPoints(ReadDict['Row Real List'][i], ClusterDict['Active Indices'], ClusterLayer, ReadDict['Seperations'][i])
+                
+#                else: 
+                
+#                print("Test")
+                
+#                PixelHits = ClusteredHittingPoints(ReadDict['Row Sky List'][i], ClusterDict['Active Indices'], ClusterLayer, ReadDict['Seperations'][i])
+                
+#                TempCounts = ObjectView(PixelHits, ProjectionPixel, ObjectZ, ImageVolume, ReadDict['Seperations'][i])
+        
+#                TempHittingData.append(PixelHits)       
+#                TempObjectCounts.append(TempCounts)
+#                TempObjectMax.append(np.max(TempCounts))
+                TempClusterList.append(ClusterDict)
+                
+        ClusteredPixels.append(Clustered_pixels)
+        
+        HittingData.append(TempHittingData)
+        ClusterList.append(TempClusterList)
+        ObjectCounts.append(TempObjectCounts)
+        ObjectMax.append(TempObjectMax)
+        
+        
+        
+#    ObjectCounts = np.array(ObjectCounts)
+#    
+#    ObjectCounts = ScaleLayers(ObjectCounts, True)
+#    
+#    ObjectGroups, OverlapLists = GroupOverlaps(ObjectCounts)          
+#    
+#    DetectorCounts, AddedMaxima, Targets = ScaleGroups(ObjectCounts, ObjectGroups, ObjectMax, OverlapCutoff) # Scales the array from each beam identically and  
+#                                                                                                             # creates Target without need for the classifier                                                                                            
+#                    
+    AnalysisDict = {'Hitting Data':HittingData, \
+                    'Cluster Dict List':ClusterList, \
+#                    'Detector Counts':DetectorCounts, \
+#                    'Targets':Targets, \
+#                    'Object Counts':ObjectCounts, \
+#                    'Object Groups':ObjectGroups, \
+                    'Cluster Indices':IndexList, \
+                    'Cluster Values':ValueList, \
+                    'All Indices':ClusteredPixels}
+    
+    return AnalysisDict
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Runs the independent per-detector stages of the view -> analyse
+# pipeline in worker processes, and caches the result of each stage
+# under a hash of its inputs
+#--------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from joblib import hash as JoblibHash
+import ThreeD_Tracking as td
+import Profiling
+import Pyramid
+import Reconstruction
+import SubVolumes
+import Store
+
+
+_Shared = None # read-only inputs of the running ParallelMap, set in each worker
+
+
+
+def _InitWorker(Shared):
+    global _Shared
+    _Shared = Shared
+
+
+
+def _Call(Function, i, Profile=False):
+    if not Profile:
+        return Function(_Shared, i)
+
+    # stages timed in the worker are sent back to be merged into the caller's report
+    Profiling.Enable()
+    Result = Function(_Shared, i)
+    Profiling.Disable()
+
+    return Result, Profiling.Stages()
+
+
+
+def ParallelMap(Function, Count, Shared, Workers=None):
+
+    #--------------------------------------------------------------------
+    # Returns [Function(Shared, i) for i in range(Count)], computed by up
+    # to Workers processes (all cores if None, in this process if 1).
+    # Shared holds the read-only inputs and is given to each worker once,
+    # forked workers inherit it without copying. Function must be defined
+    # at the top level of a module. While Profiling is enabled the stages
+    # timed in the workers are added to the caller's report
+    #--------------------------------------------------------------------
+
+    global _Shared
+
+    Workers = min(Workers or os.cpu_count() or 1, Count)
+
+    if Workers <= 1:
+        return [Function(Shared, i) for i in range(Count)]
+
+    Context = multiprocessing.get_context()
+    Fork = Context.get_start_method() == 'fork'
+
+    _Shared = Shared
+
+    try:
+        with ProcessPoolExecutor(Workers, mp_context=Context, initializer=None if Fork else _InitWorker,
+                                 initargs=() if Fork else (Shared,)) as Pool:
+            Results = list(Pool.map(_Call, [Function] * Count, range(Count), [Profiling.Enabled] * Count))
+
+    finally:
+        _Shared = None
+
+    if Profiling.Enabled:
+        for Result, Recorded in Results:
+            Profiling.Merge(Recorded)
+
+        Results = [Result for Result, Recorded in Results]
+
+    return Results
+
+
+
+# -------------------------- Per-Detector Stages -----------------------------------------
+
+
+
+def ReadDetector(Shared, i):
+
+    #--------------------------------------------------------------------
+    # Reads the sky and real RowData files of detector i and counts them
+    # with PazAnalysis (the per-detector part of ReadDataFiles)
+    #--------------------------------------------------------------------
+
+    Config = Shared['Config']
+    Position = Shared['Positions'][i]
+
+    RDSky = td.ReadRowDataFileFastest(Shared['Sky Files'][i], Position)
+    RDReal = td.ReadRowDataFileFastest(Shared['Real Files'][i], Position)
+
+    DCS = td.PazAnalysis(RDSky, Shared['Seperations'][i], Config.Iterate, Config)
+    DCR = td.PazAnalysis(RDReal, Shared['Seperations'][i], Config.Iterate, Config)
+
+    return RDSky, RDReal, DCS, DCR
+
+
+
+def HittingDetector(Shared, i):
+
+    #--------------------------------------------------------------------
+    # Hitting points of the sky trajectories through the clustered pixels
+    # of detector i (the per-detector part of analyse.py), moved to its
+    # pose if Shared['Poses'] is given
+    #--------------------------------------------------------------------
+
+    Config = Shared['Config']
+    DetectorPose = Shared['Poses'][i] if Shared.get('Poses') else None
+
+    return td.ClusteredHittingPoints(Shared['Row Sky List'][i], Shared['All Indices'][i], Config.ClusterLayer, Shared['Seperations'][i], Config, DetectorPose, i)
+
+
+
+def ObjectViewDetector(Shared, i):
+    # ObjectView counts of the hitting points of detector i
+    Config = Shared['Config']
+
+    return td.ObjectView(Shared['Hitting Data'][i], Config.ProjectionPixel, Config.ObjectZ, Config.ImageVolume, Shared['Seperations'][i], Config)
+
+
+
+def DetectorHits(ReadDict, AnalyseDict, Config=None, Workers=None, Poses=None):
+    # HittingDetector for every detector, in order, with the Pose.DetectorPose of each detector if Poses is given
+    Shared = {'Row Sky List':ReadDict['Row Sky List'], \
+              'All Indices':AnalyseDict['All Indices'], \
+              'Seperations':ReadDict['Seperations'], \
+              'Poses':Poses, \
+              'Config':td.GetConfig(Config)}
+
+    return ParallelMap(HittingDetector, len(AnalyseDict['All Indices']), Shared, Workers)
+
+
+
+def DetectorObjectViews(HittingData, Seperations, Config=None, Workers=None):
+    # ObjectViewDetector for every detector, in order
+    Shared = {'Hitting Data':HittingData, \
+              'Seperations':Seperations, \
+              'Config':td.GetConfig(Config)}
+
+    return ParallelMap(ObjectViewDetector, len(HittingData), Shared, Workers)
+
+
+
+def GroupObjects(ObjectViews, Config=None):
+
+    #--------------------------------------------------------------------
+    # Scales the ObjectView counts of each detector, groups the detectors
+    # whose counts overlap and combines each group (the grouping stage of
+    # analyse.py)
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    ObjectMax = [SubVolumes.Maximum(Counts) for Counts in ObjectViews]
+
+    if len(ObjectViews) and SubVolumes.IsSubVolume(ObjectViews[0]): # cropped ObjectViews (Config.Crop)
+        ObjectCounts = SubVolumes.ScaleLayers(ObjectViews)
+        ObjectGroups, OverlapLists = SubVolumes.GroupOverlaps(ObjectCounts)
+        DetectorCounts, AddedMaxima, Targets = SubVolumes.ScaleGroups(ObjectCounts, ObjectGroups, ObjectMax, Config.OverlapCutoff, Config)
+
+    else:
+        ObjectCounts = td.ScaleLayers(np.array(ObjectViews), True, Config)
+        ObjectGroups, OverlapLists = Pyramid.GroupOverlaps(ObjectCounts, Config.PyramidLevel) if Config.PyramidLevel > 0 else td.GroupOverlaps(ObjectCounts)
+        DetectorCounts, AddedMaxima, Targets = td.ScaleGroups(ObjectCounts, ObjectGroups, ObjectMax, Config.OverlapCutoff, Config) # Scales the array from each beam identically and
+                                                                                                                                   # creates Target without need for the classifier
+    GroupDict = {'Object Counts':ObjectCounts, \
+                 'Object Groups':ObjectGroups, \
+                 'Overlap Lists':OverlapLists, \
+                 'Detector Counts':DetectorCounts, \
+                 'Added Maxima':AddedMaxima, \
+                 'Targets':Targets}
+
+    return GroupDict
+
+
+
+def VolumeObjects(DetectorCounts, Config=None):
+
+    #--------------------------------------------------------------------
+    # td.ClusterVolume objects of each group's Detector Counts (full or
+    # sub-volumes), grown from voxels above LocalCutoff3D of the group's
+    # maximum down to PercentCutoff3D of it, with indices into the full
+    # volume
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    ObjectList = []
+
+    for Counts in DetectorCounts:
+        Offset = np.zeros(3, dtype=np.int64)
+
+        if SubVolumes.IsSubVolume(Counts):
+            Offset = np.array(Counts['Offset'])
+            Counts = Counts['Counts']
+
+        Max = SubVolumes.Maximum(Counts)
+        Objects = td.ClusterVolume(Counts, Max * Config.PercentCutoff3D, Max * Config.LocalCutoff3D, Config.Connectivity, 6)[1] if Max > 0 else []
+
+        for Object in Objects:
+            Object['Voxels'] = Object['Voxels'] + Offset
+            Object['Box'] = (tuple(int(First) for First in np.add(Object['Box'][0], Offset)), Object['Box'][1])
+            Object['Peak Index'] = tuple(int(i) for i in np.add(Object['Peak Index'], Offset))
+            Object['Centroid'] = Object['Centroid'] + Offset
+
+        ObjectList.append(Objects)
+
+    return ObjectList
+
+
+
+def ClusterImages(ReadDict, AnalyseDict):
+    # Subtracted counts of each detector at its clustered pixels only
+    ClusteredList = []
+
+    for i in range(len(AnalyseDict['All Indices'])):
+        ClusteredArray = np.zeros(np.shape(ReadDict['Subtracted Count List'][i]))
+
+        for ind_tup in AnalyseDict['All Indices'][i]:
+            ClusteredArray[ind_tup[0],ind_tup[1]] += \
+                ReadDict['Subtracted Count List'][i][ind_tup[0],ind_tup[1]]
+
+        ClusteredList.append(ClusteredArray)
+
+    return ClusteredList
+
+
+
+def AnalyseStages(Cache, ReadDict, ReadKey, Config=None, Workers=None, Cut=3, Poses=None):
+
+    #--------------------------------------------------------------------
+    # Runs the stages of analyse.py after ReadDict (whose cache key is
+    # ReadKey) through Cache and returns the AnalyseDict. Object Cuts keeps
+    # the voxels seen by at least Cut detectors. Poses (a Pose.DetectorPose
+    # per detector) rotates each detector's hitting points
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    AnalyseDict, ClusterKey = Cache.Run('Cluster', td.AnalyseData, Config, [ReadKey], ReadDict, Config)
+
+    HittingInputs = [ReadKey, ClusterKey] + ([Poses] if Poses else [])
+
+    HittingData, HittingKey = Cache.Run('Hitting', DetectorHits, Config, HittingInputs, ReadDict, AnalyseDict, Config, Workers, Poses)
+    ObjectViews, ObjectKey = Cache.Run('ObjectView', DetectorObjectViews, Config, [ReadKey, HittingKey], HittingData, ReadDict['Seperations'], Config, Workers)
+
+    GroupDict, GroupKey = Cache.Run('Groups', GroupObjects, Config, [ObjectKey], ObjectViews, Config)
+
+    ObjectOnes = []
+
+    for Counts in ObjectViews:
+        if SubVolumes.IsSubVolume(Counts):
+            TempOnes = SubVolumes.SubVolume(np.where(Counts['Counts'] > 0, 1.0, Counts['Counts']), Counts['Offset'], Counts['Shape'])
+
+        else:
+            TempOnes = np.copy(Counts)
+            TempOnes[TempOnes > 0] = 1
+
+        ObjectOnes.append(TempOnes)
+
+    ObjectCuts = np.copy(SubVolumes.Total(ObjectOnes))
+    ObjectCuts[ObjectCuts < Cut] = 0
+
+    AnalyseDict['Cluster Images'] = ClusterImages(ReadDict, AnalyseDict)
+    AnalyseDict['Hitting Data'] = list(HittingData)
+    AnalyseDict['Object Counts'] = GroupDict['Object Counts']
+    AnalyseDict['Object Ones'] = ObjectOnes
+    AnalyseDict['Detector Counts'] = GroupDict['Detector Counts']
+    AnalyseDict['Targets'] = GroupDict['Targets']
+    AnalyseDict['Volume Objects'] = VolumeObjects(GroupDict['Detector Counts'], Config)
+    AnalyseDict['Object Groups'] = GroupDict['Object Groups']
+    AnalyseDict['Object Cuts'] = ObjectCuts
+
+    return AnalyseDict
+
+
+
+def ReconstructStages(Cache, ReadDict, ReadKey, Config=None, Method='SIRT', Iterations=50, MinCounts=10, Operators=None, Poses=None):
+
+    #--------------------------------------------------------------------
+    # Builds the SystemMatrix of ReadDict and solves it with Method
+    # through Cache (see Reconstruction.py), so the matrix is only traced
+    # again when the runs or the geometry change. With an OperatorCache
+    # Operators, the saved LayoutSystem of the detectors is used instead.
+    # Poses (a Pose.DetectorPose per detector) turns the tracks or rays
+    # of each detector
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    if Operators is not None:
+        System = Reconstruction.LayoutSystem(ReadDict, Config, Operators, Poses=Poses)
+        SystemKey = [Operators.Key(ReadDict['Row Sky List'][i]['DetectorPos'], ReadDict['Seperations'][i], Config, DetectorPose=Poses[i] if Poses else None) \
+                     for i in range(len(ReadDict['Seperations']))]
+
+    else:
+        SystemInputs = [ReadKey] + ([Poses] if Poses else [])
+
+        System, SystemKey = Cache.Run('System', Reconstruction.SystemMatrix, Config, SystemInputs, ReadDict, Config, 2**12, Poses)
+
+    b, Used = Reconstruction.Measurements(ReadDict, Config, MinCounts)
+
+    Result, ResultKey = Cache.Run('Reconstruct', Reconstruction.Solve, Config, [ReadKey, SystemKey, Method, Iterations, MinCounts], \
+                                  System, b, Used, Config, Method, Iterations)
+
+    return Result
+
+
+
+# ---------------------------------- Stage Cache -----------------------------------------
+
+
+
+Geometry = ('TriggerSize', 'BarWidth', 'BarHight', 'NumOfBars', 'TriggerWidth', 'TopDepth')
+
+StageFields = {'Read':Geometry + ('ImageLayerSize', 'ProjectionPixel', 'ClusterLayer', 'Iterate', 'Projection'),  # ReadDataFiles / PazAnalysis
+               'Cluster':('LocalCutoff', 'PercentCutoff', 'Divide', 'PyramidLevel'),                              # AnalyseData
+               'Hitting':Geometry + ('ImageLayerSize', 'ProjectionPixel', 'ClusterLayer'),                        # ClusteredHittingPoints
+               'ObjectView':Geometry + ('ProjectionPixel', 'ObjectZ', 'ImageVolume', 'Projection', 'Crop'),       # ObjectView
+               'Groups':('ProjectionPixel', 'OverlapCutoff', 'Crop', 'PyramidLevel'),                             # ScaleLayers, GroupOverlaps, ScaleGroups
+               'System':Reconstruction.LayoutFields,                                                              # Reconstruction.SystemMatrix
+               'Reconstruct':('ProjectionPixel', 'ClusterLayer', 'ObjectZ', 'ImageVolume')}                       # Reconstruction.Solve
+
+
+
+class StageCache:
+
+    #--------------------------------------------------------------------
+    # Keeps the result of each pipeline stage in Directory (as a
+    # Store.SaveResults directory) under a hash of the stage name, the
+    # RunConfig fields of StageFields[Stage] and the keys of its inputs,
+    # which are the keys of upstream stages (or FileKey / DirectoryKey of
+    # files read). A stage is only run again when one of these changes,
+    # eg. changing OverlapCutoff only reruns 'Groups'. Enabled=False runs
+    # every stage without reading or writing the cache
+    #--------------------------------------------------------------------
+
+    def __init__(self, Directory='cache', Enabled=True):
+        self.Directory = Directory
+        self.Enabled = Enabled
+        self.Hashes = {} # FileName: (size, mtime, content hash)
+
+        if Enabled:
+            os.makedirs(Directory, exist_ok=True)
+
+            if os.path.isfile(self.HashFile()):
+                with open(self.HashFile()) as File:
+                    self.Hashes = dict((Name, tuple(Value)) for Name, Value in json.load(File).items())
+
+    def HashFile(self):
+        return os.path.join(self.Directory, 'files.json')
+
+    def FileKey(self, FileName):
+
+        #--------------------------------------------------------------------
+        # Hash of the contents of FileName. Hashes are remembered with the
+        # file size and modification time, so unchanged files aren't read
+        #--------------------------------------------------------------------
+
+        Stat = os.stat(FileName)
+        Name = os.path.abspath(FileName)
+
+        if Name in self.Hashes and self.Hashes[Name][:2] == (Stat.st_size, Stat.st_mtime_ns):
+            return self.Hashes[Name][2]
+
+        Hash = hashlib.sha1()
+
+        with open(FileName, 'rb') as File:
+            for Block in iter(lambda: File.read(2**20), b''):
+                Hash.update(Block)
+
+        self.Hashes[Name] = (Stat.st_size, Stat.st_mtime_ns, Hash.hexdigest())
+
+        if self.Enabled:
+            with open(self.HashFile(), 'w') as File:
+                json.dump(self.Hashes, File)
+
+        return Hash.hexdigest()
+
+    def DirectoryKey(self, Directory):
+        # Hash of the names and contents of every file under Directory
+        Keys = []
+
+        for Root, Dirs, Files in sorted(os.walk(Directory)):
+            Dirs.sort()
+
+            for Name in sorted(Files):
+                Keys.append((os.path.relpath(os.path.join(Root, Name), Directory), self.FileKey(os.path.join(Root, Name))))
+
+        return JoblibHash(Keys)
+
+    def Key(self, Stage, Config, Upstream):
+        Config = td.GetConfig(Config)
+
+        return JoblibHash([Stage, [(Name, getattr(Config, Name)) for Name in StageFields[Stage]], list(Upstream)])
+
+    def Run(self, Stage, Function, Config, Upstream, *Args):
+
+        #--------------------------------------------------------------------
+        # Returns (Function(*Args), Key), reading the result from the cache
+        # if this stage has been run with the same Key. Args must be fixed
+        # by Upstream and the StageFields of Config (Workers etc. can vary)
+        #--------------------------------------------------------------------
+
+        Key = self.Key(Stage, Config, Upstream)
+        Path = os.path.join(self.Directory, Stage + '_' + Key)
+
+        with Profiling.Stage(Stage):
+            if self.Enabled and os.path.isfile(os.path.join(Path, Store.IndexName)):
+                print("Using the cached", Stage, "stage", Key)
+                Profiling.Count('Cached')
+
+                Result = Store.ResultStore(Path)
+
+                return (Result['__Result__'] if list(Result) == ['__Result__'] else Result), Key
+
+            Result = Function(*Args)
+
+            if self.Enabled:
+                with Profiling.Stage('Save'):
+                    Store.SaveResults(Result if isinstance(Result, dict) else {'__Result__':Result}, Path)
+
+        return Result, Key
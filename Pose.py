@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Detector poses: where a detector sits (Position [cm], its x, y and the
+# height of its bottom) and how it is turned (Yaw about z, then Pitch
+# about y, then Roll about x, in degrees). Tracks are measured in the
+# detector's own frame, so the hitting points of a turned detector are
+# found by rotating its tracks about the detector and moving them to
+# Position, all tracks at once:
+#
+#     Pose = DetectorPose([500, -500], Yaw=30, Pitch=5)
+#     World = TransformTracks(Points, Pose, RowData['DetectorPos'])
+#
+# ClusteredHittingPoints does this when given a pose. The manufactured
+# beams of AlterHittingPoints (Which) are made in bulk here as well
+#--------------------------------------------------------------------
+
+import numpy as np
+
+
+
+def RotationMatrix(Yaw=0, Pitch=0, Roll=0):
+    # Rotation by Roll about x, then Pitch about y, then Yaw about z [degrees]
+    a, b, c = np.radians([Yaw, Pitch, Roll])
+
+    Rz = np.array([[np.cos(a), -np.sin(a), 0], [np.sin(a), np.cos(a), 0], [0, 0, 1]])
+    Ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    Rx = np.array([[1, 0, 0], [0, np.cos(c), -np.sin(c)], [0, np.sin(c), np.cos(c)]])
+
+    return Rz @ Ry @ Rx
+
+
+
+def DetectorPose(Position, Yaw=0, Pitch=0, Roll=0):
+    # Pose dict of a detector at Position ([x, y] or [x, y, z]) turned by Yaw, Pitch and Roll [degrees]
+    Position = np.zeros(3) + np.append(np.asarray(Position, dtype=float), [0] * (3 - len(Position)))
+
+    Pose = {'Position':Position, \
+            'Angles':(float(Yaw), float(Pitch), float(Roll)), \
+            'Rotation':RotationMatrix(Yaw, Pitch, Roll)}
+
+    return Pose
+
+
+
+def IsTranslation(Pose):
+    # Whether Pose only moves the detector
+    return np.array_equal(Pose['Rotation'], np.eye(3))
+
+
+
+def TransformPoints(Points, Pose):
+    # Points ((..., 3), in the detector frame) in the world frame of Pose, as one matrix product
+    return np.asarray(Points, dtype=float) @ Pose['Rotation'].T + Pose['Position']
+
+
+
+def TransformTracks(Points, Pose, DetectorPos=(0, 0)):
+
+    #--------------------------------------------------------------------
+    # Hitting points ((N, K, 3), eg. [Image, Up, Surf] of HittingArray) of
+    # tracks measured by a detector at DetectorPos, moved to the pose of
+    # the detector: each track (through its first and last points) is
+    # rotated about the detector and moved to Pose['Position'], then
+    # crosses the planes z = Points[:,:,2] again, raised with the detector
+    # by the Position z. Tracks parallel to the planes after rotating give
+    # non finite points
+    #--------------------------------------------------------------------
+
+    Points = np.asarray(Points, dtype=float)
+    Origin = np.array([DetectorPos[0], DetectorPos[1], 0.0])
+
+    if IsTranslation(Pose):
+        return Points - Origin + Pose['Position']
+
+    First = TransformPoints(Points[:,0] - Origin, Pose)
+    Last = TransformPoints(Points[:,-1] - Origin, Pose)
+    Delta = Last - First
+
+    Z = Points[:,:,2] + Pose['Position'][2] # as the translation above
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (Z - First[:,None,2]) / Delta[:,None,2]
+
+    Moved = First[:,None] + t[:,:,None] * Delta[:,None]
+    Moved[:,:,2] = Z
+
+    return Moved
+
+
+
+# ---------------------------------- Manufactured beams -----------------------------------------
+
+
+
+# [Up, Surf] offsets [cm] and colour of the beams made from one detector's tracks
+# for each element of Which (artificial interference data, 2 detectors 4 objects)
+ManufacturedTilts = [[([[500,0],[-1100,500]], 'y'), ([[-500,0],[-700,500]], 'b')],
+                     [([[500,0],[-1100,-500]], 'y'), ([[-500,0],[-700,-500]], 'b')],
+                     [([[500,0],[0,0]], 'y'), ([[-500,0],[900,0]], 'b')],
+                     [([[500,0],[0,-900]], 'y'), ([[-500,0],[900,-900]], 'b')]]
+
+
+
+def TiltTracks(Points, Tilt):
+    # [Up, Surf] segments ((N, 2, 3)) of hitting points Points with their ends moved by Tilt ([[dx, dy] at Up, [dx, dy] at Surf])
+    Segments = np.array(np.asarray(Points, dtype=float)[:,1:3])
+    Segments[:,:,:2] += np.asarray(Tilt, dtype=float)[None]
+
+    return Segments
+
+
+
+def ManufacturedBeams(Points, Which):
+
+    #--------------------------------------------------------------------
+    # Manufactured beams of the hitting points Points for the elements
+    # of Which set to 1, as a list of (segments, colour) with the segments
+    # of every track at once (see TiltTracks), in the order
+    # AlterHittingPoints made them
+    #--------------------------------------------------------------------
+
+    Beams = []
+
+    for k in range(len(ManufacturedTilts)):
+        if Which[k] == 1:
+            Beams += [(TiltTracks(Points, Tilt), Colour) for Tilt, Colour in ManufacturedTilts[k]]
+
+    return Beams
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Stage timers and counters for finding where a run spends its time.
+# Functions mark their work with
+#
+#     with Profiling.Stage('PazAnalysis'):
+#         ...
+#         Profiling.Count('Events', len(Lines))
+#
+# which does nothing until Enable() is called. Once enabled, stages nest
+# (a stage entered inside another is recorded as its child), repeated
+# stages are summed, and Report() returns the tree with the wall time,
+# calls, counters and rates of each stage, plus the cProfile functions
+# and tracemalloc peaks if those were asked for:
+#
+#     Profiling.Enable(Functions=True, Memory=True)
+#     ...
+#     Profiling.SaveReport('profile.json')
+#
+# Long loops over events also report their progress (events done,
+# events/s, ETA, rejected events) to the callback set with SetProgress,
+# at most once per interval, eg. SetProgress(PrintProgress) on the
+# command line or a function updating a widget in a notebook
+#--------------------------------------------------------------------
+
+import sys
+import time
+import json
+import datetime
+import platform
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import nullcontext
+
+
+Enabled = False
+Verbose = False # print each stage's time as it ends
+
+_Root = None
+_Stack = [] # open stages, innermost last
+_Profiler = None
+_Memory = False
+_Started = None
+_Begin = None
+
+_Off = nullcontext() # returned by Stage while disabled
+
+
+
+def _Node(Name):
+    return {'Name':Name, 'Calls':0, 'Seconds':0.0, 'Counters':{}, 'Stages':{}}
+
+
+
+class _Timer:
+
+    #--------------------------------------------------------------------
+    # One entry of a stage. Peak memory is measured by resetting the
+    # tracemalloc peak on entry and carrying the larger of the inner and
+    # outer peaks back to the enclosing stage on exit
+    #--------------------------------------------------------------------
+
+    __slots__ = ('Name', 'Node', 'Begin', 'Carry')
+
+    def __init__(self, Name):
+        self.Name = Name
+
+    def __enter__(self):
+        Children = _Stack[-1].Node['Stages']
+
+        if self.Name not in Children:
+            Children[self.Name] = _Node(self.Name)
+
+        self.Node = Children[self.Name]
+        self.Carry = 0
+
+        if _Memory:
+            _Stack[-1].Carry = max(_Stack[-1].Carry, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        _Stack.append(self)
+        self.Begin = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *Exception):
+        Seconds = time.perf_counter() - self.Begin
+
+        _Stack.pop()
+
+        self.Node['Calls'] += 1
+        self.Node['Seconds'] += Seconds
+
+        if _Memory:
+            Peak = max(self.Carry, tracemalloc.get_traced_memory()[1])
+            self.Node['Peak MB'] = max(self.Node.get('Peak MB', 0.0), Peak / 2**20)
+            _Stack[-1].Carry = max(_Stack[-1].Carry, Peak)
+
+        if Verbose:
+            print('It took {:.3f} s to run {}'.format(Seconds, self.Name))
+
+        return False
+
+
+
+class _RootTimer:
+    __slots__ = ('Node', 'Carry')
+
+    def __init__(self, Node):
+        self.Node = Node
+        self.Carry = 0
+
+
+
+def Stage(Name):
+    # Context manager timing Name as a child of the open stage (a shared no-op while disabled)
+    if not Enabled:
+        return _Off
+
+    return _Timer(Name)
+
+
+
+def Count(Name, Value=1):
+    # Adds Value to the counter Name of the open stage
+    if Enabled:
+        Counters = _Stack[-1].Node['Counters']
+        Counters[Name] = Counters.get(Name, 0) + Value
+
+
+
+def Enable(Functions=False, Memory=False, Print=False):
+
+    #--------------------------------------------------------------------
+    # Starts a new report. Functions also runs cProfile, Memory traces
+    # allocations with tracemalloc for the peak memory of each stage
+    # (both slow the run down noticeably), Print prints the time of each
+    # stage as it ends
+    #--------------------------------------------------------------------
+
+    global Enabled, Verbose, _Root, _Stack, _Profiler, _Memory, _Started, _Begin
+
+    Disable()
+
+    _Root = _Node('Run')
+    _Stack = [_RootTimer(_Root)]
+    _Memory = Memory
+    _Profiler = None
+    _Started = datetime.datetime.now().isoformat(timespec='seconds')
+
+    Verbose = Print
+
+    if Memory:
+        tracemalloc.start()
+
+    if Functions:
+        _Profiler = cProfile.Profile()
+        _Profiler.enable()
+
+    Enabled = True
+    _Begin = time.perf_counter()
+
+
+
+def Disable():
+    # Stops recording, the report so far is kept for Report()
+    global Enabled
+
+    if not Enabled:
+        return
+
+    Enabled = False
+
+    _Root['Seconds'] = time.perf_counter() - _Begin
+
+    if _Profiler is not None:
+        _Profiler.disable()
+
+    if _Memory:
+        _Root['Peak MB'] = max(_Stack[0].Carry, tracemalloc.get_traced_memory()[1]) / 2**20
+        tracemalloc.stop()
+
+
+
+def Stages():
+    # Stage tree recorded so far (e.g. by a worker process, for Merge)
+    return _Root['Stages'] if _Root is not None else {}
+
+
+
+def Merge(Recorded):
+    # Adds the stages Recorded by another process as children of the open stage
+    if Enabled:
+        _MergeInto(_Stack[-1].Node['Stages'], Recorded)
+
+
+
+def _MergeInto(Into, Recorded):
+    for Name, Node in Recorded.items():
+        Target = Into.setdefault(Name, _Node(Name))
+
+        Target['Calls'] += Node['Calls']
+        Target['Seconds'] += Node['Seconds']
+
+        for Counter, Value in Node['Counters'].items():
+            Target['Counters'][Counter] = Target['Counters'].get(Counter, 0) + Value
+
+        if 'Peak MB' in Node:
+            Target['Peak MB'] = max(Target.get('Peak MB', 0.0), Node['Peak MB'])
+
+        _MergeInto(Target['Stages'], Node['Stages'])
+
+
+
+# ---------------------------------- Report -----------------------------------------
+
+
+
+def _Listed(Node):
+    # Node with its children as a list and the rate of each counter
+    Listed = {Key:Value for Key, Value in Node.items() if Key != 'Stages'}
+
+    Listed['Rates'] = {Counter + '/s':Value / Node['Seconds'] for Counter, Value in Node['Counters'].items() if Node['Seconds'] > 0}
+    Listed['Stages'] = [_Listed(Child) for Child in Node['Stages'].values()]
+
+    return Listed
+
+
+
+def Report(Functions=30):
+
+    #--------------------------------------------------------------------
+    # The recorded run as a JSON-ready dict: the stage tree and, if they
+    # were enabled, the Functions slowest functions by cumulative time
+    # and the peak traced memory. Call after Disable() for the totals
+    # of the whole run
+    #--------------------------------------------------------------------
+
+    if _Root is None:
+        return {}
+
+    Result = {'Started':_Started, \
+              'Python':platform.python_version(), \
+              'Seconds':_Root['Seconds'] if not Enabled else time.perf_counter() - _Begin, \
+              'Stages':_Listed(_Root)['Stages']}
+
+    if 'Peak MB' in _Root:
+        Result['Peak MB'] = _Root['Peak MB']
+
+    if _Profiler is not None:
+        Stats = pstats.Stats(_Profiler)
+        Rows = sorted(Stats.stats.items(), key=lambda Item: Item[1][3], reverse=True)[:Functions]
+
+        Result['Functions'] = [{'Function':'{}:{}({})'.format(*Key), \
+                                'Calls':Value[1], \
+                                'Own Seconds':Value[2], \
+                                'Cumulative Seconds':Value[3]} for Key, Value in Rows]
+
+    return Result
+
+
+
+def SaveReport(FileName, Functions=30):
+    # Disables profiling and writes Report() to FileName
+    Disable()
+
+    with open(FileName, 'w') as File:
+        json.dump(Report(Functions), File, indent=1)
+
+
+
+def PrintReport(Recorded=None, Depth=0):
+    # Indented table of the stage tree of a Report()
+    Recorded = Report() if Recorded is None else Recorded
+
+    if Depth == 0:
+        print('\n{:<40}{:>8}{:>12}{:>14}'.format('Stage', 'Calls', 'Seconds', 'Events/s'))
+
+    for Node in Recorded['Stages']:
+        Rate = Node['Rates'].get('Events/s')
+        print('{:<40}{:>8d}{:>12.3f}'.format('  ' * Depth + Node['Name'], Node['Calls'], Node['Seconds']) + \
+              ('{:>14.4g}'.format(Rate) if Rate is not None else '{:>14}'.format('-')))
+
+        PrintReport(Node, Depth + 1)
+
+
+
+
+# ---------------------------------- Progress -----------------------------------------
+
+
+
+_Callback = None # called with the Info of running loops, see SetProgress
+_Interval = 1.0
+
+
+
+class _Progress:
+
+    #--------------------------------------------------------------------
+    # Progress of a loop over Total events. The loop calls
+    #
+    #     if Done >= Tracker.Next:
+    #         Tracker.Update(Done, Rejected)
+    #
+    # so between reports it only compares two numbers. Update moves Next
+    # on by about a quarter of the events expected per interval and calls
+    # the callback if an interval has passed since the last report
+    #--------------------------------------------------------------------
+
+    def __init__(self, Name, Total, Callback, Interval):
+        self.Name = Name
+        self.Total = Total
+        self.Callback = Callback
+        self.Interval = Interval
+        self.Begin = self.Last = time.perf_counter()
+        self.Next = 1000
+
+    def Info(self, Done, Rejected, Finished=False):
+        Seconds = time.perf_counter() - self.Begin
+        Rate = Done / Seconds if Seconds > 0 else 0.0
+
+        return {'Name':self.Name, \
+                'Done':Done, \
+                'Total':self.Total, \
+                'Rejected':Rejected, \
+                'Seconds':Seconds, \
+                'Events/s':Rate, \
+                'ETA Seconds':(self.Total - Done) / Rate if Rate > 0 else None, \
+                'Finished':Finished}
+
+    def Update(self, Done, Rejected=0):
+        Now = time.perf_counter()
+        Rate = Done / (Now - self.Begin) if Now > self.Begin else 0.0
+
+        self.Next = Done + max(1, int(Rate * self.Interval / 4))
+
+        if Now - self.Last >= self.Interval:
+            self.Last = Now
+            self.Callback(self.Info(Done, Rejected))
+
+    def Finish(self, Done, Rejected=0):
+        # reported if the loop ran for longer than one interval
+        if time.perf_counter() - self.Begin >= self.Interval:
+            self.Callback(self.Info(Done, Rejected, True))
+
+
+
+class _NoProgress:
+    Next = float('inf')
+
+    def Update(self, Done, Rejected=0):
+        pass
+
+    def Finish(self, Done, Rejected=0):
+        pass
+
+
+
+_NoTracker = _NoProgress()
+
+
+
+def Progress(Name, Total):
+    # Tracker for a loop over Total events (a shared no-op without a callback)
+    if _Callback is None:
+        return _NoTracker
+
+    return _Progress(Name, Total, _Callback, _Interval)
+
+
+
+def SetProgress(Callback, Interval=1.0):
+    # Reports progress to Callback(Info) at most every Interval seconds (None to stop)
+    global _Callback, _Interval
+
+    _Callback = Callback
+    _Interval = Interval
+
+
+
+def PrintProgress(Info):
+    # Callback writing one updating line per loop to stderr
+    Line = '{}: {:d}/{:d} events ({:.0%}), {:.4g} events/s, {:d} rejected'.format(Info['Name'], Info['Done'], Info['Total'], \
+                                                                                  Info['Done'] / max(Info['Total'], 1), \
+                                                                                  Info['Events/s'], Info['Rejected'])
+
+    if Info['Finished']:
+        Line += ', done in {:.1f} s'.format(Info['Seconds'])
+
+    elif Info['ETA Seconds'] is not None:
+        Line += ', ETA {:.0f} s'.format(Info['ETA Seconds'])
+
+    sys.stderr.write('\r{:<100}'.format(Line) + ('\n' if Info['Finished'] else ''))
+    sys.stderr.flush()
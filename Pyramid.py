@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Multi-resolution pyramids of count images and volumes. Level 0 is the
+# finest histogram (eg. a PazAnalysis layer or an ObjectView volume) and
+# each level above sums blocks of Factor voxels of the one below along
+# every axis still longer than MinSize, so counts are kept and a voxel
+# of any level is nonzero exactly when its block has a nonzero voxel.
+#
+# Seeds, candidate regions and overlaps are found at a coarse level and
+# only checked at the finest one where the coarse level points:
+#
+#     Pyr = Pyramid.Build(Volume)
+#     Mask = Pyramid.Regions(Pyr, 0.3)     # voxels worth refining
+#
+# which keeps the analysis of wide surveys with a few small anomalies
+# from looking at every fine voxel
+#--------------------------------------------------------------------
+
+import numpy as np
+import ThreeD_Tracking as td
+
+
+
+def Pool(Volume, Factors):
+
+    #--------------------------------------------------------------------
+    # Sum of each block of Factors (one per axis) voxels of Volume. Axes
+    # not a multiple of their factor are padded with zeros at the end
+    #--------------------------------------------------------------------
+
+    Volume = np.asarray(Volume)
+    Factors = tuple(Factors) + (1,) * (Volume.ndim - len(Factors))
+
+    Padded = np.pad(Volume, [(0, -Size % Factor) for Size, Factor in zip(Volume.shape, Factors)])
+
+    Blocks = []
+
+    for Size, Factor in zip(Padded.shape, Factors):
+        Blocks += [Size // Factor, Factor]
+
+    return Padded.reshape(Blocks).sum(axis=tuple(range(1, 2 * Volume.ndim, 2)))
+
+
+
+def Build(Volume, Levels=None, Factor=2, MinSize=4):
+
+    #--------------------------------------------------------------------
+    # Pyramid of Volume as a dict of 'Levels' (level 0 is Volume) and the
+    # 'Scales', the fine voxels per voxel of each level along each axis.
+    # Levels are added until every axis is down to MinSize voxels, or
+    # until there are Levels levels above level 0
+    #--------------------------------------------------------------------
+
+    Volume = np.asarray(Volume)
+
+    Pyr = {'Levels':[Volume], 'Scales':[(1,) * Volume.ndim]}
+
+    while Levels is None or len(Pyr['Levels']) <= Levels:
+        Top = Pyr['Levels'][-1]
+        Factors = tuple(Factor if Size > MinSize else 1 for Size in Top.shape)
+
+        if all(Step == 1 for Step in Factors):
+            break
+
+        Pyr['Levels'].append(Pool(Top, Factors))
+        Pyr['Scales'].append(tuple(Scale * Step for Scale, Step in zip(Pyr['Scales'][-1], Factors)))
+
+    return Pyr
+
+
+
+def Expand(Mask, Scale, Shape):
+    # Mask of a level with Scale repeated onto the voxels of a level of Shape
+    for Axis, Step in enumerate(Scale):
+        Mask = np.repeat(Mask, Step, axis=Axis)
+
+    return Mask[tuple(slice(0, Size) for Size in Shape)]
+
+
+
+def Block(Index, Scale, Shape):
+    # Slices of the level 0 voxels (of Shape) under the voxel at Index of a level with Scale
+    return tuple(slice(i * Step, min((i + 1) * Step, Size)) for i, Step, Size in zip(Index, Scale, Shape))
+
+
+
+def Centres(Index, Scale, Shape):
+    # Level 0 indices (fractional) of the centres of the voxels at Index (one array per axis) of a level with Scale
+    return [np.minimum(np.asarray(i) * Step + (Step - 1) / 2, Size - 1) for i, Step, Size in zip(Index, Scale, Shape)]
+
+
+
+# ---------------------------------- Coarse to fine -----------------------------------------
+
+
+
+def Regions(Pyr, Fraction, Level=None):
+
+    #--------------------------------------------------------------------
+    # Level 0 mask of the voxels reached by going down from Level (the
+    # coarsest if None) keeping, at each level, the voxels of at least
+    # Fraction of the largest count among those under the voxels kept
+    # at the level above
+    #--------------------------------------------------------------------
+
+    Level = len(Pyr['Levels']) - 1 if Level is None else Level
+    Mask = np.ones(Pyr['Levels'][Level].shape, dtype=bool)
+
+    for l in range(Level, -1, -1):
+        if l < Level:
+            Ratio = tuple(Above // Below for Above, Below in zip(Pyr['Scales'][l + 1], Pyr['Scales'][l]))
+            Mask = Expand(Mask, Ratio, Pyr['Levels'][l].shape)
+
+        Counts = Pyr['Levels'][l]
+        Max = np.max(Counts[Mask]) if np.any(Mask) else 0
+
+        Mask &= (Counts >= Fraction * Max) & (Counts > 0)
+
+    return Mask
+
+
+
+def SeedMaxima(Data, LocalCutoff, Divide, Level=1, Factor=2):
+
+    #--------------------------------------------------------------------
+    # td.LocalMaxIndices run on Level of the pyramid of the 2D image Data
+    # (with Divide scaled down to keep the regions the same size), each
+    # maximum then moved to the largest pixel of Data under it. Returns
+    # the Value and Index lists as LocalMaxIndices does, for ClusterMaxima
+    # and AnalyseData
+    #--------------------------------------------------------------------
+
+    Data = np.asarray(Data)
+    Pyr = Build(Data, Level, Factor)
+    Coarse, Scale = Pyr['Levels'][-1], Pyr['Scales'][-1]
+
+    CoarseDivide = [max(2, int(round((Div - 1) / Step)) + 1) for Div, Step in zip(Divide, Scale)]
+
+    Value, Index = [], []
+
+    for CoarseIndex in td.LocalMaxIndices(Coarse, LocalCutoff, CoarseDivide)[1]:
+        Cells = Block(CoarseIndex, Scale, Data.shape)
+        i, j = np.unravel_index(np.argmax(Data[Cells]), Data[Cells].shape)
+
+        Value.append(Data[Cells][i,j])
+        Index.append([Cells[0].start + int(i), Cells[1].start + int(j)])
+
+    return Value, Index
+
+
+
+def Overlap(First, Second, Level=1, Factor=2, Coarse=None):
+
+    #--------------------------------------------------------------------
+    # Whether two volumes of counts >= 0 are both nonzero at any voxel.
+    # The coarse voxels (at Level) where both are nonzero are found first,
+    # then only the fine voxels under them are checked, stopping at the
+    # first hit. Coarse gives the (levels, scale) of both if already built
+    #--------------------------------------------------------------------
+
+    First, Second = np.asarray(First), np.asarray(Second)
+
+    if Coarse is None:
+        FirstPyr, SecondPyr = Build(First, Level, Factor), Build(Second, Level, Factor)
+        Coarse = (FirstPyr['Levels'][-1], SecondPyr['Levels'][-1]), FirstPyr['Scales'][-1]
+
+    (FirstCoarse, SecondCoarse), Scale = Coarse
+
+    for Cell in np.argwhere((FirstCoarse != 0) & (SecondCoarse != 0)):
+        Voxels = Block(Cell, Scale, First.shape)
+
+        if np.any((First[Voxels] != 0) & (Second[Voxels] != 0)):
+            return True
+
+    return False
+
+
+
+def GroupOverlaps(Data, Level=1, Factor=2):
+
+    #--------------------------------------------------------------------
+    # td.GroupOverlaps (the same groups and pairs) of full volumes of
+    # counts >= 0, with each pair checked coarse to fine by Overlap on
+    # pyramids built once per volume. Returns (ObjectGroups, OverlapLists)
+    #--------------------------------------------------------------------
+
+    N = len(Data)
+    Pyrs = [Build(Data[i], Level, Factor) for i in range(N)]
+    Overlaps = np.zeros((N, N), dtype=bool)
+
+    for i in range(N):
+        for j in range(i + 1, N):
+            Coarse = (Pyrs[i]['Levels'][-1], Pyrs[j]['Levels'][-1]), Pyrs[i]['Scales'][-1]
+            Overlaps[i,j] = Overlaps[j,i] = Overlap(Data[i], Data[j], Level, Factor, Coarse)
+
+    OverlapLists = [[i,j] for i in range(N) for j in range(N) if Overlaps[i,j]]
+
+    return td.GroupPairs(OverlapLists), OverlapLists
+
+
+
+def RenderLevel(Volume, MaxPoints, Factor=2):
+
+    #--------------------------------------------------------------------
+    # The finest level of the pyramid of Volume with at most MaxPoints
+    # nonzero voxels (the coarsest if none has) and its Scale, for
+    # plotting large volumes point by point
+    #--------------------------------------------------------------------
+
+    Volume = np.asarray(Volume)
+
+    if np.count_nonzero(Volume) <= MaxPoints:
+        return Volume, (1,) * Volume.ndim
+
+    Pyr = Build(Volume, Factor=Factor)
+
+    for Counts, Scale in zip(Pyr['Levels'], Pyr['Scales']):
+        if np.count_nonzero(Counts) <= MaxPoints:
+            break
+
+    return Counts, Scale
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Tomographic reconstruction of the density deficit in the image volume
+# from the sky and real runs of all detectors, as an alternative to
+# overlapping back-projected cluster beams (ObjectView -> GroupOverlaps
+# -> ScaleGroups).
+#
+# Each pixel of a detector's cluster layer image (the 'Subtracted Count
+# List' images) is one measurement: the fraction of its sky tracks
+# missing from the real run. To first order this is the sum over the
+# voxels the tracks cross of the path length times the voxel's deficit
+# per cm, so with A[pixel, voxel] the mean path length [cm] of the
+# pixel's sky tracks in the voxel (SystemMatrix)
+#
+#     A x = Subtracted / Sky
+#
+# which is solved for x >= 0 with SIRT, ART or OS-EM (Solvers).
+#
+# The same rows can be made from the geometry alone (LayoutMatrix), with
+# rays from the top of the detector to each pixel instead of the tracks
+# of a run. These only depend on the detector position (and pose, see
+# Pose.py), seperation and grid, so OperatorCache traces them once per
+# layout and keeps them on disk, memory-mapped, for every later run at
+# that layout
+#--------------------------------------------------------------------
+
+import os
+import json
+import shutil
+import numpy as np
+import scipy.sparse as sparse
+from joblib import hash as JoblibHash
+import ThreeD_Tracking as td
+import Pose
+import Profiling
+import Store
+
+
+LayoutFields = ('TriggerSize', 'BarWidth', 'BarHight', 'NumOfBars', 'TriggerWidth', 'TopDepth', \
+                'ImageLayerSize', 'ProjectionPixel', 'ClusterLayer', 'ObjectZ', 'ImageVolume') # RunConfig fields the rows depend on
+
+
+
+# ---------------------------------- System Matrix -----------------------------------------
+
+
+
+def DetectorTracks(RowData, Seperation, Config=None):
+
+    #--------------------------------------------------------------------
+    # Fitted trajectories of the events of RowData and the flat index of
+    # the cluster layer pixel each crosses (as in PazAnalysis), for the
+    # tracks inside the image
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Lines, Quality = td.EventLines(RowData, Seperation, Config, Quality=True)
+    Lines = Lines[Quality == td.QualityOK]
+
+    ZImage = Config.ZUp(Seperation) + Config.ClusterOffset
+    Pixels, Rows = td.LineIndices(Lines, Config.LayerGrid, ZImage, RowData['DetectorPos'], Rows=True)
+
+    return Lines[Rows], Pixels
+
+
+
+def TripletMatrix(Triplets, Shape):
+    # CSR matrix of Shape summing the (rows, columns, values) of each of Triplets, built once
+    if not Triplets:
+        return sparse.csr_matrix(Shape)
+
+    Rows, Columns, Values = [np.concatenate(Column) for Column in zip(*Triplets)]
+
+    return sparse.coo_matrix((Values, (Rows, Columns)), shape=Shape).tocsr()
+
+
+
+def PoseSegments(Start, End, DetectorPose, DetectorPos):
+    # Segments Start -> End ((N, 3), of a detector at DetectorPos) moved to DetectorPose (Pose.TransformTracks), unchanged if it is None
+    if PoseKey(DetectorPos, DetectorPose) is None: # level at DetectorPos, kept exactly as without a pose
+        return Start, End
+
+    Moved = Pose.TransformTracks(np.stack([Start, End], axis=1), DetectorPose, DetectorPos)
+
+    return Moved[:,0], Moved[:,1]
+
+
+
+def DetectorMatrix(RowData, Seperation, Config=None, Chunk=2**12, DetectorPose=None):
+
+    #--------------------------------------------------------------------
+    # (pixels x voxels) CSR matrix of the mean path length [cm] of the sky
+    # tracks of each cluster layer pixel in each voxel of Config.VolumeGrid
+    # (at the heights of ObjectView), and the number of tracks of each
+    # pixel. The tracks are traced in chunks to bound memory. With a
+    # DetectorPose the tracks are moved to it (see PoseSegments), the
+    # pixels being those of the detector's own image
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+    Grid = Config.VolumeGrid
+    ZUp = Config.ZUp(Seperation)
+
+    Pixels = int(np.prod(Config.ProjectionPixel[:2]))
+    Voxels = int(np.prod(Grid.Shape))
+
+    Lines, Pixel = DetectorTracks(RowData, Seperation, Config)
+    Start, End = PoseSegments(*td.LineSegments(Lines, Grid, ZUp, RowData['DetectorPos']), DetectorPose, RowData['DetectorPos'])
+
+    Triplets = [] # (pixels, voxels, lengths) of each chunk, summed into one matrix at the end
+
+    for First in range(0, len(Lines), Chunk):
+        Rows, Flat, Lengths = td.TraceSegments(Start[First:First+Chunk], End[First:First+Chunk], Grid, ZUp)
+        Triplets.append((Pixel[First:First+Chunk][Rows], Flat, Lengths))
+
+    Matrix = TripletMatrix(Triplets, (Pixels, Voxels))
+
+    Tracks = np.bincount(Pixel, minlength=Pixels)
+
+    Profiling.Count('Tracks', len(Lines))
+
+    Mean = sparse.diags(1 / np.maximum(Tracks, 1)) @ Matrix
+
+    return Mean.tocsr(), Tracks
+
+
+
+def SystemMatrix(ReadDict, Config=None, Chunk=2**12, Poses=None):
+
+    #--------------------------------------------------------------------
+    # DetectorMatrix of the sky runs of every detector, stacked into one
+    # (detectors * pixels x voxels) matrix, with the tracks of each row.
+    # Poses gives the Pose.DetectorPose of each detector
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Matrices, Tracks = [], []
+
+    with Profiling.Stage('SystemMatrix'):
+        for i in range(len(ReadDict['Row Sky List'])):
+            Matrix, Count = DetectorMatrix(ReadDict['Row Sky List'][i], ReadDict['Seperations'][i], Config, Chunk, Poses[i] if Poses else None)
+
+            Matrices.append(Matrix)
+            Tracks.append(Count)
+
+        System = {'Matrix':sparse.vstack(Matrices, format='csr'), 'Tracks':np.concatenate(Tracks)}
+
+    return System
+
+
+
+def Measurements(ReadDict, Config=None, MinCounts=10):
+
+    #--------------------------------------------------------------------
+    # Fraction of the sky counts missing from the real run in each row of
+    # SystemMatrix, and the mask of rows with at least MinCounts sky
+    # counts to be used in the solve
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Fractions, Used = [], []
+
+    for i in range(len(ReadDict['Subtracted Count List'])):
+        Sky = np.asarray(ReadDict['Sky Count List'][i], dtype=float)
+        Subtracted = np.asarray(ReadDict['Subtracted Count List'][i], dtype=float)
+
+        if Sky.ndim == 3: # Iterate counts, the subtracted image is the cluster layer
+            Sky = Sky[:,:,Config.ClusterLayer]
+
+        Fractions.append((Subtracted / np.maximum(Sky, 1)).ravel())
+        Used.append((Sky >= MinCounts).ravel())
+
+    return np.concatenate(Fractions), np.concatenate(Used)
+
+
+
+# ---------------------------------- Layout Operators -----------------------------------------
+
+
+
+def _Extended(Down, Up, Z):
+    # Points of the lines through Down and Up ((N, 3) arrays) at the heights Z[0] and Z[-1]
+    Delta = Up - Down
+    Along = lambda Height: Down + ((Height - Down[:,2]) / Delta[:,2])[:,None] * Delta
+
+    return Along(Z[0]), Along(Z[-1])
+
+
+
+def LayoutMatrix(DetectorPos, Seperation, Config=None, Rays=3, Chunk=2**12, DetectorPose=None):
+
+    #--------------------------------------------------------------------
+    # (pixels x voxels) CSR matrix as DetectorMatrix, made from the
+    # geometry instead of the tracks of a run: the rows are the mean path
+    # lengths of Rays x Rays rays from points spread evenly over the top
+    # trigger of the detector at DetectorPos to the centre of each cluster
+    # layer pixel, moved to DetectorPose if given
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+    Grid = Config.VolumeGrid
+    ZUp = Config.ZUp(Seperation)
+
+    Pixels = int(np.prod(Config.ProjectionPixel[:2]))
+    Voxels = int(np.prod(Grid.Shape))
+
+    Iind, Jind = np.divmod(np.arange(Pixels), Config.ProjectionPixel[1])
+    X, Y = Config.LayerGrid.IndexToWorld(Iind, Jind)
+    Centres = np.stack([X, Y, np.full(Pixels, ZUp + Config.ClusterOffset)], axis=1)
+
+    Spread = ((np.arange(Rays) + 0.5) / Rays - 0.5) * Config.TriggerSize
+    Offsets = np.stack(np.meshgrid(Spread, Spread, indexing='ij'), axis=-1).reshape((-1, 2))
+
+    Triplets = []
+    Z = Grid.Edges(ZUp)[2]
+
+    for Offset in Offsets:
+        Down = np.tile([DetectorPos[0] + Offset[0], DetectorPos[1] + Offset[1], ZUp], (Pixels, 1))
+        Start, End = PoseSegments(*_Extended(Down, Centres, Z), DetectorPose, DetectorPos)
+
+        for First in range(0, Pixels, Chunk):
+            Rows, Flat, Lengths = td.TraceSegments(Start[First:First+Chunk], End[First:First+Chunk], Grid, ZUp)
+            Triplets.append((First + Rows, Flat, Lengths))
+
+    return (TripletMatrix(Triplets, (Pixels, Voxels)) / len(Offsets)).tocsr()
+
+
+
+def PoseKey(DetectorPos, DetectorPose):
+    # Position and angles of DetectorPose for the layout key, None if there is none or it leaves the detector level at DetectorPos
+    if DetectorPose is None:
+        return None
+
+    Position = [float(x) for x in DetectorPose['Position']]
+
+    if Pose.IsTranslation(DetectorPose) and Position == [float(DetectorPos[0]), float(DetectorPos[1]), 0.0]:
+        return None
+
+    return {'Position':Position, 'Angles':[float(Angle) for Angle in DetectorPose['Angles']]}
+
+
+
+class OperatorCache:
+
+    #--------------------------------------------------------------------
+    # Keeps the LayoutMatrix of each detector layout (position, pose,
+    # seperation, Rays and the LayoutFields of the RunConfig) in
+    # Directory as Store.SaveSparse arrays. Get traces a layout the first
+    # time it is asked for and afterwards returns the saved matrix
+    # memory-mapped, so new runs at a layout need no ray tracing
+    #--------------------------------------------------------------------
+
+    def __init__(self, Directory='operators'):
+        self.Directory = Directory
+
+        os.makedirs(Directory, exist_ok=True)
+
+    def Key(self, DetectorPos, Seperation, Config=None, Rays=3, DetectorPose=None):
+        Config = td.GetConfig(Config)
+
+        Layout = [[float(DetectorPos[0]), float(DetectorPos[1])], float(Seperation), int(Rays), \
+                  [(Name, getattr(Config, Name)) for Name in LayoutFields]]
+
+        if PoseKey(DetectorPos, DetectorPose) is not None: # level detectors keep the keys they had without poses
+            Layout.append(PoseKey(DetectorPos, DetectorPose))
+
+        return JoblibHash(Layout)
+
+    def Get(self, DetectorPos, Seperation, Config=None, Rays=3, DetectorPose=None):
+        Config = td.GetConfig(Config)
+
+        Path = os.path.join(self.Directory, 'Layout_' + self.Key(DetectorPos, Seperation, Config, Rays, DetectorPose))
+
+        if os.path.isfile(os.path.join(Path, 'layout.json')):
+            return Store.LoadSparse(Path)
+
+        print('Tracing the projection operator of the detector at', list(DetectorPos), 'seperation', Seperation)
+
+        with Profiling.Stage('LayoutMatrix'):
+            Matrix = LayoutMatrix(DetectorPos, Seperation, Config, Rays, DetectorPose=DetectorPose)
+
+        Partial = Path + '.partial'
+
+        if os.path.isdir(Partial):
+            shutil.rmtree(Partial)
+
+        Store.SaveSparse(Matrix, Partial)
+
+        with open(os.path.join(Partial, 'layout.json'), 'w') as File:
+            json.dump({'DetectorPos':[float(DetectorPos[0]), float(DetectorPos[1])], 'Seperation':float(Seperation), 'Rays':int(Rays), \
+                       'Pose':PoseKey(DetectorPos, DetectorPose), \
+                       'Config':{Name:getattr(Config, Name) for Name in LayoutFields}}, File, indent=1) # written last, marks the layout complete
+
+        if os.path.isdir(Path):
+            shutil.rmtree(Path)
+
+        os.rename(Partial, Path)
+
+        return Store.LoadSparse(Path)
+
+
+
+def LayoutSystem(ReadDict, Config=None, Operators=None, Rays=3, Poses=None):
+
+    #--------------------------------------------------------------------
+    # SystemMatrix style system of the detectors of ReadDict made of the
+    # LayoutMatrix of each (from the OperatorCache Operators if given),
+    # for Solve with the Measurements of any run at these layouts. Poses
+    # gives the Pose.DetectorPose of each detector
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Matrices = []
+
+    for i in range(len(ReadDict['Row Sky List'])):
+        DetectorPos, Seperation = ReadDict['Row Sky List'][i]['DetectorPos'], ReadDict['Seperations'][i]
+        DetectorPose = Poses[i] if Poses else None
+
+        if Operators is not None:
+            Matrices.append(Operators.Get(DetectorPos, Seperation, Config, Rays, DetectorPose))
+
+        else:
+            Matrices.append(LayoutMatrix(DetectorPos, Seperation, Config, Rays, DetectorPose=DetectorPose))
+
+    Matrix = sparse.vstack(Matrices, format='csr')
+
+    return {'Matrix':Matrix, 'Tracks':np.diff(Matrix.indptr)} # rows crossing no voxel are left out of Solve
+
+
+
+def BackProject(Matrix, Image, Config=None):
+    # Volume on Config.VolumeGrid of the pixel values Image spread along the rows of Matrix (A^T Image), a sparse mat-vec
+    Config = td.GetConfig(Config)
+
+    return (Matrix.T @ np.asarray(Image, dtype=float).ravel()).reshape(Config.VolumeGrid.Shape)
+
+
+
+# ---------------------------------- Solvers -----------------------------------------
+
+
+
+def _Inverse(Sums):
+    # 1 / Sums, 0 where Sums is 0
+    Sums = np.asarray(Sums, dtype=float).ravel()
+
+    return np.divide(1, Sums, out=np.zeros_like(Sums), where=Sums > 0)
+
+
+
+def _Blocks(Rows, Count):
+    # Interleaved row subsets of ART and OS-EM (neighbouring pixels go to different subsets)
+    return [np.arange(Rows)[k::Count] for k in range(min(Count, max(Rows, 1)))]
+
+
+
+def SIRT(A, b, Iterations=50, Relaxation=1.0, X=None, Callback=None):
+
+    #--------------------------------------------------------------------
+    # Simultaneous iterative reconstruction: every iteration moves X by
+    # the back-projected row-normalised residual of all rows at once,
+    #     X += Relaxation * C A^T R (b - A X),  R, C = 1 / row, column sums
+    # and clips X to be non-negative. Callback(Iteration, X, Residual)
+    # is called after each iteration
+    #--------------------------------------------------------------------
+
+    A = sparse.csr_matrix(A)
+    b = np.asarray(b, dtype=float)
+
+    R = _Inverse(A.sum(axis=1))
+    C = _Inverse(A.sum(axis=0))
+
+    X = np.zeros(A.shape[1]) if X is None else np.array(X, dtype=float)
+    Residuals = []
+
+    for Iteration in range(Iterations):
+        Residual = b - A @ X
+        X += Relaxation * C * (A.T @ (R * Residual))
+        np.maximum(X, 0, out=X)
+
+        Residuals.append(float(np.linalg.norm(Residual)))
+
+        if Callback is not None:
+            Callback(Iteration, X, Residuals[-1])
+
+    return X, Residuals
+
+
+
+def ART(A, b, Iterations=10, Relaxation=0.5, Blocks=32, X=None, Callback=None):
+
+    #--------------------------------------------------------------------
+    # Block algebraic reconstruction (SART): as SIRT but X is updated
+    # after each of Blocks interleaved subsets of the rows in turn, which
+    # converges in fewer iterations. Blocks = number of rows is classic
+    # row by row ART. The residual is that at the start of each iteration
+    #--------------------------------------------------------------------
+
+    A = sparse.csr_matrix(A)
+    b = np.asarray(b, dtype=float)
+
+    Subsets = [(A[Rows], b[Rows]) for Rows in _Blocks(A.shape[0], Blocks)]
+    Subsets = [(Ak, bk, _Inverse(Ak.sum(axis=1)), _Inverse(Ak.sum(axis=0))) for Ak, bk in Subsets]
+
+    X = np.zeros(A.shape[1]) if X is None else np.array(X, dtype=float)
+    Residuals = []
+
+    for Iteration in range(Iterations):
+        Residuals.append(float(np.linalg.norm(b - A @ X)))
+
+        for Ak, bk, R, C in Subsets:
+            X += Relaxation * C * (Ak.T @ (R * (bk - Ak @ X)))
+            np.maximum(X, 0, out=X)
+
+        if Callback is not None:
+            Callback(Iteration, X, Residuals[-1])
+
+    return X, Residuals
+
+
+
+def OSEM(A, b, Iterations=10, Subsets=8, X=None, Callback=None):
+
+    #--------------------------------------------------------------------
+    # Ordered subsets expectation maximisation: the multiplicative update
+    #     X *= A_k^T (b_k / A_k X) / A_k^T 1
+    # over each subset k of the rows in turn, which keeps X non-negative.
+    # Voxels no track of a subset crosses are left as they are. Starts
+    # from a uniform X unless one is given
+    #--------------------------------------------------------------------
+
+    A = sparse.csr_matrix(A)
+    b = np.maximum(np.asarray(b, dtype=float), 0)
+
+    Parts = [(A[Rows], b[Rows]) for Rows in _Blocks(A.shape[0], Subsets)]
+    Parts = [(Ak, bk, _Inverse(Ak.sum(axis=0))) for Ak, bk in Parts]
+    Parts = [(Ak, bk, C, C > 0) for Ak, bk, C in Parts]
+
+    if X is None:
+        Total = A.sum()
+        X = np.full(A.shape[1], b.sum() / Total if Total > 0 else 0.0)
+
+    else:
+        X = np.array(X, dtype=float)
+
+    Residuals = []
+
+    for Iteration in range(Iterations):
+        Residuals.append(float(np.linalg.norm(b - A @ X)))
+
+        for Ak, bk, C, Seen in Parts:
+            Projected = Ak @ X
+            Ratio = np.divide(bk, Projected, out=np.zeros_like(bk), where=Projected > 0)
+            X[Seen] *= (C * (Ak.T @ Ratio))[Seen]
+
+        if Callback is not None:
+            Callback(Iteration, X, Residuals[-1])
+
+    return X, Residuals
+
+
+
+Solvers = {'SIRT':SIRT, 'ART':ART, 'OSEM':OSEM}
+
+
+
+def Solve(System, b, Used, Config=None, Method='SIRT', Iterations=50, **Options):
+
+    #--------------------------------------------------------------------
+    # Solves the rows Used of the SystemMatrix (or ProjectionOperator)
+    # System for measurements b with one of Solvers. Returns the deficit
+    # volume [1/cm] on Config.VolumeGrid and the residual norms
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    if Method not in Solvers:
+        raise ValueError('Method must be one of {}, not {!r}'.format(', '.join(Solvers), Method))
+
+    Used = np.asarray(Used, dtype=bool) & (np.asarray(System['Tracks']) > 0)
+
+    with Profiling.Stage(Method):
+        X, Residuals = Solvers[Method](System['Matrix'][Used], b[Used], Iterations, **Options)
+        Profiling.Count('Iterations', Iterations)
+
+    return {'Volume':X.reshape(Config.VolumeGrid.Shape), 'Residuals':Residuals, 'Method':Method, 'Rows':int(np.count_nonzero(Used))}
+
+
+
+def Reconstruct(ReadDict, Config=None, Method='SIRT', Iterations=50, MinCounts=10, System=None, **Options):
+    # Solve of the SystemMatrix of ReadDict (built unless given) for its Measurements
+    Config = td.GetConfig(Config)
+
+    if System is None:
+        System = SystemMatrix(ReadDict, Config)
+
+    b, Used = Measurements(ReadDict, Config, MinCounts)
+
+    return Solve(System, b, Used, Config, Method, Iterations, **Options)
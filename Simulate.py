@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Simulates cosmic muons crossing one detector (the geometry of the
+# RunConfig: four layers of NumOfBars triangular bars between two
+# trigger planes) and writes them as RowData.out files, or in the
+# columnar format of Store.SaveRowData, for tests and benchmarks of any
+# size. Buried density anomalies can be added to the overburden:
+#
+#     python Simulate.py RDR_sim.out --events 1000000 --position 500 0 --anomaly 0 0 1200 150 1
+#--------------------------------------------------------------------
+
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import ThreeD_Tracking as td
+import Store
+
+
+Start = 1624132791.0 # [s] default time of the first event, Sat Jun 19 19:59:51 2021 (UTC)
+Flux = 1 / 60        # [cm^-2 s^-1] vertical muon flux at the surface, sets the default event rate
+
+
+
+# ---------------------------------- Muon Tracks -----------------------------------------
+
+
+
+def LayerBottoms(Seperation, Config=None):
+    # Heights [cm] of the bottom of layers 1 (XUp), 2 (YUp), 3 (XDown), 4 (YDown) above the bottom of the detector
+    Config = td.GetConfig(Config)
+    TW, BH = Config.TriggerWidth, Config.BarHight
+
+    return np.array([TW + Seperation + 3 * BH, TW + Seperation + 2 * BH, TW + BH, TW])
+
+
+
+def SampleTracks(N, Rng, MaxZenith=70, Config=None, Seperation=td.PlanesSeperation):
+
+    #--------------------------------------------------------------------
+    # N muon tracks x = X + TX * z, y = Y + TY * z (z above the bottom of
+    # the detector) with a cos^2 zenith distribution up to MaxZenith [deg]
+    # and uniform in azimuth, which cross both trigger planes
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Half = Config.TriggerSize / 2
+    ZTop = Config.ZUp(Seperation)
+
+    CosMin3 = np.cos(np.radians(MaxZenith)) ** 3
+
+    Tracks = []
+    Found = 0
+
+    while Found < N:
+        M = int(1.5 * (N - Found)) + 16
+
+        Cos = Rng.uniform(CosMin3, 1, M) ** (1 / 3) # dN/dcos ~ cos^2
+        Tan = np.sqrt(1 - Cos**2) / Cos
+        Phi = Rng.uniform(0, 2 * np.pi, M)
+
+        TX, TY = Tan * np.cos(Phi), Tan * np.sin(Phi)
+
+        XTop, YTop = Rng.uniform(-Half, Half, (2, M))
+        X, Y = XTop - TX * ZTop, YTop - TY * ZTop # at z = 0, the bottom trigger
+
+        Keep = (np.abs(X) <= Half) & (np.abs(Y) <= Half)
+
+        Tracks.append(np.stack([X, Y, TX, TY], axis=1)[Keep])
+        Found += np.count_nonzero(Keep)
+
+    return np.concatenate(Tracks)[:N]
+
+
+
+def AnomalyWeights(Tracks, Anomalies, DetectorPos, Seperation, AttenuationLength, Config=None):
+
+    #--------------------------------------------------------------------
+    # Relative chance of each track reaching the detector through the
+    # spherical Anomalies (dicts of 'Centre' [x,y,z] in cm, z above the
+    # bottom of the detector as for the image layers, 'Radius' [cm] and
+    # 'Contrast', the fractional change in density, < 0 for voids), as
+    # exp(-Contrast * PathLength / AttenuationLength)
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+    ZTop = Config.ZUp(Seperation)
+
+    Start = np.stack([Tracks[:,0] + Tracks[:,2] * ZTop + DetectorPos[0], \
+                      Tracks[:,1] + Tracks[:,3] * ZTop + DetectorPos[1], \
+                      np.full(len(Tracks), ZTop)], axis=1)
+
+    Direction = np.stack([Tracks[:,2], Tracks[:,3], np.ones(len(Tracks))], axis=1)
+    Direction /= np.linalg.norm(Direction, axis=1)[:,None]
+
+    Exponent = np.zeros(len(Tracks))
+
+    for Anomaly in Anomalies:
+        Offset = Start - np.asarray(Anomaly['Centre'], dtype=float)
+
+        B = np.sum(Offset * Direction, axis=1)
+        C = np.sum(Offset**2, axis=1) - Anomaly['Radius']**2
+        Root = np.sqrt(np.clip(B**2 - C, 0, None))
+
+        PathLength = np.clip(-B + Root, 0, None) - np.clip(-B - Root, 0, None) # part of the chord above the detector
+
+        Exponent -= Anomaly['Contrast'] * PathLength / AttenuationLength
+
+    return np.exp(Exponent)
+
+
+
+def LayerBars(U, K):
+
+    #--------------------------------------------------------------------
+    # Bars crossed in one layer by tracks at U (at the bottom of the layer)
+    # moving K across the layer height, both in units of half a bar width
+    # from the first bar. Bar f points down (even f) or up (odd f) with its
+    # apex at f. Returns the bar numbers and the fraction of the layer
+    # height each track spends in them, both (N, M)
+    #--------------------------------------------------------------------
+
+    M = int(np.ceil(np.max(np.abs(K), initial=0))) + 4
+
+    F = (np.floor(np.minimum(U, U + K)).astype(np.int64) - 1)[:,None] + np.arange(M)[None,:]
+
+    U, K = U[:,None], K[:,None]
+    Even = F % 2 == 0
+
+    # inside bar f for the heights s (0 at the bottom, 1 at the top) with A1 s <= B1 and A2 s <= B2
+    A1 = np.where(Even, K - 1, K + 1)
+    B1 = np.where(Even, F - U, 1 + F - U)
+    A2 = np.where(Even, -(K + 1), 1 - K)
+    B2 = np.where(Even, U - F, 1 + U - F)
+
+    Low, High = np.zeros(F.shape), np.ones(F.shape)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for A, B in [(A1, B1), (A2, B2)]:
+            High = np.where(A > 0, np.minimum(High, B / A), High)
+            Low = np.where(A < 0, np.maximum(Low, B / A), Low)
+            High = np.where((A == 0) & (B < 0), -1, High)
+
+    return F, np.clip(High - Low, 0, None)
+
+
+
+def TrackBars(Tracks, Seperation, MinLength=0.01, Config=None):
+
+    #--------------------------------------------------------------------
+    # The bar readout of each track, as the arrays of Store.RowDataToArrays
+    # (Bars, Lengths [cm] and Offsets, event k is Offsets[k]:Offsets[k+1]).
+    # Bars with a path length below MinLength [cm] give no signal
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+
+    Half = Config.BarWidth / 2
+    First = -(Config.NumOfBars / 4 - 0.25) * Config.BarWidth # apex of bar 0
+
+    Scale = Config.BarHight * np.sqrt(1 + Tracks[:,2]**2 + Tracks[:,3]**2)
+
+    Codes, Lengths = [], []
+
+    for Layer, Bottom in enumerate(LayerBottoms(Seperation, Config)):
+        Axis = Layer % 2 # layers 1 and 3 measure x, 2 and 4 measure y
+
+        U = (Tracks[:,Axis] + Tracks[:,2+Axis] * Bottom - First) / Half
+        K = Tracks[:,2+Axis] * Config.BarHight / Half
+
+        F, Fraction = LayerBars(U, K)
+
+        Length = Fraction * Scale[:,None]
+        Length[(F < 0) | (F >= Config.NumOfBars) | (Length < MinLength)] = 0
+
+        Codes.append(100 * (Layer + 1) + F)
+        Lengths.append(Length)
+
+    Codes, Lengths = np.concatenate(Codes, axis=1), np.concatenate(Lengths, axis=1)
+    Hit = Lengths > 0
+
+    Offsets = np.zeros(len(Tracks) + 1, dtype=np.int64)
+    Offsets[1:] = np.cumsum(np.count_nonzero(Hit, axis=1))
+
+    return {'Bars':Codes[Hit].astype(float), 'Lengths':Lengths[Hit], 'Offsets':Offsets}
+
+
+
+def SimulateEvents(N, Seperation=td.PlanesSeperation, DetectorPos=(0,0), Anomalies=None, Seed=None, Begin=Start, Rate=None, \
+                   MaxZenith=70, AttenuationLength=1000, MinLength=0.01, Config=None):
+
+    #--------------------------------------------------------------------
+    # Simulates the triggered muon events of a detector at DetectorPos
+    # during the time N events arrive without Anomalies (see
+    # AnomalyWeights), which remove events (or add them, for voids) so
+    # runs with and without them can be subtracted. Returns the arrays of
+    # TrackBars with Times [s since the epoch] of a run starting at Begin
+    # with Rate events per second (trigger area times Flux if None) and
+    # the true Tracks
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+    Rng = np.random.default_rng(Seed)
+
+    Rate = Rate or Flux * Config.TriggerSize**2
+
+    Anomalies = Anomalies or []
+    MaxWeight = np.exp(sum(-min(Anomaly['Contrast'], 0) * 2 * Anomaly['Radius'] for Anomaly in Anomalies) / AttenuationLength)
+
+    Candidates = int(round(N * MaxWeight))
+
+    Tracks = SampleTracks(Candidates, Rng, MaxZenith, Config, Seperation)
+    Times = Begin + np.cumsum(Rng.exponential(1 / (Rate * MaxWeight), Candidates))
+
+    if Anomalies:
+        Weight = AnomalyWeights(Tracks, Anomalies, DetectorPos, Seperation, AttenuationLength, Config)
+        Keep = Rng.uniform(0, MaxWeight, Candidates) < Weight
+
+        Tracks, Times = Tracks[Keep], Times[Keep]
+
+    Events = TrackBars(Tracks, Seperation, MinLength, Config)
+    Events['Times'] = Times
+    Events['Tracks'] = Tracks
+
+    return Events
+
+
+
+def DateStrings(Times):
+    # RowData DateAndTime strings (as time.ctime, in UTC) of Times, formatting each second once
+    Seconds, Inverse = np.unique(np.floor(Times).astype(np.int64), return_inverse=True)
+    Strings = np.array([time.strftime('%a %b %d %H:%M:%S %Y', time.gmtime(Second)) for Second in Seconds])
+
+    return Strings[Inverse.ravel()]
+
+
+
+def EventsToRowData(Events, DetectorPos=(0,0), FileName='simulated'):
+    # RowData dictionary (as ReadRowDataFileFastest gives) of the events of SimulateEvents
+    Arrays = {'Bars':Events['Bars'], 'Lengths':Events['Lengths'], 'Offsets':Events['Offsets'], \
+              'DateAndTime':DateStrings(Events['Times'])}
+
+    Info = {'FileName':FileName, 'NumberOfEvents':len(Events['Offsets']), 'DetectorPos':list(DetectorPos)}
+
+    return Store.ArraysToRowData(Arrays, Info)
+
+
+
+# ---------------------------------- Writing Files -----------------------------------------
+
+
+
+def BarLines(Bars, Lengths):
+
+    #--------------------------------------------------------------------
+    # The RowData lines '%03d %.7f\n' of each bar, built as an (n, 14)
+    # array of characters. Lengths must be below 10 cm
+    #--------------------------------------------------------------------
+
+    if np.any(np.asarray(Lengths) >= 9.99999995):
+        raise ValueError('RowData path lengths must be below 10 cm, lower MaxZenith')
+
+    Digits = lambda Values, Count: (Values[:,None] // 10**np.arange(Count - 1, -1, -1)[None,:]) % 10 + ord('0')
+
+    Fixed = np.rint(np.asarray(Lengths) * 1e7).astype(np.int64)
+
+    Lines = np.empty((len(Bars), 14), dtype=np.uint8)
+    Lines[:,0:3] = Digits(np.asarray(Bars).astype(np.int64), 3)
+    Lines[:,3] = ord(' ')
+    Lines[:,4] = Digits(Fixed // 10**7, 1)[:,0]
+    Lines[:,5] = ord('.')
+    Lines[:,6:13] = Digits(Fixed % 10**7, 7)
+    Lines[:,13] = ord('\n')
+
+    return Lines
+
+
+
+def WriteRowDataFile(Events, File, First=0):
+
+    #--------------------------------------------------------------------
+    # Writes the events of SimulateEvents to the open (binary) File in the
+    # RowData.out format, numbered from First. Every event is padded to
+    # the 12 lines ReadRowDataFileFastest reads per event, which only
+    # sees the first 9 bars of an event
+    #--------------------------------------------------------------------
+
+    Offsets = Events['Offsets']
+    Text = BarLines(Events['Bars'], Events['Lengths']).tobytes()
+    Dates = DateStrings(Events['Times'])
+    Counts = np.diff(Offsets)
+
+    Pads = [b'Trigger\n' * (9 - n) for n in range(10)]
+
+    Parts = []
+
+    for k in range(len(Counts)):
+        Parts.append(b'*Event*\n%d\n%s\n' % (First + k, Dates[k].encode()))
+        Parts.append(Text[14 * Offsets[k]:14 * Offsets[k+1]])
+        Parts.append(Pads[min(Counts[k], 9)])
+
+    File.write(b''.join(Parts))
+
+
+
+def _AppendArray(Parts, Name, Array, Directory):
+    # Appends Array to the raw file of Name in Directory, keeping its dtype in Parts
+    with open(os.path.join(Directory, Name + '.part'), 'ab') as File:
+        File.write(np.ascontiguousarray(Array).tobytes())
+
+    Parts[Name] = (Array.dtype, Parts.get(Name, (None, 0))[1] + len(Array))
+
+
+
+def _FinishArrays(Parts, Directory):
+    # Turns the raw files of _AppendArray into .npy files
+    for Name, (Type, Length) in Parts.items():
+        Part = os.path.join(Directory, Name + '.part')
+
+        with open(os.path.join(Directory, Name + '.npy'), 'wb') as File, open(Part, 'rb') as Raw:
+            np.lib.format.write_array_header_1_0(File, {'descr':np.lib.format.dtype_to_descr(Type), \
+                                                        'fortran_order':False, 'shape':(Length,)})
+            shutil.copyfileobj(Raw, File, 2**24)
+
+        os.remove(Part)
+
+
+
+def SimulateFile(FileName, N, Seperation=td.PlanesSeperation, DetectorPos=(0,0), Anomalies=None, Seed=None, Columnar=False, \
+                 Chunk=10**6, Config=None, **Options):
+
+    #--------------------------------------------------------------------
+    # Simulates the events of SimulateEvents (Options are passed on) in
+    # chunks of Chunk and writes them to FileName as a RowData.out
+    # file, or as a Store.SaveRowData directory (read with
+    # Store.LoadRowData) if Columnar. Memory use is set by Chunk, not N.
+    # Note ReadRowDataFileFastest drops the last event of .out files
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+    Seeds = np.random.SeedSequence(Seed).spawn(-(-N // Chunk))
+
+    Begin = Options.pop('Begin', Start)
+    Parts = {}
+    Written = 0
+
+    if Columnar:
+        if os.path.isdir(FileName):
+            shutil.rmtree(FileName)
+
+        os.makedirs(FileName)
+
+    else:
+        File = open(FileName, 'wb')
+
+    try:
+        for i, First in enumerate(range(0, N, Chunk)):
+            Events = SimulateEvents(min(Chunk, N - First), Seperation, DetectorPos, Anomalies, Seeds[i], Begin, Config=Config, **Options)
+
+            if len(Events['Times']) == 0:
+                continue
+
+            Begin = Events['Times'][-1]
+
+            if Columnar:
+                Offsets = Events['Offsets'][1:] + Parts.get('Bars', (None, 0))[1]
+
+                _AppendArray(Parts, 'Bars', Events['Bars'], FileName)
+                _AppendArray(Parts, 'Lengths', Events['Lengths'], FileName)
+                _AppendArray(Parts, 'Offsets', np.concatenate([[0], Offsets]) if Written == 0 else Offsets, FileName)
+                _AppendArray(Parts, 'DateAndTime', DateStrings(Events['Times']).astype('<U24'), FileName)
+
+            else:
+                WriteRowDataFile(Events, File, Written)
+
+            Written += len(Events['Times'])
+
+    finally:
+        if not Columnar:
+            File.close()
+
+    if Columnar:
+        _FinishArrays(Parts, FileName)
+
+        with open(os.path.join(FileName, 'info.json'), 'w') as Info:
+            json.dump({'FileName':FileName, 'NumberOfEvents':Written + 1, 'DetectorPos':[float(x) for x in DetectorPos]}, Info)
+
+
+
+def Main(Arguments=None):
+    Parser = argparse.ArgumentParser(description='Simulates muon events of one detector as a RowData file')
+
+    Parser.add_argument('file', help='output RowData.out file (or directory with --columnar)')
+    Parser.add_argument('-n', '--events', type=int, default=100000, help='number of events the run would have without anomalies (default 100000)')
+    Parser.add_argument('--seperation', type=float, default=td.PlanesSeperation, help='layer seperation [cm]')
+    Parser.add_argument('--position', type=float, nargs=2, default=[0, 0], metavar=('X', 'Y'), help='detector position [cm]')
+    Parser.add_argument('--anomaly', type=float, nargs=5, action='append', default=[], metavar=('X', 'Y', 'Z', 'RADIUS', 'CONTRAST'), \
+                        help='spherical density anomaly, Z [cm] above the detector, CONTRAST the fractional density change (repeatable)')
+    Parser.add_argument('--seed', type=int, default=None)
+    Parser.add_argument('--columnar', action='store_true', help='write Store.SaveRowData arrays instead of a .out file')
+    Parser.add_argument('--chunk', type=int, default=10**6, help='events simulated at a time (default 1000000)')
+
+    Args = Parser.parse_args(Arguments)
+
+    Anomalies = [{'Centre':Anomaly[:3], 'Radius':Anomaly[3], 'Contrast':Anomaly[4]} for Anomaly in Args.anomaly]
+
+    SimulateFile(Args.file, Args.events, Args.seperation, Args.position, Anomalies, Args.seed, Args.columnar, Args.chunk)
+
+
+
+if __name__ == '__main__':
+    Main()
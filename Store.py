@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# On-disk layout for the ReadDict and AnalyseDict dictionaries of the
+# view -> analyse pipeline. Each entry (and each detector of per-detector
+# lists) is a separate file: numpy arrays are .npy files read memory-
+# mapped, RowData dictionaries are stored as flat arrays, sparse
+# matrices as their CSR arrays, TrackBundles as their columns (read
+# back memory-mapped) and anything else is a small joblib
+# file. Entries are only read when accessed
+#--------------------------------------------------------------------
+
+import os
+import json
+import shutil
+import numpy as np
+import scipy.sparse as sparse
+from collections.abc import MutableMapping, Sequence
+from joblib import dump, load
+import Tracks
+
+
+IndexName = 'index.json'
+
+
+
+# ---------------------------------- RowData Arrays -----------------------------------------
+
+
+
+def RowDataToArrays(RowData):
+
+    #--------------------------------------------------------------------
+    # Flattens the ragged BarsReadout lists of RowData into arrays: the
+    # bars and lengths of event k are Bars[Offsets[k]:Offsets[k+1]]
+    #--------------------------------------------------------------------
+
+    Bars, Lengths = RowData['BarsReadout']
+
+    Offsets = np.zeros(len(Bars) + 1, dtype=np.int64)
+    Offsets[1:] = np.cumsum([len(Bar) for Bar in Bars])
+
+    Arrays = {'Bars':np.fromiter((b for Bar in Bars for b in Bar), dtype=float, count=Offsets[-1]),
+              'Lengths':np.fromiter((l for Length in Lengths for l in Length), dtype=float, count=Offsets[-1]),
+              'Offsets':Offsets,
+              'DateAndTime':np.asarray(RowData['DateAndTime'], dtype=str)}
+
+    Info = {'FileName':str(RowData['FileName']),
+            'NumberOfEvents':int(RowData['NumberOfEvents']),
+            'DetectorPos':[float(x) for x in RowData['DetectorPos']]}
+
+    return Arrays, Info
+
+
+
+def ArraysToRowData(Arrays, Info):
+    # Inverse of RowDataToArrays
+    Offsets = np.asarray(Arrays['Offsets'])
+    Bars = np.asarray(Arrays['Bars']).tolist()
+    Lengths = np.asarray(Arrays['Lengths']).tolist()
+
+    RowData = {'FileName':Info['FileName'],
+               'NumberOfEvents':Info['NumberOfEvents'],
+               'DateAndTime':np.asarray(Arrays['DateAndTime']).tolist(),
+               'DetectorPos':Info['DetectorPos'],
+               'BarsReadout':[[Bars[Offsets[k]:Offsets[k+1]] for k in range(len(Offsets) - 1)],
+                              [Lengths[Offsets[k]:Offsets[k+1]] for k in range(len(Offsets) - 1)]],
+               'UpperTrigPos':[[],[]],
+               'LowerTrigPos':[[],[]]}
+
+    return RowData
+
+
+
+def SaveRowData(RowData, Directory):
+    # Writes RowData as the arrays of RowDataToArrays in Directory
+    SaveRowDataArrays(*RowDataToArrays(RowData), Directory)
+
+
+
+def SaveRowDataArrays(Arrays, Info, Directory):
+    # Writes the arrays and info of RowDataToArrays in Directory, read back with LoadRowData
+    os.makedirs(Directory, exist_ok=True)
+
+    for Name in Arrays:
+        np.save(os.path.join(Directory, Name + '.npy'), Arrays[Name])
+
+    with open(os.path.join(Directory, 'info.json'), 'w') as File:
+        json.dump(Info, File)
+
+
+
+def LoadRowData(Directory):
+    # Reads RowData written by SaveRowData
+    with open(os.path.join(Directory, 'info.json')) as File:
+        Info = json.load(File)
+
+    Arrays = dict((Name, np.load(os.path.join(Directory, Name + '.npy'), mmap_mode='r')) \
+                  for Name in ['Bars', 'Lengths', 'Offsets', 'DateAndTime'])
+
+    return ArraysToRowData(Arrays, Info)
+
+
+
+# ---------------------------------- Result Store -----------------------------------------
+
+
+
+def _IsRowData(Value):
+    return isinstance(Value, dict) and 'BarsReadout' in Value
+
+
+
+def _IsPixelHits(Value):
+    # ClusteredHittingPoints output, a list of [HittingPoints]
+    return isinstance(Value, list) and len(Value) > 0 and \
+           all(isinstance(Hit, (list, tuple)) and len(Hit) == 1 and np.shape(Hit[0]) == (3,3) for Hit in Value)
+
+
+
+def _IsNumbers(Value):
+    return isinstance(Value, (list, tuple)) and len(Value) > 0 and \
+           all(isinstance(x, (int, float, np.number)) and not isinstance(x, bool) for x in Value)
+
+
+
+def SaveSparse(Matrix, Directory):
+    # Writes the CSR arrays (data, indices, indptr) of Matrix to Directory as .npy files
+    Matrix = sparse.csr_matrix(Matrix)
+
+    os.makedirs(Directory, exist_ok=True)
+
+    for Name in ['data', 'indices', 'indptr']:
+        np.save(os.path.join(Directory, Name + '.npy'), getattr(Matrix, Name))
+
+    with open(os.path.join(Directory, 'shape.json'), 'w') as File:
+        json.dump(list(Matrix.shape), File)
+
+
+
+def LoadSparse(Directory):
+    # CSR matrix written by SaveSparse, its arrays memory-mapped (read only)
+    with open(os.path.join(Directory, 'shape.json')) as File:
+        Shape = tuple(json.load(File))
+
+    Arrays = [np.load(os.path.join(Directory, Name + '.npy'), mmap_mode='r') for Name in ['data', 'indices', 'indptr']]
+
+    return sparse.csr_matrix(tuple(Arrays), shape=Shape, copy=False)
+
+
+
+def _SaveEntry(Value, Directory, Path):
+
+    #--------------------------------------------------------------------
+    # Writes one value to Directory/Path and returns its index entry
+    #--------------------------------------------------------------------
+
+    if isinstance(Value, np.ndarray) and Value.dtype != object:
+        np.save(os.path.join(Directory, Path + '.npy'), Value)
+        return {'Kind':'Array', 'Path':Path + '.npy'}
+
+    if _IsNumbers(Value):
+        np.save(os.path.join(Directory, Path + '.npy'), np.asarray(Value))
+        return {'Kind':'Array', 'Path':Path + '.npy'}
+
+    if _IsRowData(Value):
+        SaveRowData(Value, os.path.join(Directory, Path))
+        return {'Kind':'RowData', 'Path':Path}
+
+    if Tracks.IsTrackBundle(Value):
+        Tracks.Save(Value, os.path.join(Directory, Path))
+        return {'Kind':'Tracks', 'Path':Path}
+
+    if _IsPixelHits(Value):
+        np.save(os.path.join(Directory, Path + '.npy'), np.array([Hit[0] for Hit in Value], dtype=float))
+        return {'Kind':'PixelHits', 'Path':Path + '.npy'}
+
+    if sparse.issparse(Value):
+        SaveSparse(Value, os.path.join(Directory, Path))
+        return {'Kind':'Sparse', 'Path':Path}
+
+    dump(Value, os.path.join(Directory, Path + '.joblib'))
+    return {'Kind':'Object', 'Path':Path + '.joblib'}
+
+
+
+def _LoadEntry(Entry, Directory):
+    Path = os.path.join(Directory, Entry['Path'])
+
+    if Entry['Kind'] == 'Array':
+        return np.load(Path, mmap_mode='r')
+
+    if Entry['Kind'] == 'RowData':
+        return LoadRowData(Path)
+
+    if Entry['Kind'] == 'Tracks':
+        return Tracks.Load(Path)
+
+    if Entry['Kind'] == 'PixelHits':
+        return Tracks.TrackBundle(np.load(Path, mmap_mode='r'))
+
+    if Entry['Kind'] == 'Sparse':
+        return LoadSparse(Path)
+
+    return load(Path)
+
+
+
+def SaveResults(Dict, Directory):
+
+    #--------------------------------------------------------------------
+    # Writes a ReadDict / AnalyseDict style dictionary to Directory. Lists
+    # and tuples (eg. one entry per detector) have each element written
+    # separately so single detectors can be read back alone. The files are
+    # written to a new directory which then replaces Directory, so arrays
+    # still mapped from an earlier version stay valid
+    #--------------------------------------------------------------------
+
+    Final = Directory
+    Directory = Directory.rstrip(os.sep) + '.partial'
+
+    if os.path.isdir(Directory):
+        shutil.rmtree(Directory)
+
+    os.makedirs(Directory)
+
+    Index = {}
+
+    for Key in Dict:
+        Value = Dict[Key]
+
+        if isinstance(Value, LazyList):
+            Value = list(Value)
+
+        Path = Key.replace('/', '_')
+
+        if isinstance(Value, (list, tuple)) and not _IsNumbers(Value) and not _IsPixelHits(Value):
+            os.makedirs(os.path.join(Directory, Path), exist_ok=True)
+
+            Items = [_SaveEntry(Value[i], Directory, os.path.join(Path, str(i))) for i in range(len(Value))]
+            Index[Key] = {'Kind':'List', 'Items':Items}
+
+        else:
+            Index[Key] = _SaveEntry(Value, Directory, Path)
+
+    with open(os.path.join(Directory, IndexName), 'w') as File:
+        json.dump(Index, File, indent=1)
+
+    if os.path.isdir(Final):
+        shutil.rmtree(Final)
+
+    os.rename(Directory, Final)
+
+
+
+class LazyList(Sequence):
+
+    #--------------------------------------------------------------------
+    # A stored list whose elements are read on first access
+    #--------------------------------------------------------------------
+
+    def __init__(self, Items, Directory):
+        self.Items = Items
+        self.Directory = Directory
+        self.Loaded = {}
+
+    def __len__(self):
+        return len(self.Items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        i = range(len(self))[i]
+
+        if i not in self.Loaded:
+            self.Loaded[i] = _LoadEntry(self.Items[i], self.Directory)
+
+        return self.Loaded[i]
+
+
+
+class ResultStore(MutableMapping):
+
+    #--------------------------------------------------------------------
+    # Dictionary view of a directory written by SaveResults. Entries are
+    # read when first accessed (arrays memory-mapped, per-detector lists
+    # as LazyLists). Assigned entries are kept in memory until Save
+    #--------------------------------------------------------------------
+
+    def __init__(self, Directory):
+        self.Directory = Directory
+
+        with open(os.path.join(Directory, IndexName)) as File:
+            self.Index = json.load(File)
+
+        self.Loaded = {}
+
+    def __getitem__(self, Key):
+        if Key not in self.Loaded:
+            Entry = self.Index[Key]
+
+            if Entry['Kind'] == 'List':
+                self.Loaded[Key] = LazyList(Entry['Items'], self.Directory)
+
+            else:
+                self.Loaded[Key] = _LoadEntry(Entry, self.Directory)
+
+        return self.Loaded[Key]
+
+    def __setitem__(self, Key, Value):
+        self.Loaded[Key] = Value
+        self.Index.setdefault(Key, None)
+
+    def __delitem__(self, Key):
+        del self.Index[Key]
+        self.Loaded.pop(Key, None)
+
+    def __iter__(self):
+        return iter(self.Index)
+
+    def __len__(self):
+        return len(self.Index)
+
+    def Save(self, Directory=None):
+        # Writes every entry (read or assigned) to Directory, by default the one it was read from
+        SaveResults(dict((Key, self[Key]) for Key in self), Directory or self.Directory)
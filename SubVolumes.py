@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Cropped ObjectView volumes. Each detector's (or beam's) tracks only
+# cross a cone of the ImageVolume, so ObjectView(..., Crop=True) fills
+# just the block of voxels around it and returns it as a sub-volume:
+#
+#     {'Counts': the block, 'Offset': (i, j, k) of its first voxel,
+#      'Shape': shape of the full volume}
+#
+# The functions below scale, overlap and add sub-volumes without making
+# the full volumes, giving the same results as td.ScaleLayers,
+# td.GroupOverlaps and td.ScaleGroups on the full ones (Pipeline uses
+# them when Config.Crop is set). Full() makes the full volume if needed
+#--------------------------------------------------------------------
+
+import numpy as np
+import ThreeD_Tracking as td
+
+
+
+def SubVolume(Counts, Offset, Shape):
+    # Sub-volume of Counts placed at Offset (voxel indices) in a volume of Shape
+    return {'Counts':np.asarray(Counts), 'Offset':tuple(int(First) for First in Offset), 'Shape':tuple(int(Size) for Size in Shape)}
+
+
+
+def IsSubVolume(Value):
+    return isinstance(Value, dict) and 'Counts' in Value and 'Offset' in Value
+
+
+
+def Slices(Sub):
+    # Slices of the full volume covered by Sub
+    return tuple(slice(First, First + Size) for First, Size in zip(Sub['Offset'], np.shape(Sub['Counts'])))
+
+
+
+def Full(Sub):
+    # The full volume of Sub (zero outside it), dense arrays are returned as they are
+    if not IsSubVolume(Sub):
+        return np.asarray(Sub)
+
+    Volume = np.zeros(Sub['Shape'])
+    Volume[Slices(Sub)] = Sub['Counts']
+
+    return Volume
+
+
+
+def Crop(Volume):
+    # Sub-volume of the smallest block holding the nonzero voxels of a full Volume
+    Volume = np.asarray(Volume)
+    Nonzero = np.nonzero(Volume)
+
+    if len(Nonzero[0]) == 0:
+        return SubVolume(np.zeros((0,) * Volume.ndim), (0,) * Volume.ndim, Volume.shape)
+
+    Offset = [int(Axis.min()) for Axis in Nonzero]
+    Block = tuple(slice(First, int(Axis.max()) + 1) for First, Axis in zip(Offset, Nonzero))
+
+    return SubVolume(Volume[Block], Offset, Volume.shape)
+
+
+
+def Maximum(Sub):
+    # Largest count of Sub (0 if it is empty), as np.max of its full volume for counts >= 0
+    Counts = Sub['Counts'] if IsSubVolume(Sub) else np.asarray(Sub)
+
+    return np.max(Counts) if Counts.size else 0.0
+
+
+
+def Intersection(First, Second):
+
+    #--------------------------------------------------------------------
+    # Slices of First['Counts'] and Second['Counts'] covering the voxels
+    # they share, or None if they do not meet
+    #--------------------------------------------------------------------
+
+    Into, From = [], []
+
+    for A, B, SizeA, SizeB in zip(First['Offset'], Second['Offset'], np.shape(First['Counts']), np.shape(Second['Counts'])):
+        Begin, End = max(A, B), min(A + SizeA, B + SizeB)
+
+        if Begin >= End:
+            return None
+
+        Into.append(slice(Begin - A, End - A))
+        From.append(slice(Begin - B, End - B))
+
+    return tuple(Into), tuple(From)
+
+
+
+def Sum(Subs, Weights=None):
+    # Sub-volume of the sum of Subs (times Weights), covering the block holding all of them
+    Subs = [Sub for Sub in Subs]
+    Weights = np.ones(len(Subs)) if Weights is None else Weights
+    Shape = Subs[0]['Shape']
+
+    Filled = [k for k in range(len(Subs)) if np.size(Subs[k]['Counts'])]
+
+    if not Filled:
+        return SubVolume(np.zeros((0,) * len(Shape)), (0,) * len(Shape), Shape)
+
+    Offset = [min(Subs[k]['Offset'][Axis] for k in Filled) for Axis in range(len(Shape))]
+    End = [max(Subs[k]['Offset'][Axis] + np.shape(Subs[k]['Counts'])[Axis] for k in Filled) for Axis in range(len(Shape))]
+
+    Total = SubVolume(np.zeros([Last - First for First, Last in zip(Offset, End)]), Offset, Shape)
+
+    for k in Filled:
+        Block = tuple(slice(First - Begin, First - Begin + Size) for First, Begin, Size in zip(Subs[k]['Offset'], Offset, np.shape(Subs[k]['Counts'])))
+        Total['Counts'][Block] += Subs[k]['Counts'] * Weights[k]
+
+    return Total
+
+
+
+def Total(Volumes):
+    # Full volume of the sum of Volumes, either full volumes or sub-volumes
+    if len(Volumes) and IsSubVolume(Volumes[0]):
+        return Full(Sum(Volumes))
+
+    return np.sum(Volumes, axis=0)
+
+
+
+# ---------------------------------- Analysis -----------------------------------------
+
+
+
+def ScaleLayers(Subs):
+    # td.ScaleLayers(Counts, True) of each sub-volume: every layer scaled to the largest count of the volume
+    Scaled = []
+
+    for Sub in Subs:
+        Counts = np.array(Sub['Counts'], dtype=float)
+        Max = Maximum(Sub)
+
+        for j in range(np.shape(Counts)[2]):
+            if Counts[:,:,j].size and np.max(Counts[:,:,j]) != 0:
+                Counts[:,:,j] = Counts[:,:,j] * Max / np.max(Counts[:,:,j])
+
+        Scaled.append(SubVolume(Counts, Sub['Offset'], Sub['Shape']))
+
+    return Scaled
+
+
+
+def GroupOverlaps(Subs):
+
+    #--------------------------------------------------------------------
+    # td.GroupOverlaps of sub-volumes of counts >= 0: a pair overlaps if
+    # both are nonzero at any voxel, which is only looked for where their
+    # blocks meet. Returns (ObjectGroups, OverlapLists)
+    #--------------------------------------------------------------------
+
+    N = len(Subs)
+    Overlaps = np.zeros((N, N), dtype=bool)
+
+    for i in range(N):
+        for j in range(i + 1, N):
+            Shared = Intersection(Subs[i], Subs[j])
+
+            if Shared is not None:
+                Overlaps[i,j] = Overlaps[j,i] = np.any((Subs[i]['Counts'][Shared[0]] != 0) & (Subs[j]['Counts'][Shared[1]] != 0))
+
+    OverlapLists = [[i,j] for i in range(N) for j in range(N) if Overlaps[i,j]]
+
+    return td.GroupPairs(OverlapLists), OverlapLists
+
+
+
+def ScaleGroups(Subs, Groups, Maxima, OverlapCutoff, Config=None):
+
+    #--------------------------------------------------------------------
+    # td.ScaleGroups of sub-volumes: the layers where each pair of a
+    # group overlaps by more than OverlapCutoff of the largest count of
+    # the layer (counted in Targets), and the scaled sum of each group's
+    # sub-volumes, as a sub-volume, for DetectorCounts
+    #--------------------------------------------------------------------
+
+    Layers = td.GetConfig(Config).ProjectionPixel[2]
+
+    DetectorCounts = []
+    AddedMaxima = []
+    Targets = np.zeros((len(Groups), Layers))
+
+    for i in range(len(Groups)):
+        Temp = []
+        Scaled, Weights = [], []
+
+        for j in Groups[i]:
+            LayerMax = np.zeros(Layers)
+            Counts = Subs[j]['Counts']
+
+            if Counts.size:
+                LayerMax[Subs[j]['Offset'][2]:Subs[j]['Offset'][2] + np.shape(Counts)[2]] = np.max(Counts, axis=(0, 1))
+
+            for k in Groups[i]:
+                if j != k:
+                    Overlap = np.zeros(Layers)
+                    Shared = Intersection(Subs[j], Subs[k])
+
+                    if Shared is not None:
+                        Into, From = Shared
+                        Minus = Counts[Into] - Subs[k]['Counts'][From]
+                        Minus[Minus < 0] = 0
+
+                        First = Subs[j]['Offset'][2] + Into[2].start
+                        Overlap[First:First + np.shape(Minus)[2]] = np.abs(np.sum(Counts[Into] - Minus, axis=(0, 1)))
+
+                    Targets[i] += np.where(Overlap > LayerMax * OverlapCutoff, 1, 2)
+
+            if Maxima[j] != 0 and not Maxima[j] in Temp: # assumes that if maxima are the same then clustered array is a duplicate
+                Scaled.append(Subs[j])
+                Weights.append(np.max(Maxima) / Maxima[j])
+
+                Temp.append(Maxima[j])
+
+        DetectorCounts.append(Sum(Scaled, Weights) if Scaled else SubVolume(np.zeros((0, 0, 0)), (0, 0, 0), Subs[0]['Shape']))
+        AddedMaxima.append(Temp)
+
+    return DetectorCounts, AddedMaxima, Targets
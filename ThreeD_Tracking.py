@@ -14,6 +14,7 @@ import datetime
 import math
 import os
 import glob
+from dataclasses import dataclass, field, replace
 
 # Plotting
 from matplotlib import cm
@@ -31,14 +32,16 @@ from sklearn.cluster import AffinityPropagation
 
 from joblib import dump, load
 from scipy.optimize import curve_fit
+from scipy import ndimage
 import imageio
 
+import Profiling
+import Pose
+import Tracks
 
 
 print("Hello Viewer!")
 
-begin_time = datetime.datetime.now()
-
 
 
 #---------------------------------- Special Commands --------------------------------------
@@ -83,6 +86,8 @@ ImageVolume = [3000, 3000, TopDepth - ObjectZ]                  #[cm] Dimensions
 #---------------------
 ProjectionPixel = [143, 143, 30]                                #Resolution of images, ProjectionPixel[2] is number of image layers
 Cutoff = [0.3, 0.5, 0.7, 0.8]                                   #Thresholds as fraction of maximum in ScatterDistance()
+Projection = 'Nearest'                                          #'Nearest' ==> one count per image layer at the nearest pixel. 'Count' / 'Length' ==> every voxel crossed, weighted by 1 / path length [cm] (TraceSegments)
+Crop = False                                                    #True ==> ObjectView only fills the block of voxels its tracks cross (SubVolumes.py)
 
 #ProjectionPixel = [143, 143, 30]   
  
@@ -96,6 +101,8 @@ PercentCutoff = 0.05                                             #Cutoff as a fr
 OverlapCutoff = 0.4                                             #Cutoff as fraction of number of hitting points for determining overlap with ScaleGroups() 
 LocalCutoff3D = 0.6                                            #Index cutoff for LayerCluster()
 PercentCutoff3D = 0.35                                          #Clustering cutoff for LayerCluster()
+Connectivity = 6                                                #6 ==> voxels sharing a face are connected in ClusterVolume(), 26 ==> sharing a face, edge or corner
+PyramidLevel = 0                                                #>0 ==> seeds and overlaps are found this many 2x coarser levels up first (Pyramid.py)
  
                                                                 #Take PercentCutoff3D as largest st. final output is non zero
 
@@ -107,6 +114,297 @@ PredictLayers = False                                           #True ==> classi
 Which = None                                                   #None ==> real analysis will be run. [i,j,k,l] all are 1 or 0 for manufactured beams             
 Iterate = False                                                 #
 dense = True
+
+
+#---------------------
+# Run Configuration
+#---------------------
+
+@dataclass(frozen=True)
+class RunConfig:
+    
+    #--------------------------------------------------------------------
+    # Immutable copy of the geometry, imaging and clustering parameters
+    # above which is passed through the pipeline instead of reading the
+    # module globals. Derived constants (image layer heights, index
+    # scaling) are computed once on construction. ImageVolume and 
+    # ClusterLayer follow TopDepth, ObjectZ and ProjectionPixel if None
+    #--------------------------------------------------------------------
+    
+    TriggerSize: float = TriggerSize
+    BarWidth: float = BarWidth
+    BarHight: float = BarHight
+    NumOfBars: int = NumOfBars
+    TriggerWidth: float = TriggerWidth
+    
+    TopDepth: float = TopDepth
+    ImageLayerSize: tuple = tuple(ImageLayerSize)
+    ObjectZ: float = ObjectZ
+    ImageVolume: tuple = None
+    
+    ProjectionPixel: tuple = tuple(ProjectionPixel)
+    Cutoff: tuple = tuple(Cutoff)
+    Projection: str = Projection
+    Crop: bool = Crop
+    
+    Divide: tuple = tuple(Divide)
+    ClusterLayer: int = None
+    LocalCutoff: float = LocalCutoff
+    PercentCutoff: float = PercentCutoff
+    OverlapCutoff: float = OverlapCutoff
+    LocalCutoff3D: float = LocalCutoff3D
+    PercentCutoff3D: float = PercentCutoff3D
+    Connectivity: int = Connectivity
+    PyramidLevel: int = PyramidLevel
+    
+    Iterate: bool = Iterate
+    Which: tuple = None
+    
+    # Derived constants
+    DetectorBase: float = field(init=False, repr=False, compare=False)     #[cm] Height of the top of the detector less the plane seperation
+    BarSide: float = field(init=False, repr=False, compare=False)          #[cm] Length of the slanted side of a bar
+    BarCos: float = field(init=False, repr=False, compare=False)
+    BarSin: float = field(init=False, repr=False, compare=False)
+    LayerOffsets: np.ndarray = field(init=False, repr=False, compare=False) #[cm] Height of each image layer above the detector
+    ClusterOffset: float = field(init=False, repr=False, compare=False)    #[cm] Height of ClusterLayer above the detector
+    ObjectOffsets: np.ndarray = field(init=False, repr=False, compare=False) #[cm] Height of each ObjectView layer above ObjectZ
+    LayerGrid: 'ImageGrid' = field(init=False, repr=False, compare=False)  #Image layers of PazAnalysis (ImageLayerSize)
+    VolumeGrid: 'ImageGrid' = field(init=False, repr=False, compare=False) #Image volume of ObjectView (ImageVolume)
+    
+    def __post_init__(self):
+        Set = lambda Name, Value: object.__setattr__(self, Name, Value)
+        
+        for Name in ['ImageLayerSize', 'ProjectionPixel', 'Cutoff', 'Divide']:
+            Set(Name, tuple(getattr(self, Name)))
+        
+        if self.ImageVolume is None:
+            Set('ImageVolume', (3000, 3000, self.TopDepth - self.ObjectZ))
+            
+        else:
+            Set('ImageVolume', tuple(self.ImageVolume))
+            
+        if self.ClusterLayer is None:
+            Set('ClusterLayer', self.ProjectionPixel[2] - 1)
+        
+        if self.Which is not None:
+            Set('Which', tuple(self.Which))
+        
+        if self.Projection not in Projections:
+            raise ValueError('Projection must be one of {}, not {!r}'.format(', '.join(Projections), self.Projection))
+        
+        if self.Connectivity not in Connectivities:
+            raise ValueError('Connectivity must be one of {}, not {!r}'.format(', '.join(map(str, Connectivities)), self.Connectivity))
+        
+        Alpha = np.arctan(2*self.BarHight/self.BarWidth)
+        
+        Set('DetectorBase', 2 * self.TriggerWidth + 4 * self.BarHight)
+        Set('BarSide', np.sqrt(self.BarHight**2+(self.BarWidth/2)**2))
+        Set('BarCos', math.cos(Alpha))
+        Set('BarSin', math.sin(Alpha))
+        
+        LayerOffsets = np.arange(self.ProjectionPixel[2]) * self.TopDepth / self.ProjectionPixel[2]
+        ObjectOffsets = np.arange(self.ProjectionPixel[2]) * self.ImageVolume[2] / self.ProjectionPixel[2]
+        LayerOffsets.flags.writeable = False
+        ObjectOffsets.flags.writeable = False
+        
+        Set('LayerOffsets', LayerOffsets)
+        Set('ClusterOffset', self.ClusterLayer * self.TopDepth / self.ProjectionPixel[2])
+        Set('ObjectOffsets', ObjectOffsets)
+        Set('LayerGrid', ImageGrid(self.ImageLayerSize, self.ProjectionPixel, 0, LayerOffsets))
+        Set('VolumeGrid', ImageGrid(self.ImageVolume[:2], self.ProjectionPixel, self.ObjectZ, ObjectOffsets))
+    
+    def ZUp(self, Seperation):
+        # Height of the top of the detector [cm]
+        return self.DetectorBase + Seperation
+    
+    def LayerZ(self, Seperation):
+        # Heights of the PazAnalysis image layers [cm]
+        return self.ZUp(Seperation) + self.LayerOffsets
+    
+    def ObjectLayerZ(self, Seperation):
+        # Heights of the ObjectView image layers [cm]
+        return self.ZUp(Seperation) + self.ObjectZ + self.ObjectOffsets
+    
+    def Replace(self, **Changes):
+        # Copy with Changes applied, derived defaults are recomputed unless given
+        if 'ImageVolume' not in Changes and self.ImageVolume == (3000, 3000, self.TopDepth - self.ObjectZ):
+            Changes['ImageVolume'] = None
+        
+        if 'ClusterLayer' not in Changes and self.ClusterLayer == self.ProjectionPixel[2] - 1:
+            Changes['ClusterLayer'] = None
+        
+        return replace(self, **Changes)
+    
+    @classmethod
+    def FromGlobals(cls):
+        
+        #--------------------------------------------------------------------
+        # Builds a RunConfig from the current values of the module globals,
+        # so scripts which assign to them (eg. td.ProjectionPixel = ...)
+        # keep working. Identical globals return the same instance
+        #--------------------------------------------------------------------
+        
+        Globals = globals()
+        Key = tuple((Name, tuple(Globals[Name]) if isinstance(Globals[Name], list) else Globals[Name]) \
+                    for Name in _GlobalConfigNames)
+        
+        if Key not in _GlobalConfigs:
+            _GlobalConfigs[Key] = cls(**dict(Key))
+        
+        return _GlobalConfigs[Key]
+
+_GlobalConfigNames = ['TriggerSize', 'BarWidth', 'BarHight', 'NumOfBars', 'TriggerWidth', 'TopDepth',
+                      'ImageLayerSize', 'ObjectZ', 'ImageVolume', 'ProjectionPixel', 'Cutoff', 'Projection', 'Crop', 'Divide', 
+                      'ClusterLayer', 'LocalCutoff', 'PercentCutoff', 'OverlapCutoff', 'LocalCutoff3D', 
+                      'PercentCutoff3D', 'Connectivity', 'PyramidLevel', 'Iterate', 'Which']
+_GlobalConfigs = {}
+
+Projections = ('Nearest', 'Count', 'Length')
+Connectivities = {6:1, 26:3} # neighbours: ndimage.generate_binary_structure rank
+EventChunk = 2**14 # events whose counts PazAnalysis and ParallelPazAnalysis sum on their own before adding them in order
+
+
+
+class ImageGrid:
+    
+    #--------------------------------------------------------------------
+    # Regular grid of image pixels covering Extent [cm] in x and y with 
+    # Shape[0] x Shape[1] pixels centred on Centre, and Shape[2] image 
+    # layers at heights ZStart + Offsets above the top of the detector.
+    # The one place world coordinates are converted to pixel indices
+    #--------------------------------------------------------------------
+    
+    def __init__(self, Extent, Shape, ZStart=0, Offsets=None, Centre=(0, 0)):
+        self.Extent = tuple(Extent[:2])
+        self.Shape = tuple(Shape)
+        self.ZStart = ZStart
+        self.Centre = tuple(Centre)
+        self.Half = (self.Extent[0]/2, self.Extent[1]/2)
+        self.Span = (self.Shape[0]-1, self.Shape[1]-1) # pixels between the edges of Extent
+        self.Offsets = Offsets if Offsets is not None else np.zeros(self.Shape[2] if len(self.Shape) > 2 else 1)
+    
+    @classmethod
+    def Volume(cls, ImageVolume, Resolution, ObjectZ):
+        # Grid of ObjectView / ScatterDistance for the given volume and resolution
+        return cls(ImageVolume[:2], Resolution, ObjectZ, np.arange(Resolution[2]) * ImageVolume[2] / Resolution[2])
+    
+    def Centred(self, Centre):
+        # The same grid moved to be centred on Centre (eg. a detector position)
+        return ImageGrid(self.Extent, self.Shape, self.ZStart, self.Offsets, Centre[:2])
+    
+    def LayerZ(self, ZUp):
+        # Heights of the image layers given the height of the top of the detector
+        return ZUp + self.ZStart + self.Offsets
+    
+    def WorldToIndex(self, X, Y):
+        
+        #--------------------------------------------------------------------
+        # Nearest pixel indices of world coordinates X, Y (arrays of any 
+        # shape). Non finite coordinates are given the index -1
+        #--------------------------------------------------------------------
+        
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        
+        Iind = np.rint(((X - self.Centre[0]) + self.Half[0]) * self.Span[0] / self.Extent[0])
+        Jind = np.rint(((Y - self.Centre[1]) + self.Half[1]) * self.Span[1] / self.Extent[1])
+        
+        Finite = np.isfinite(Iind) & np.isfinite(Jind)
+        
+        return np.where(Finite, Iind, -1).astype(np.int64), np.where(Finite, Jind, -1).astype(np.int64)
+    
+    def IndexToWorld(self, Iind, Jind):
+        # World coordinates [cm] of the pixel centres at Iind, Jind
+        X = np.asarray(Iind) * self.Extent[0] / self.Span[0] - self.Half[0] + self.Centre[0]
+        Y = np.asarray(Jind) * self.Extent[1] / self.Span[1] - self.Half[1] + self.Centre[1]
+        
+        return X, Y
+    
+    def Edges(self, ZUp):
+        
+        #--------------------------------------------------------------------
+        # Voxel boundaries [cm] in x, y and z of the grid, with the image 
+        # layers at LayerZ(ZUp). Pixels are centred on their IndexToWorld
+        # coordinates and each layer extends from its height up to the next
+        # (the last as far as the one before)
+        #--------------------------------------------------------------------
+        
+        if len(self.Offsets) < 2:
+            raise ValueError('Voxel boundaries need at least two image layers')
+        
+        X = (np.arange(self.Shape[0] + 1) - 0.5) * self.Extent[0] / self.Span[0] - self.Half[0] + self.Centre[0]
+        Y = (np.arange(self.Shape[1] + 1) - 0.5) * self.Extent[1] / self.Span[1] - self.Half[1] + self.Centre[1]
+        
+        Z = self.LayerZ(ZUp)
+        Z = np.append(Z, 2 * Z[-1] - Z[-2])
+        
+        return X, Y, Z
+    
+    def Box(self, X, Y):
+        
+        #--------------------------------------------------------------------
+        # (Offset, Shape) of the smallest block of pixels, through all the
+        # layers, holding every finite point X, Y inside the grid (points
+        # outside are clipped to its edge). An empty block if there are none
+        #--------------------------------------------------------------------
+        
+        Iind, Jind = self.WorldToIndex(X, Y)
+        Finite = (Iind != -1) & (Jind != -1)
+        Layers = self.Shape[2] if len(self.Shape) > 2 else 1
+        
+        if not np.any(Finite):
+            return (0, 0, 0), (0, 0, Layers)
+        
+        Iind = np.clip(Iind[Finite], 0, self.Shape[0] - 1)
+        Jind = np.clip(Jind[Finite], 0, self.Shape[1] - 1)
+        
+        Offset = (int(Iind.min()), int(Jind.min()), 0)
+        
+        return Offset, (int(Iind.max()) - Offset[0] + 1, int(Jind.max()) - Offset[1] + 1, Layers)
+    
+    def InBounds(self, Iind, Jind):
+        # Mask of indices inside the image (index 0 is excluded as in the original stages)
+        return (Iind > 0) & (Jind > 0) & (Iind < self.Shape[0]) & (Jind < self.Shape[1])
+    
+    def FlatIndices(self, X, Y, Rows=False):
+        
+        #--------------------------------------------------------------------
+        # Flat indices into an image of the grid of the points X, Y inside 
+        # it. X and Y have shape (N,) for a 2D image or (N, L) for one point
+        # per image layer, indexing a (Shape[0], Shape[1], L) array. If Rows,
+        # the row (0 to N-1) of each index is returned as well
+        #--------------------------------------------------------------------
+        
+        Iind, Jind = self.WorldToIndex(X, Y)
+        Mask = self.InBounds(Iind, Jind)
+        
+        Flat = Iind[Mask] * self.Shape[1] + Jind[Mask]
+        
+        if Iind.ndim > 1:
+            Layer = np.broadcast_to(np.arange(Iind.shape[1]), Iind.shape)
+            Flat = Flat * Iind.shape[1] + Layer[Mask]
+        
+        if Rows:
+            return Flat, np.nonzero(Mask)[0]
+        
+        return Flat
+    
+    def ImageShape(self, X):
+        # Shape of the image FlatIndices(X, Y) indexes
+        return self.Shape[:2] + np.shape(X)[1:]
+    
+    def Histogram(self, X, Y):
+        # Counts the points X, Y (see FlatIndices) in each pixel
+        Shape = self.ImageShape(X)
+        
+        return np.bincount(self.FlatIndices(X, Y), minlength=int(np.prod(Shape))).astype(float).reshape(Shape)
+
+
+
+def GetConfig(Config=None):
+    # Config if one is given, otherwise the configuration described by the module globals
+    return Config if Config is not None else RunConfig.FromGlobals()
+
     
 
 # --------------------------------- Translation of Gilad's Code -----------------------------------------
@@ -120,56 +418,115 @@ def ReadRowDataFileFastest(FileName,DetectorPos): #must use 'path/Filename' (inc
     # information contained in the file
     #--------------------------------------------------------------------
     
-    begin_time = datetime.datetime.now()
+    with Profiling.Stage('ReadRowDataFileFastest'):
+        G = np.loadtxt(FileName, dtype = str, delimiter = '~') #Delimiter '~' is chosen in order to avoid default whitespace delimiter
     
-    G = np.loadtxt(FileName, dtype = str, delimiter = '~') #Delimiter '~' is chosen in order to avoid default whitespace delimiter
-    Gsize = len(G)
+        EventWordInd = np.flatnonzero(G == '*Event*').tolist()
+        n = len(EventWordInd)
     
-    EventWordInd = []
-    n = 0
+        RowData = {'FileName':FileName,
+                   'NumberOfEvents':n,
+                   'DateAndTime':[],
+                   'DetectorPos':DetectorPos, #Coordinates (in x,y plane) of the Detector
+                   'BarsReadout': [[],[]],
+                   'UpperTrigPos':[[],[]],
+                   'LowerTrigPos':[[],[]]} #Trig Positions are left empty, can be filled if needed
+    
+        for i in range(n):
+            RowData['DateAndTime'].append(G[EventWordInd[i]+2])   
+       
+        RowData['BarsReadout'] = RowDataEvents(G, EventWordInd[:n-1], 'Reading ' + str(FileName)) # -1 to avoid error from length of last event 
+        Profiling.Count('Events', len(RowData['BarsReadout'][0]))
+        
+        print('There were ', n,' events in ', FileName,', the simulation ran between ', \
+              RowData['DateAndTime'][0],' - ',RowData['DateAndTime'][n-1],'.')
+
+    return RowData
+
+
+
+def RowDataEvents(G, EventWordInd, Name='Reading'):
     
-    for i in range(Gsize):    
-        if G[i] == '*Event*':
-            n += 1
-            EventWordInd.append(i)
+    #--------------------------------------------------------------------
+    # Reads the bar numbers and path lengths of the events starting at 
+    # the lines EventWordInd of G, giving BarsReadout. Progress is 
+    # reported as Name (see Profiling.SetProgress)
+    #--------------------------------------------------------------------
     
-    RowData = {'FileName':FileName,
-               'NumberOfEvents':n,
-               'DateAndTime':[],
-               'DetectorPos':DetectorPos, #Coordinates (in x,y plane) of the Detector
-               'BarsReadout': [[],[]],
-               'UpperTrigPos':[[],[]],
-               'LowerTrigPos':[[],[]]} #Trig Positions are left empty, can be filled if needed
+    BarsReadout = [[],[]]
     
-    for i in range(n):
-        RowData['DateAndTime'].append(G[EventWordInd[i]+2])   
-       
-    for i in range(n-1): # -1 to avoid error from length of last event 
+    Tracker = Profiling.Progress(Name, len(EventWordInd))
+    
+    for i in range(len(EventWordInd)):
+        if i >= Tracker.Next:
+            Tracker.Update(i)
+        
         Bar = []
         Length = []
         
-        for l in range(12):
+        for l in range(min(12, len(G) - EventWordInd[i])):
             if 12 <= len(G[EventWordInd[i]+l]) <= 13: #Bounds depend delicately on precision of path lengths
                 Bar.append(G[EventWordInd[i]+l][0:3])
                 Length.append(G[EventWordInd[i]+l][4:])
     
-        BarFloat = np.float_(Bar).tolist() #Converts string elements to float
-        LengthFloat = np.float_(Length).tolist()
-        
-        RowData['BarsReadout'][0].append(BarFloat)
-        RowData['BarsReadout'][1].append(LengthFloat)
+        BarFloat = np.float64(Bar).tolist() #Converts string elements to float
+        LengthFloat = np.float64(Length).tolist()
         
-    print('There were ', n,' events in ', FileName,', the simulation ran between ', \
-          RowData['DateAndTime'][0],' - ',RowData['DateAndTime'][n-1],'.')
+        BarsReadout[0].append(BarFloat)
+        BarsReadout[1].append(LengthFloat)
     
-    tictoc = datetime.datetime.now() - begin_time
-    print('It took ', tictoc,' to read the file.') #',FileName)
+    Tracker.Finish(len(EventWordInd))
+    
+    return BarsReadout
 
-    return RowData
+
+
+def ReadRowDataIncrement(FileName, DetectorPos, Offset=0):
+    
+    #--------------------------------------------------------------------
+    # Reads the events appended to a RowData.out file since byte Offset,
+    # for files which are still being written. An event is only read once
+    # the next one has started, so the returned NewOffset (the start of 
+    # the first unread event) can be passed back in to continue reading
+    #--------------------------------------------------------------------
+    
+    with open(FileName, 'rb') as File:
+        File.seek(Offset)
+        Text = File.read()
+    
+    Starts = []
+    G = []
+    Position = Offset
+    
+    for Line in Text.splitlines(keepends=True):
+        Stripped = Line.decode().rstrip('\r\n').split('#')[0] # as np.loadtxt in ReadRowDataFileFastest
+        
+        if Stripped.strip() != '':
+            if Stripped == '*Event*':
+                Starts.append(Position)
+            
+            G.append(Stripped)
+            
+        Position += len(Line)
+    
+    EventWordInd = [i for i in range(len(G)) if G[i] == '*Event*']
+    n = max(len(EventWordInd) - 1, 0) # the last event may still be being written
+    
+    RowData = {'FileName':FileName,
+               'NumberOfEvents':n + 1, # as ReadRowDataFileFastest, BarsReadout holds NumberOfEvents - 1 events
+               'DateAndTime':[G[EventWordInd[i]+2] for i in range(n)],
+               'DetectorPos':DetectorPos,
+               'BarsReadout':RowDataEvents(G, EventWordInd[:n]),
+               'UpperTrigPos':[[],[]],
+               'LowerTrigPos':[[],[]]}
+    
+    NewOffset = Starts[n] if n > 0 else Offset
+    
+    return RowData, NewOffset
 
 
 
-def CalcLocalPos(Bar,Length): #Arguments are BarsReadout elements from one event
+def CalcLocalPos(Bar,Length,Config=None): #Arguments are BarsReadout elements from one event
     # LocalPos == [LocalX or LocalY, LocalZ]
     
     #--------------------------------------------------------------------
@@ -178,6 +535,9 @@ def CalcLocalPos(Bar,Length): #Arguments are BarsReadout elements from one event
     # event
     #--------------------------------------------------------------------
     
+    Config = GetConfig(Config)
+    BarWidth, BarHight = Config.BarWidth, Config.BarHight
+    
     LengthLocal = [[],[],[],[]]
     BarLocal = [[],[],[],[]]
     LocalPos = [[],[],[],[]]
@@ -186,8 +546,7 @@ def CalcLocalPos(Bar,Length): #Arguments are BarsReadout elements from one event
          LengthLocal[math.floor(Bar[n]/100)-1].append(Length[n])
          BarLocal[math.floor(Bar[n]/100)-1].append(Bar[n])
          
-    a = np.sqrt(BarHight**2+(BarWidth/2)**2)
-    Alpha = np.arctan(2*BarHight/BarWidth)
+    a = Config.BarSide
     
     for i in range(len(LengthLocal)):
         NumOfBarsLocal = len(LengthLocal[i])
@@ -225,12 +584,12 @@ def CalcLocalPos(Bar,Length): #Arguments are BarsReadout elements from one event
                                    [LengthLocal[i][mxind],LengthLocal[i][mxind-1]]],axis = 0) 
             '''
             if BarLocal[i][0]%2 == 0: #The first bar's vertex is facing down
-                X = BarWidth/2 - (a*Readout[0]/(Readout[0]+Readout[1]))*math.cos(Alpha)
-                Z = BarHight/2 - (a*Readout[0]/(Readout[0]+Readout[1]))*math.sin(Alpha)
+                X = BarWidth/2 - (a*Readout[0]/(Readout[0]+Readout[1]))*Config.BarCos
+                Z = BarHight/2 - (a*Readout[0]/(Readout[0]+Readout[1]))*Config.BarSin
             
             else: #The first bar's vertex is facing up
-                X = -BarWidth/2 + (a*Readout[1]/(Readout[0]+Readout[1]))*math.cos(Alpha)
-                Z = BarHight/2 - (a*Readout[1]/(Readout[0]+Readout[1]))*math.sin(Alpha)
+                X = -BarWidth/2 + (a*Readout[1]/(Readout[0]+Readout[1]))*Config.BarCos
+                Z = BarHight/2 - (a*Readout[1]/(Readout[0]+Readout[1]))*Config.BarSin
             
         LocalPos[i] = [X,Z] #[X/2 + np.random.random()*X, Z/2 + np.random.random()*Z] #randomize 50% (increases computing time)
             
@@ -238,7 +597,7 @@ def CalcLocalPos(Bar,Length): #Arguments are BarsReadout elements from one event
 
 
 
-def CalcAbsPos(LocalPos,BarLocal, Seperation):
+def CalcAbsPos(LocalPos,BarLocal, Seperation, Config=None):
     #AbsPos[i] == [AbsX or AbsY, AbsZ] 
     
     #--------------------------------------------------------------------
@@ -246,6 +605,9 @@ def CalcAbsPos(LocalPos,BarLocal, Seperation):
     # and height measured from the bottom of the detector
     #--------------------------------------------------------------------
     
+    Config = GetConfig(Config)
+    TriggerWidth, BarHight, BarWidth, NumOfBars = Config.TriggerWidth, Config.BarHight, Config.BarWidth, Config.NumOfBars
+    
     AbsPos = [[0,0],[0,0],[0,0],[0,0]]
     
     if [-9999,-9999] in LocalPos:
@@ -283,113 +645,350 @@ def CalcAbsPos(LocalPos,BarLocal, Seperation):
 
 
 
-def CalcEventHittingPoints(Bar, Length, ZImage, DetectorPos, Seperation): #( <RowData>['BarsReadout'][0][i], <RowData>['BarsReadout'][1][i], ...)
+#---------------------
+# Event quality codes (see FitEventLine)
+
+QualityOK = 0
+QualityMissingLayer = 1 # a layer of bars has no signal
+QualityVertical = 2 # the trajectory is vertical in x or y (dX == 0 or dY == 0)
+
+QualityNames = {QualityOK:'OK', QualityMissingLayer:'Missing Layer', QualityVertical:'Vertical'}
+
+
+
+def CalcEventLine(Bar, Length, Seperation, Config=None): #( <RowData>['BarsReadout'][0][i], <RowData>['BarsReadout'][1][i], ...)
     
     #--------------------------------------------------------------------
-    # Determines where on each plane (z = const.) the muon passed through 
+    # Fits the trajectory of one event as z = ax * x + bx, z = ay * y + by
+    # in the frame of the detector. Returns [ax, bx, ay, by], or None if a
+    # layer has no signal or the trajectory is vertical in x or y
     #--------------------------------------------------------------------
     
-    HittingPoints = np.zeros(9).reshape((3,3))
+    return FitEventLine(Bar, Length, Seperation, Config)[0]
+
+
+
+def FitEventLine(Bar, Length, Seperation, Config=None):
+    # CalcEventLine and the quality code of the event (QualityOK, QualityMissingLayer or QualityVertical)
+    
+    Config = GetConfig(Config)
     
-    [LocalPos,BarLocal] = CalcLocalPos(Bar,Length)
+    [LocalPos,BarLocal] = CalcLocalPos(Bar,Length,Config)
     
-    AbsPos = CalcAbsPos(LocalPos,BarLocal, Seperation)
+    AbsPos = CalcAbsPos(LocalPos,BarLocal, Seperation, Config)
     
     if AbsPos == -9999:
-        HittingPoints = [[-9999]*3]*3
+        return None, QualityMissingLayer
     
-    else:    
-        AbsXUp = AbsPos[0]
-        AbsYUp = AbsPos[1]
-        AbsXDown = AbsPos[2]
-        AbsYDown = AbsPos[3]
+    AbsXUp = AbsPos[0]
+    AbsYUp = AbsPos[1]
+    AbsXDown = AbsPos[2]
+    AbsYDown = AbsPos[3]
+    
+    dZx = AbsXUp[1] - AbsXDown[1]
+    dX = AbsXUp[0] - AbsXDown[0]
+    
+    dZy = AbsYUp[1] - AbsYDown[1]
+    dY = AbsYUp[0] - AbsYDown[0]
+    
+    if dX == 0 or dY == 0:
+        return None, QualityVertical
+    
+    ax = dZx / dX  
+    ay = dZy / dY
+
+    bx = AbsXUp[1] - ax * AbsXUp[0]
+    by = AbsYUp[1] - ay * AbsYUp[0]
+    
+    return [ax, bx, ay, by], QualityOK
+
+
+
+def EventLines(RowData, Seperation, Config=None, Quality=False):
+    
+    #--------------------------------------------------------------------
+    # Fits the trajectory of every event in RowData (see CalcEventLine), 
+    # giving an (N, 4) array with rows of NaN for rejected events. If 
+    # Quality, the (N,) array of quality codes of the events (QualityOK
+    # etc.) is returned as well, to select events with a mask
+    #--------------------------------------------------------------------
+    
+    Config = GetConfig(Config)
+    
+    Bars, Lengths = RowData['BarsReadout']
+    Lines = np.full((len(Bars), 4), np.nan)
+    Codes = np.zeros(len(Bars), dtype=np.int8)
+    
+    Tracker = Profiling.Progress('Fitting ' + str(RowData.get('FileName', 'tracks')), len(Bars))
+    Rejected = 0
+    
+    for k in range(len(Bars)):
+        if k >= Tracker.Next:
+            Tracker.Update(k, Rejected)
         
-        ZUp = 2 * TriggerWidth + 4 * BarHight + Seperation
-        ZSurf = TopDepth
+        Line, Codes[k] = FitEventLine(Bars[k], Lengths[k], Seperation, Config)
         
-        dZx = AbsXUp[1] - AbsXDown[1]
-        dX = AbsXUp[0] - AbsXDown[0]
+        if Line is not None:
+            Lines[k] = Line
         
-        dZy = AbsYUp[1] - AbsYDown[1]
-        dY = AbsYUp[0] - AbsYDown[0]
+        else:
+            Rejected += 1
+    
+    Tracker.Finish(len(Bars), Rejected)
+    
+    if Profiling.Enabled:
+        for Name, Count in QualityCounts(Codes).items():
+            if Name != QualityNames[QualityOK]:
+                Profiling.Count('Rejected: ' + Name, Count)
+    
+    if Quality:
+        return Lines, Codes
+    
+    return Lines
+
+
+
+def QualityCounts(Codes):
+    # Number of events with each quality code, as {name: count}
+    Counts = np.bincount(np.asarray(Codes, dtype=np.int64), minlength=len(QualityNames))
+    
+    return {Name:int(Counts[Code]) for Code, Name in QualityNames.items()}
+
+
+
+def LineHittingPoints(Lines, ZImages, DetectorPos):
+    
+    #--------------------------------------------------------------------
+    # Points where each trajectory in Lines crosses the planes z = ZImages,
+    # as an (N, len(ZImages), 3) array in world coordinates
+    #--------------------------------------------------------------------
+    
+    Lines = np.asarray(Lines, dtype=float)
+    ZImages = np.asarray(ZImages, dtype=float)
+    
+    Points = np.empty((len(Lines), len(ZImages), 3))
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Points[:,:,0] = (ZImages[None,:] - Lines[:,1,None]) / Lines[:,0,None] + DetectorPos[0]
+        Points[:,:,1] = (ZImages[None,:] - Lines[:,3,None]) / Lines[:,2,None] + DetectorPos[1]
         
-        if dX != 0 and dY != 0:
-            ax = dZx / dX  
-            ay = dZy / dY
+    Points[:,:,2] = ZImages[None,:]
+    
+    return Points
+
+
+
+def LineIndices(Lines, Grid, ZImages, DetectorPos, Rows=False):
+    
+    #--------------------------------------------------------------------
+    # Flat indices of the pixels of Grid each trajectory in Lines crosses
+    # on the planes z = ZImages (into a 3D array), or on the plane 
+    # z = ZImages if it is a number (into a 2D array). If Rows, the row of
+    # Lines giving each index is returned as well
+    #--------------------------------------------------------------------
+    
+    Points = LineHittingPoints(Lines, np.atleast_1d(ZImages), DetectorPos)
+    
+    if np.ndim(ZImages) != 0:
+        return Grid.FlatIndices(Points[:,:,0], Points[:,:,1], Rows)
+    
+    return Grid.FlatIndices(Points[:,0,0], Points[:,0,1], Rows)
+
+
+
+def BoxIndices(Flat, Shape, Box):
+    # Flat indices into the (Offset, Shape) Box of a Shape array of the Flat indices into it which are inside Box
+    Offset, BoxShape = Box
+    Index = [Axis - First for Axis, First in zip(np.unravel_index(Flat, Shape), Offset)]
+    Inside = np.all([(Index[Axis] >= 0) & (Index[Axis] < BoxShape[Axis]) for Axis in range(len(Shape))], axis=0)
+    
+    return np.ravel_multi_index([Axis[Inside] for Axis in Index], BoxShape), Inside
+
+
+
+def HistogramLines(Lines, Grid, ZImages, DetectorPos, Chunk=2**16, Box=None):
+    
+    #--------------------------------------------------------------------
+    # Counts the trajectories in Lines crossing each pixel of Grid (see 
+    # LineIndices). Done in chunks of events to bound memory. Box 
+    # ((Offset, Shape), see ImageGrid.Box) only counts that block of pixels
+    #--------------------------------------------------------------------
+    
+    Shape = Grid.Shape[:2] + np.shape(ZImages)
+    Size = int(np.prod(Box[1] if Box is not None else Shape))
+    DetectorCounts = np.zeros(Size)
+    
+    for Start in range(0, len(Lines), Chunk):
+        Flat = LineIndices(Lines[Start:Start+Chunk], Grid, ZImages, DetectorPos)
         
-            bx = AbsXUp[1] - ax * AbsXUp[0]
-            by = AbsYUp[1] - ay * AbsYUp[0]
-            
-            HittingPoints[0][0] = (ZImage - bx) / ax + DetectorPos[0] #XImage
-            HittingPoints[0][1] = (ZImage - by) / ay + DetectorPos[1] #YImage
-            HittingPoints[0][2] = ZImage #ZImage
-            
-            HittingPoints[1][0] = (ZUp - bx) / ax + DetectorPos[0] #XUp
-            HittingPoints[1][1] = (ZUp - by) / ay + DetectorPos[1] #YUp
-            HittingPoints[1][2] = ZUp #ZUp
-            
-            HittingPoints[2][0] = (ZSurf - bx) / ax + DetectorPos[0] #XSurf
-            HittingPoints[2][1] = (ZSurf - by) / ay + DetectorPos[1] #YSurf
-            HittingPoints[2][2] = ZSurf #ZSurf
-            
-        else:
-            HittingPoints = [[-9999]*3]*3
+        if Box is not None:
+            Flat = BoxIndices(Flat, Shape, Box)[0]
+        
+        DetectorCounts += np.bincount(Flat, minlength=Size)
     
-    return HittingPoints 
+    return DetectorCounts.reshape(Box[1] if Box is not None else Shape)
 
 
 
-def PazAnalysis(RowData, Seperation, Iterate):
+def TraceSegments(Start, End, Grid, ZUp):
     
     #--------------------------------------------------------------------
-    # Creates a 3D array counting the number of trajectories passsing 
-    # through each pixel in the image layers specified by the global
-    # variables 
+    # Siddon style ray traversal: the voxels of Grid (see Grid.Edges) each
+    # segment Start[n] -> End[n] ((N, 3) arrays) crosses and the path 
+    # length [cm] in each. The segments are cut at every voxel boundary 
+    # they cross, all at once by sorting the crossings of each segment.
+    # Returns (Rows, Flat, Lengths), where Flat indexes a Grid.Shape array
+    # as LineIndices does and Rows is the segment of each crossing
     #--------------------------------------------------------------------
     
-    begin_time = datetime.datetime.now()
+    Edges = Grid.Edges(ZUp)
+    Shape = tuple(len(Edge) - 1 for Edge in Edges)
+    
+    Start = np.asarray(Start, dtype=float).reshape((-1, 3))
+    Delta = np.asarray(End, dtype=float).reshape((-1, 3)) - Start
+    
+    # fraction of the way along each segment it crosses each boundary, crossings outside the segment are moved to its end
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Crossings = np.concatenate([(Edges[Axis][None,:] - Start[:,Axis,None]) / Delta[:,Axis,None] for Axis in range(3)], axis=1)
+    
+    Crossings[~((Crossings > 0) & (Crossings < 1))] = 1
+    
+    T = np.concatenate([np.zeros((len(Start), 1)), Crossings, np.ones((len(Start), 1))], axis=1)
+    T.sort(axis=1)
+    
+    Rows, Columns = np.nonzero(np.diff(T, axis=1) > 0)
+    
+    Before, After = T[Rows, Columns], T[Rows, Columns + 1]
+    Middle = Start[Rows] + ((Before + After) / 2)[:,None] * Delta[Rows]
     
-    N = RowData['NumberOfEvents']
+    Index = [np.searchsorted(Edges[Axis], Middle[:,Axis], side='right') - 1 for Axis in range(3)]
+    Inside = np.all([(Index[Axis] >= 0) & (Index[Axis] < Shape[Axis]) for Axis in range(3)], axis=0)
     
-    if Iterate == True:
-        DetectorCounts = np.zeros((ProjectionPixel[0], ProjectionPixel[1], ProjectionPixel[2])) 
+    Flat = (Index[0][Inside] * Shape[1] + Index[1][Inside]) * Shape[2] + Index[2][Inside]
+    Lengths = (After - Before)[Inside] * np.linalg.norm(Delta[Rows[Inside]], axis=1)
+    
+    return Rows[Inside], Flat, Lengths
+
+
+
+def LineSegments(Lines, Grid, ZUp, DetectorPos):
+    # Segments of the trajectories in Lines between the bottom and top of the voxels of Grid, as (Start, End)
+    Z = Grid.Edges(ZUp)[2]
+    Points = LineHittingPoints(Lines, [Z[0], Z[-1]], DetectorPos)
+    
+    return Points[:,0], Points[:,1]
+
+
+
+def DepositSegments(Start, End, Grid, ZUp, Mode='Count', Chunk=2**12, Box=None):
+    
+    #--------------------------------------------------------------------
+    # Volume of Grid.Shape adding up the voxels each segment crosses (see
+    # TraceSegments): one per voxel if Mode is 'Count', the path length
+    # [cm] in it if 'Length'. Done in chunks of segments to bound memory.
+    # Box ((Offset, Shape), see ImageGrid.Box) only fills that block
+    #--------------------------------------------------------------------
+    
+    if Mode not in ('Count', 'Length'):
+        raise ValueError("Mode must be 'Count' or 'Length', not {!r}".format(Mode))
+    
+    Size = int(np.prod(Box[1] if Box is not None else Grid.Shape))
+    Volume = np.zeros(Size)
+    
+    for First in range(0, len(Start), Chunk):
+        Rows, Flat, Lengths = TraceSegments(Start[First:First+Chunk], End[First:First+Chunk], Grid, ZUp)
         
-        for k in range(N-1):
-            for i in range(ProjectionPixel[2]):
-                ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + i*TopDepth/ProjectionPixel[2] #Z coordinate of Image Layer
-                HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, RowData['DetectorPos'], Seperation)
-                
-                if np.all(HittingPoints == -9999):
-                    DetectorCounts = -9999
-                    break
-                
-                else:  
-                    Iind = int(round((HittingPoints[0][0] + ImageLayerSize[0]/2)*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
-                    Jind = int(round((HittingPoints[0][1] + ImageLayerSize[1]/2)*(ProjectionPixel[1]-1)/ImageLayerSize[1]))
-                    
-                    if Iind>0 and Jind>0 and Iind<len(DetectorCounts[0]) and Jind<len(DetectorCounts[1]): 
-                            DetectorCounts[Iind,Jind,i] += 1 
+        if Box is not None:
+            Flat, Inside = BoxIndices(Flat, Grid.Shape, Box)
+            Lengths = Lengths[Inside]
         
-    else:
-        DetectorCounts = np.zeros((ProjectionPixel[0], ProjectionPixel[1])) 
+        Volume += np.bincount(Flat, weights=Lengths if Mode == 'Length' else None, minlength=Size)
+    
+    return Volume.reshape(Box[1] if Box is not None else Grid.Shape)
+
+
+
+def IndexMask(Indices, Shape):
+    # Boolean image which is True at each (i, j) in Indices
+    Mask = np.zeros(Shape[:2], dtype=bool)
+    Indices = np.array(list(Indices), dtype=np.int64).reshape(-1, 2)
+    Inside = (Indices >= 0).all(axis=1) & (Indices[:,0] < Shape[0]) & (Indices[:,1] < Shape[1])
+    Mask[Indices[Inside,0], Indices[Inside,1]] = True
+    
+    return Mask
+
+
+
+def HittingArray(PixelHits):
+    # (N, 3, 3) array of the hitting points of a Tracks.TrackBundle (not copied) or a ClusteredHittingPoints style list 
+    if Tracks.IsTrackBundle(PixelHits):
+        return PixelHits.Points
+    
+    return np.array([Hit[0] for Hit in PixelHits], dtype=float).reshape((-1, 3, 3))
+
+
+
+def CalcEventHittingPoints(Bar, Length, ZImage, DetectorPos, Seperation, Config=None): #( <RowData>['BarsReadout'][0][i], <RowData>['BarsReadout'][1][i], ...)
+    
+    #--------------------------------------------------------------------
+    # Determines where on each plane (z = const.) the muon passed through 
+    #--------------------------------------------------------------------
+    
+    Config = GetConfig(Config)
+    
+    Line = CalcEventLine(Bar, Length, Seperation, Config)
+    
+    if Line is None:
+        HittingPoints = [[-9999]*3]*3
+    
+    else:    
+        HittingPoints = LineHittingPoints([Line], [ZImage, Config.ZUp(Seperation), Config.TopDepth], DetectorPos)[0] #[Image, Up, Surf]
+    
+    return HittingPoints 
+
+
+
+def EventBounds(Events, Chunk=EventChunk):
+    # Bounds of the Chunk event blocks of Events events (Events at the end)
+    return np.append(np.arange(0, Events, Chunk), Events)
+
+
+
+def PazAnalysis(RowData, Seperation, Iterate, Config=None, Chunk=EventChunk):
+    
+    #--------------------------------------------------------------------
+    # Creates a 3D array counting the number of trajectories passsing 
+    # through each pixel in the image layers specified by Config
+    # (Config.LayerGrid). With Projection 'Length' the sums are floats
+    # and depend on their order, so the counts of each Chunk events are
+    # summed on their own and then added in order, as ParallelPazAnalysis
+    # does; both give the same bits for the same Chunk
+    #--------------------------------------------------------------------
+    
+    Config = GetConfig(Config)
+    
+    with Profiling.Stage('PazAnalysis'):
+        Lines, Quality = EventLines(RowData, Seperation, Config, Quality=True)
+        Lines = Lines[Quality == QualityOK] # events without a trajectory are left out
         
-        for k in range(N-1):
-            ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + ClusterLayer*TopDepth/ProjectionPixel[2] #Z coordinate of Image Layer
-            HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, RowData['DetectorPos'], Seperation)
+        if Iterate == True and Config.Projection != 'Nearest':
+            Start, End = LineSegments(Lines, Config.LayerGrid, Config.ZUp(Seperation), RowData['DetectorPos'])
+            Bounds = np.searchsorted(np.flatnonzero(Quality == QualityOK), EventBounds(len(Quality), Chunk)) # lines of each Chunk events
             
-            if np.all(HittingPoints == -9999):
-                DetectorCounts = -9999
-                break
+            DetectorCounts = np.zeros(Config.LayerGrid.Shape)
             
-            else:  
-                Iind = int(round((HittingPoints[0][0] + ImageLayerSize[0]/2)*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
-                Jind = int(round((HittingPoints[0][1] + ImageLayerSize[1]/2)*(ProjectionPixel[1]-1)/ImageLayerSize[1]))
-                
-                if Iind>0 and Jind>0 and Iind<len(DetectorCounts[0]) and Jind<len(DetectorCounts[1]): 
-                        DetectorCounts[Iind,Jind] += 1 
-    
-    tictoc = datetime.datetime.now() - begin_time
-    print('It took ', tictoc,' to analyse the RowData from ', RowData['FileName'])
+            for First, Last in zip(Bounds[:-1], Bounds[1:]):
+                DetectorCounts += DepositSegments(Start[First:Last], End[First:Last], Config.LayerGrid, Config.ZUp(Seperation), Config.Projection)
+        
+        elif Iterate == True:
+            DetectorCounts = HistogramLines(Lines, Config.LayerGrid, Config.LayerZ(Seperation), RowData['DetectorPos'])
+            
+        else:
+            ZImage = Config.ZUp(Seperation) + Config.ClusterOffset #Z coordinate of Image Layer
+            DetectorCounts = HistogramLines(Lines, Config.LayerGrid, ZImage, RowData['DetectorPos'])
+        
+        Profiling.Count('Events', len(Quality))
+        Profiling.Count('Voxels', DetectorCounts.size)
     
     return DetectorCounts 
 
@@ -399,22 +998,30 @@ def PazAnalysis(RowData, Seperation, Iterate):
 
 
     
-def ScatterDistance(Data, Cutoff, ObjectZ, ImageVolume, Seperation):
+def ScatterDistance(Data, Cutoff, ObjectZ, ImageVolume, Seperation, Config=None, MaxPoints=20000):
     #Expects 3D array
     #Computing time grows very quickly with number of data points
     
     #--------------------------------------------------------------------
     # Plots Data by mapping each element to a point in space and color
-    # coordinates the values using Cutoff variable. Not for use with 
-    # the unprocessed output of PazAnalysis (too many points to compute)
+    # coordinates the values using Cutoff variable. Data with more than
+    # MaxPoints nonzero elements is plotted at the finest level of its
+    # pyramid (Pyramid.RenderLevel) with at most that many
     #--------------------------------------------------------------------
     
+    import Pyramid
+    
+    Config = GetConfig(Config)
+    
+    Shape = np.shape(Data)
+    Data, Scale = Pyramid.RenderLevel(Data, MaxPoints)
+    
     Max = np.max(Data)
     
     fig =  plt.figure(figsize=(15,15))
-    ax = fig.gca(projection='3d')
+    ax = fig.add_subplot(projection='3d')
     ax.set(xlim=(-ImageVolume[0]/2, ImageVolume[0]/2), ylim=(-ImageVolume[1]/2, ImageVolume[1]/2)) 
-    ax.set_zlim(0, TopDepth)
+    ax.set_zlim(0, Config.TopDepth)
     ax.view_init(elev=20, azim=0)
     ax.set_xlabel('x [cm]')
     ax.set_ylabel('y [cm]')
@@ -424,8 +1031,6 @@ def ScatterDistance(Data, Cutoff, ObjectZ, ImageVolume, Seperation):
     cols = ['b','c', 'g', 'y', 'w']
     # cols.reverse()
     
-    Shape = np.shape(Data)
-    
 #    d = Shape[0] * Shape[1] * Shape[2]
     
 #    Nones = np.array([None]*d,dtype='str') #[None for i in range(d)] # list of labels for data points
@@ -442,48 +1047,25 @@ def ScatterDistance(Data, Cutoff, ObjectZ, ImageVolume, Seperation):
     
 #    ax.scatter(x, y, z, cmap=cm.coolwarm, c=col, marker='s', s=80, linewidth=0, alpha=opac, label=lbl)
     
-    for j in range(Shape[2]):
-        z = 2 * TriggerWidth + 4 * BarHight + Seperation + ObjectZ + j*ImageVolume[2]/Shape[2]
-        
-        for k in range(Shape[0]):
-            for l in range(Shape[1]):
-                
-                if Data[k,l,j] != 0:
-                    x = k*ImageVolume[0]/Shape[0] - ImageVolume[0]/2 
-                    y = l*ImageVolume[1]/Shape[1] - ImageVolume[1]/2
-                    
-                    if Data[k][l][j] > Max*Cutoff[3]:
-                        col = cols[0]
-                        opac = 0.5
-                    
-                    elif Data[k][l][j] > Max*Cutoff[2]:
-                        col = cols[1]
-                        opac = 0.5
-                       
-                    elif Data[k][l][j] > Max*Cutoff[1]:
-                        col = cols[2]
-                        # opac = 0.5
-                        opac = 0.4
-                    
-                    elif Data[k][l][j] > Max*Cutoff[0]:
-                        col = cols[3]
-                        # opac = 0.5
-                        opac = 0.3
-                        
-                    else:
-                        col = cols[3]
-                        # opac = 0.5
-                        opac = 0.2
-                    
-#                    lbl = Nones[l + k * Shape[0] + j * Shape[0] * Shape[1]]
-                    
-#                    if j == 0 and k == 0 and l == 0:
-#                        for i in range(4):
-#                            print(Nones[i])
-#                            ax.scatter(x, y, z, cmap=cm.coolwarm, c=col, marker='s', s=80, linewidth=0, alpha=opac, label=Nones[i])
-                        
-#                    else:
-                    ax.scatter(x, y, z, cmap=cm.coolwarm, c=col, marker='s', s=80, linewidth=0, alpha=opac)
+    Grid = ImageGrid.Volume(ImageVolume, Shape, ObjectZ)
+    
+    Iind, Jind, Layer = np.nonzero(Data)
+    Values = Data[Iind, Jind, Layer]
+    
+    Iind, Jind, Layer = Pyramid.Centres([Iind, Jind, Layer], Scale, Shape) # the same indices at level 0
+    
+    x, y = Grid.IndexToWorld(Iind, Jind)
+    z = np.interp(Layer, np.arange(Shape[2]), Grid.LayerZ(Config.ZUp(Seperation)))
+    
+    Classes = [(Values > Max*Cutoff[3], cols[0], 0.5), 
+               ((Values <= Max*Cutoff[3]) & (Values > Max*Cutoff[2]), cols[1], 0.5),
+               ((Values <= Max*Cutoff[2]) & (Values > Max*Cutoff[1]), cols[2], 0.4),
+               ((Values <= Max*Cutoff[1]) & (Values > Max*Cutoff[0]), cols[3], 0.3),
+               (Values <= Max*Cutoff[0], cols[3], 0.2)]
+    
+    for Mask, col, opac in Classes:
+        if np.any(Mask):
+            ax.scatter(x[Mask], y[Mask], z[Mask], c=col, marker='s', s=80*Scale[0], linewidth=0, alpha=opac)
                         
                         
 #    legend1 = ax.legend(*ax.legend_elements(),
@@ -537,7 +1119,7 @@ def PlotQuick(Data, ThreeD):
     
 #%%
 
-def AlterHittingPoints(PixelHits, Plot, DetectHits, Which, DetectorPosition): 
+def AlterHittingPoints(PixelHits, Plot, DetectHits, Which, DetectorPosition, Config=None): 
     #Set DetectHits = -1 for analysis or to view all trajectories
     
     #-----------------------------------------------------------------
@@ -547,29 +1129,20 @@ def AlterHittingPoints(PixelHits, Plot, DetectHits, Which, DetectorPosition):
     # (if Which != None)
     #-----------------------------------------------------------------
     
-    def BinPoints(PixelHits, BinData, ax, Tilt, Plot, col, opac): # Changes hitting points from Pixel hits to manipulate trajectory beams 
-        for i in range(len(PixelHits)):                                                              # and plots the beam if Plot == True
-            # x = np.array([PixelHits[i][0][1][0] + Tilt[0][0] + DetectorPosition[0], PixelHits[i][0][2][0] + Tilt[1][0] + DetectorPosition[0]])
-            # y = np.array([PixelHits[i][0][1][1] + Tilt[0][1] + DetectorPosition[1], PixelHits[i][0][2][1] + Tilt[1][1] + DetectorPosition[1]])  
-            x = np.array([PixelHits[i][0][1][0] + Tilt[0][0], PixelHits[i][0][2][0] + Tilt[1][0]])
-            y = np.array([PixelHits[i][0][1][1] + Tilt[0][1], PixelHits[i][0][2][1] + Tilt[1][1]])  
-            z = np.array([PixelHits[i][0][1][2], PixelHits[i][0][2][2]])
-            BinData.append([x,y,z])
-            
-            if Plot == True:
-                ax.plot(x,y,z,col,alpha=opac) 
-                
-    np.random.shuffle(PixelHits)
+    Config = GetConfig(Config)
     
-    PixelHits = PixelHits[:DetectHits] #Reduces number of data points to handle interactive plotting and reduce computing time
+    Points = HittingArray(PixelHits)
     
-    BinData = []
+    Order = np.arange(len(Points))
+    np.random.shuffle(Order) # shuffles the tracks as np.random.shuffle(PixelHits) did, leaving PixelHits as it is
+    
+    Points = Points[Order[:DetectHits]] #Reduces number of data points to handle interactive plotting and reduce computing time
     
     if Plot == True:
         fig =  plt.figure(figsize=(15,15))
-        ax = fig.gca(projection='3d')
-        ax.set(xlim=(-ImageVolume[0]/2, ImageVolume[0]/2), ylim=(-ImageVolume[1]/2, ImageVolume[1]/2)) 
-        ax.set_zlim(0, TopDepth)
+        ax = fig.add_subplot(projection='3d')
+        ax.set(xlim=(-Config.ImageVolume[0]/2, Config.ImageVolume[0]/2), ylim=(-Config.ImageVolume[1]/2, Config.ImageVolume[1]/2)) 
+        ax.set_zlim(0, Config.TopDepth)
         ax.view_init(elev=20, azim=0)
         ax.set_xlabel('x [cm]')
         ax.set_ylabel('y [cm]')
@@ -580,26 +1153,19 @@ def AlterHittingPoints(PixelHits, Plot, DetectHits, Which, DetectorPosition):
         ax = None
     
     if Which != None: #Manufactures beams with altered positions from 1 detector. Creates artificial interference data (2 detectors 4 objects)
-        if Which[0] == 1:
-            BinPoints(PixelHits, BinData, ax, [[500,0],[-1100,500]], Plot, 'y', 0.2)    
-            BinPoints(PixelHits, BinData, ax, [[-500,0],[-700,500]], Plot, 'b', 0.2) 
-        
-        if Which[1] == 1:
-            BinPoints(PixelHits, BinData, ax, [[500,0],[-1100,-500]], Plot, 'y', 0.2)    
-            BinPoints(PixelHits, BinData, ax, [[-500,0],[-700,-500]], Plot, 'b', 0.2)
-        
-        if Which[2] == 1:
-            BinPoints(PixelHits, BinData, ax, [[500,0],[0,0]], Plot, 'y', 0.2)    
-            BinPoints(PixelHits, BinData, ax, [[-500,0],[900,0]], Plot, 'b', 0.2) 
-        
-        if Which[3] == 1:
-            BinPoints(PixelHits, BinData, ax, [[500,0],[0,-900]], Plot, 'y', 0.2)    
-            BinPoints(PixelHits, BinData, ax, [[-500,0],[900,-900]], Plot, 'b', 0.2)
+        Beams, Opacity = Pose.ManufacturedBeams(Points, Which), 0.2
     
     else:
-        #for i in range(len(PixelHits)):
-        # BinPoints(PixelHits, BinData, ax, [[DetectorPosition[0],DetectorPosition[1]],[DetectorPosition[0],DetectorPosition[1]]], Plot, 'b', 0.5)
-        BinPoints(PixelHits, BinData, ax, [[0,0],[0,0]], Plot, 'b', 0.5)
+        Beams, Opacity = [(Pose.TiltTracks(Points, [[0,0],[0,0]]), 'b')], 0.5
+    
+    BinData = [] # [x, y, z] of the [Up, Surf] segment of each track of each beam
+    
+    for Segments, Colour in Beams:
+        BinData += [list(Track) for Track in np.transpose(Segments, (0, 2, 1))]
+        
+        if Plot == True: # one line with the segments split by NaNs
+            Split = np.concatenate([Segments, np.full((len(Segments), 1, 3), np.nan)], axis=1).reshape((-1, 3))
+            ax.plot(Split[:,0], Split[:,1], Split[:,2], Colour, alpha=Opacity)
 
     if Plot == True:
         
@@ -738,12 +1304,17 @@ def ClusterMaxima(Data, Value, Index, PercentCutoff):
     #--------------------------------------------------------------------
     # Runs the ClusterAlgorithm at each element of Index and provided the 
     # results have more than five nonzero pixels, then combines them to  
-    # form one image
+    # form one image (the largest clustered value at each pixel). Area
+    # is the running count of clustered pixels over the kept clusters and
+    # Active Indices the pixels of clusters of more than one step, in the
+    # order they first appear
     #--------------------------------------------------------------------
     
-    AllClusters = []
+    Maximized = None
     Area = []
     ActiveIndices = []
+    Seen = set()
+    n = 0
     
     LayerMaxima = np.max(Data)
     
@@ -751,30 +1322,23 @@ def ClusterMaxima(Data, Value, Index, PercentCutoff):
         
         for l in range(len(Index[i])):
             Dict = ClusterAlgorithm(Data, LayerMaxima*PercentCutoff, [Index[i][l][0],Index[i][l][1]]) 
+            Nonzero = np.count_nonzero(Dict['Clustered Array'])
             
-            if np.count_nonzero(Dict['Clustered Array']) > 5: # Requires two full layers of clustered Pixels 
-                AllClusters.append(Dict['Clustered Array']) # ( 1 start pixel + 4 adjacent to it) to be considered significant
-                n = np.count_nonzero(AllClusters)
+            if Nonzero > 5: # Requires two full layers of clustered Pixels ( 1 start pixel + 4 adjacent to it) to be considered significant
+                Maximized = np.copy(Dict['Clustered Array']) if Maximized is None else np.maximum(Maximized, Dict['Clustered Array'])
+                n += Nonzero
                 
-                for layer in Dict['Active Indices']:
-                    for ind in layer:
-                        if not ind in ActiveIndices and len(Dict['Active Indices']) > 1:
-                            ActiveIndices.append(ind)
+                if len(Dict['Active Indices']) > 1:
+                    for layer in Dict['Active Indices']:
+                        for ind in layer:
+                            if (ind[0], ind[1]) not in Seen:
+                                Seen.add((ind[0], ind[1]))
+                                ActiveIndices.append(ind)
                 
                 Area.append(n)
-        
-    AllClusters = np.transpose(AllClusters)
     
-    Shape = np.shape(Data)
-    
-    Maximized = np.zeros((Shape[1],Shape[0]))
-    
-    if len(AllClusters) != 0:
-        for k in range(Shape[0]):
-            for l in range(Shape[1]):  
-                Maximized[k][l] = np.max(AllClusters[k][l]) 
-                    
-    Maximized = np.transpose(Maximized) 
+    if Maximized is None:
+        Maximized = np.zeros(np.shape(Data))
     
     LayerDict = {'Active Indices':ActiveIndices, \
                  'Clustered Array':Maximized, \
@@ -786,11 +1350,64 @@ def ClusterMaxima(Data, Value, Index, PercentCutoff):
 
 
 
+def ClusterVolume(Data, Threshold, SeedThreshold=None, Connectivity=6, MinVoxels=1):
+    #Expects 3D array
+    
+    #--------------------------------------------------------------------
+    # Labels the objects of Data in one pass: the connected regions of 
+    # voxels at or above Threshold (sharing a face if Connectivity is 6,
+    # also an edge or corner if 26) which reach SeedThreshold somewhere
+    # and have at least MinVoxels voxels. Returns the Labels volume (0 
+    # outside the objects, k+1 in object k) and a dict for each object of
+    # its Voxels ((N, 3) indices), Box (offset and shape of its bounding
+    # block), Weight (sum of Data over it), Peak value and index and the
+    # weighted Centroid index, by decreasing Weight
+    #--------------------------------------------------------------------
+    
+    Data = np.asarray(Data, dtype=float)
+    SeedThreshold = Threshold if SeedThreshold is None else SeedThreshold
+    
+    Structure = ndimage.generate_binary_structure(Data.ndim, Connectivities[Connectivity] if Data.ndim == 3 else 1)
+    Labels, N = ndimage.label(Data >= Threshold, Structure)
+    
+    Index = np.arange(1, N + 1)
+    Sizes = ndimage.sum_labels(np.ones(Data.shape), Labels, Index) if N else np.zeros(0)
+    Weights = ndimage.sum_labels(Data, Labels, Index) if N else np.zeros(0)
+    Peaks = ndimage.maximum(Data, Labels, Index) if N else np.zeros(0)
+    
+    Kept = Index[(np.asarray(Peaks) >= SeedThreshold) & (np.asarray(Sizes) >= MinVoxels)]
+    Kept = Kept[np.argsort(-np.asarray(Weights)[Kept - 1], kind='stable')]
+    
+    Relabel = np.zeros(N + 1, dtype=np.int64)
+    Relabel[Kept] = np.arange(1, len(Kept) + 1)
+    Labels = Relabel[Labels]
+    
+    Voxels = np.argwhere(Labels)
+    Order = np.argsort(Labels[tuple(Voxels.T)], kind='stable')
+    Split = np.split(Voxels[Order], np.cumsum(np.bincount(Labels[tuple(Voxels.T)], minlength=len(Kept) + 1)[1:])[:-1])
+    
+    Objects = []
+    
+    for k, Slices in enumerate(ndimage.find_objects(Labels)):
+        Values = Data[tuple(Split[k].T)]
+        Peak = int(np.argmax(Values))
+        
+        Objects.append({'Voxels':Split[k], \
+                        'Box':(tuple(Slice.start for Slice in Slices), tuple(Slice.stop - Slice.start for Slice in Slices)), \
+                        'Weight':float(np.sum(Values)), \
+                        'Peak':float(Values[Peak]), \
+                        'Peak Index':tuple(int(i) for i in Split[k][Peak]), \
+                        'Centroid':np.average(Split[k], axis=0, weights=Values) if np.sum(Values) > 0 else np.mean(Split[k], axis=0)})
+    
+    return Labels, Objects
+
+
+
 # ---------------------------------- Tracking -----------------------------------------
 
 
 
-def TrackPixel(RowData, Indices, Color, opac, Seperation): 
+def TrackPixel(RowData, Indices, Color, opac, Seperation, Config=None): 
     #Choose indices from a 3D DetectorCount array for Indices
     
     #-----------------------------------------------------------------
@@ -798,28 +1415,26 @@ def TrackPixel(RowData, Indices, Color, opac, Seperation):
     # Could be useful in the future for displaced vertex reconstruction
     #-----------------------------------------------------------------
     
-    begin_time = datetime.datetime.now()
+    Config = GetConfig(Config)
+    ImageLayerSize, TopDepth = Config.ImageLayerSize, Config.TopDepth
     
-    PixelHits = []
-    N = RowData['NumberOfEvents']
+    ZImage = Config.LayerZ(Seperation)[Indices[2]]
     
-    for k in range(N-1): 
-        ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + Indices[2]*TopDepth/ProjectionPixel[2]
-        HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, RowData['DetectorPos'])
-            
-        if np.all(HittingPoints == -9999):
-            continue
+    with Profiling.Stage('TrackPixel'):
+        Lines, Quality = EventLines(RowData, Seperation, Config, Quality=True)
+        Lines = Lines[Quality == QualityOK]
+        Points = LineHittingPoints(Lines, [ZImage, Config.ZUp(Seperation), TopDepth], RowData['DetectorPos'])
+        
+        Iind, Jind = Config.LayerGrid.WorldToIndex(Points[:,0,0], Points[:,0,1])
         
-        else:  
-            Iind = int(round((HittingPoints[0][0] + ImageLayerSize[0]/2)*(ProjectionPixel[0]-1)/ImageLayerSize[0]))
-            Jind = int(round((HittingPoints[0][1] + ImageLayerSize[0]/2)*(ProjectionPixel[1]-1)/ImageLayerSize[1]))
+        #PixelHits = Points[(Iind > 0) & (Jind > 0)] #Plots all trajectories
+        PixelHits = Points[(Iind == Indices[0]) & (Jind == Indices[1]) & (Iind > 0) & (Jind > 0)]
         
-        #if Iind > 0 and Jind > 0: #Plots all trajectories
-        if Iind == Indices[0] and Jind == Indices[1] and Iind > 0 and Jind > 0:
-            PixelHits.append(HittingPoints)
+        Profiling.Count('Events', len(Quality))
+        Profiling.Count('Tracks', len(PixelHits))
     
     fig =  plt.figure(figsize=(15,15))
-    ax = fig.gca(projection='3d')
+    ax = fig.add_subplot(projection='3d')
     ax.set(xlim=(-ImageLayerSize[0]/2, ImageLayerSize[0]/2), ylim=(-ImageLayerSize[1]/2, ImageLayerSize[1]/2)) 
     ax.set_zlim(0, TopDepth)
         
@@ -832,26 +1447,27 @@ def TrackPixel(RowData, Indices, Color, opac, Seperation):
     
     plt.ion()
     plt.show()
-    
-    tictoc = datetime.datetime.now() - begin_time
-    print('It took ', tictoc,' to track the data')
 
 
 
-def ClusteredHittingPoints(RowData, ClusterIndices, Layer, Seperation):  
+def ClusteredHittingPoints(RowData, ClusterIndices, Layer, Seperation, Config=None, DetectorPose=None, Detector=0):  
     #Expects ClusterDict['Active Indices'] for Indices
     #Layer corresponds to the image layer used to create ClusterIndices
 
     #-----------------------------------------------------------------
     # Determines hitting points of trajectories that go through the 
-    # clustered image
+    # clustered image. With a DetectorPose (Pose.DetectorPose) the
+    # selected tracks are rotated and moved to the pose of the detector
+    # (Pose.TransformTracks, all tracks at once). Returns a 
+    # Tracks.TrackBundle with the Detector index, the event and the
+    # cluster layer pixel of each track, which indexes as the old list of
+    # [HittingPoints]
     #-----------------------------------------------------------------
 
-    begin_time = datetime.datetime.now()
-    
-    N = RowData['NumberOfEvents']
+    Config = GetConfig(Config)
     
     Pos = RowData['DetectorPos'] #[cm]
+    ZImage = Config.LayerZ(Seperation)[Layer]
     
 #    IndexList = []
 #    for i in range(len(ClusterIndices)): 
@@ -862,48 +1478,25 @@ def ClusteredHittingPoints(RowData, ClusterIndices, Layer, Seperation):
 #            for j in range(len(ClusterIndices[i])):
 #                IndexList.append(ClusterIndices[i][j])
         
-    PixelHits = []
-    PixelIndex = []
-    
-    for k in range(N-1):  
-        ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + Layer * TopDepth / ProjectionPixel[2]
+    with Profiling.Stage('ClusteredHittingPoints'):
+        Lines, Quality = EventLines(RowData, Seperation, Config, Quality=True)
+        Points = LineHittingPoints(Lines, [ZImage, Config.ZUp(Seperation), Config.TopDepth], Pos) #[Image, Up, Surf]
         
-        HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, RowData['DetectorPos'], Seperation)
-#        HittingPoints = CalcEventHittingPoints(RowData['BarsReadout'][0][k], RowData['BarsReadout'][1][k], ZImage, [0,0], Seperation)
+        Iind, Jind = Config.LayerGrid.Centred(Pos).WorldToIndex(Points[:,0,0], Points[:,0,1])
         
-#        print("Hitting points are: ",HittingPoints)
+        Selected = (Quality == QualityOK) & Config.LayerGrid.InBounds(Iind, Jind)
+        Selected[Selected] = IndexMask(ClusterIndices, Config.ProjectionPixel)[Iind[Selected], Jind[Selected]]
         
-        if np.all(HittingPoints == -9999):
-            continue
-
-        else:
-#            Iind = int(round((HittingPoints[0][0] + ImageVolume[0]/2 )*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
-#            Jind = int(round((HittingPoints[0][1] + ImageVolume[0]/2 )*(ProjectionPixel[1]-1)/ImageLayerSize[1])) 
-            Iind = int(round((HittingPoints[0][0] - Pos[0] + ImageLayerSize[0]/2)*(ProjectionPixel[0]-1)/ImageLayerSize[0])) 
-            Jind = int(round((HittingPoints[0][1] - Pos[1] + ImageLayerSize[0]/2)*(ProjectionPixel[1]-1)/ImageLayerSize[1])) 
-
-
-#        if [Iind,Jind] in IndexList and Iind > 0 and Jind > 0:
-        if (Iind,Jind) in ClusterIndices and Iind > 0 and Jind > 0:
-            PixelIndex.append([Iind,Jind]) 
-            PixelHits.append([HittingPoints]) # + [RowData['DetectorPos'][0],RowData['DetectorPos'][1],0]])
-            
-            ##### use hitting points rotate and return thos instead
-            '''
-            y = lowest hitting point
-            y' = highest hitting point
-            x = y' - y # so traj is line segment through the origin
-            x' = R x # rotate the line segment according to detector orientation
-            x'' = x' + y # translate it back to original position
-            
-            x'' and y together give the track for the muon
-            
-            '''
-            
-            
-    
-    tictoc = datetime.datetime.now() - begin_time
-    print('It took ', tictoc,' to track the data')
+        Points = Points[Selected]
+        
+        if DetectorPose is not None:
+            Points = Pose.TransformTracks(Points, DetectorPose, Pos)
+        
+        Pixel = np.ravel_multi_index((Iind[Selected], Jind[Selected]), Config.ProjectionPixel[:2]) # before the pose, for Beams
+        PixelHits = Tracks.TrackBundle(Points, Detector, np.flatnonzero(Selected), Pixel)
+        
+        Profiling.Count('Events', len(Lines))
+        Profiling.Count('Tracks', len(PixelHits))
 
     return PixelHits 
 
@@ -913,56 +1506,66 @@ def ClusteredHittingPoints(RowData, ClusterIndices, Layer, Seperation):
 
 
 
-def ObjectView(Data, Resolution, ObjectZ, ImageVolume, Seperation):
+def ObjectView(Data, Resolution, ObjectZ, ImageVolume, Seperation, Config=None, Mode=None, Crop=None):
     
     #-----------------------------------------------------------------
     # Takes Data hitting points and counts hits in the ImageVolume at 
-    # ObjectZ above the detector with resolution Resolution
+    # ObjectZ above the detector with resolution Resolution. Mode 
+    # (Config.Projection if None) is 'Nearest' to count each track once
+    # per image layer, or 'Count' / 'Length' to add every voxel it 
+    # crosses (see DepositSegments). Crop (Config.Crop if None) returns
+    # only the block of voxels the tracks cross, as a SubVolumes.SubVolume
     #-----------------------------------------------------------------
     
-    DetectorCounts = np.zeros((Resolution[0],Resolution[1],Resolution[2]))
+    Config = GetConfig(Config)
+    Mode = Mode or Config.Projection
+    Crop = Config.Crop if Crop is None else Crop
     
-    for i in range(len(Data)):
-        AbsXUp = Data[i][0][2][0]
-        AbsYUp = Data[i][0][2][1]  
-        AbsXDown = Data[i][0][1][0]
-        AbsYDown = Data[i][0][1][1]
-        
-        ZUp = Data[i][0][2][2]             
-        ZDown = Data[i][0][1][2]
-        dZ = ZUp - ZDown
-        
-        if dZ == 0:
-            continue                    
+    Grid = ImageGrid.Volume(ImageVolume, Resolution, ObjectZ)
+    
+    with Profiling.Stage('ObjectView'):
+        Points = HittingArray(Data)
+        Points = Points[Points[:,2,2] != Points[:,1,2]] # dZ == 0
+    
+        Down = Points[:,1] #[X, Y, Z] at the top of the detector
+        Up = Points[:,2] #[X, Y, Z] at the surface
+        dZ = Up[:,2] - Down[:,2]
         
-        dX = AbsXUp - AbsXDown     
-        ax = dZ / dX                           
-        bx = ZUp - ax * AbsXUp         
+        if Mode != 'Nearest':
+            Z = Grid.Edges(Config.ZUp(Seperation))[2]
+            
+            Start = Down + ((Z[0] - Down[:,2]) / dZ)[:,None] * (Up - Down) # the tracks extended to the bottom and top of the volume
+            End = Down + ((Z[-1] - Down[:,2]) / dZ)[:,None] * (Up - Down)
+            
+            Box = Grid.Box(np.append(Start[:,0], End[:,0]), np.append(Start[:,1], End[:,1])) if Crop else None
+            Counts = DepositSegments(Start, End, Grid, Config.ZUp(Seperation), Mode, Box=Box)
         
-        dY = AbsYUp - AbsYDown
-        ay = dZ / dY
-        by = ZUp - ay * AbsYUp
+        else:
+            Lines = np.empty((len(Points), 4))
         
-        for j in range(Resolution[2]):
-            ZImage = 2 * TriggerWidth + 4 * BarHight + Seperation + ObjectZ + j*ImageVolume[2]/Resolution[2]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                Lines[:,0] = dZ / (Up[:,0] - Down[:,0]) #ax
+                Lines[:,1] = Up[:,2] - Lines[:,0] * Up[:,0] #bx
+                Lines[:,2] = dZ / (Up[:,1] - Down[:,1]) #ay
+                Lines[:,3] = Up[:,2] - Lines[:,2] * Up[:,1] #by
             
-            HittingPoints = np.zeros(3)
+            Box = None
             
-            HittingPoints[0] = (ZImage - bx) / ax #XImage  
-            HittingPoints[1] = (ZImage - by) / ay #YImage
-            HittingPoints[2] = ZImage #ZImage
+            if Crop: # the tracks are straight, so the block is set by where they cross the first and last layers
+                Ends = LineHittingPoints(Lines, Grid.LayerZ(Config.ZUp(Seperation))[[0, -1]], [0,0])
+                Box = Grid.Box(Ends[:,:,0], Ends[:,:,1])
             
-            Iind = int(round((HittingPoints[0] + ImageVolume[0]/2)*(Resolution[0]-1)/ImageVolume[0]))
-            Jind = int(round((HittingPoints[1] + ImageVolume[1]/2)*(Resolution[1]-1)/ImageVolume[1]))
-#            Iind = int(round((HittingPoints[0] + ImageLayerSize[0]/2)*(Resolution[0]-1)/ImageLayerSize[0]))
-#            Jind = int(round((HittingPoints[1] + ImageLayerSize[1]/2)*(Resolution[1]-1)/ImageLayerSize[1]))
-#            Iind = int(round((HittingPoints[0])*(Resolution[0]-1)/ImageLayerSize[0]))
-#            Jind = int(round((HittingPoints[1])*(Resolution[1]-1)/ImageLayerSize[1]))
-        
-            if Iind > 0 and Jind > 0 and Iind < len(DetectorCounts[0]) and Jind < len(DetectorCounts[1]):
-                DetectorCounts[Iind][Jind][j] += 1
-                    
-    return DetectorCounts 
+            Counts = HistogramLines(Lines, Grid, Grid.LayerZ(Config.ZUp(Seperation)), [0,0], Box=Box)
+        
+        Profiling.Count('Tracks', len(Points))
+        Profiling.Count('Voxels', Counts.size)
+    
+    if Crop:
+        import SubVolumes
+        
+        return SubVolumes.SubVolume(Counts, Box[0], Grid.Shape)
+    
+    return Counts
 
 
     
@@ -995,6 +1598,12 @@ def GroupOverlaps(Data):
                 if np.any(Data[i] != Minus):
                     OverlapLists.append([i,j])    
     
+    return GroupPairs(OverlapLists), OverlapLists
+
+
+
+def GroupPairs(OverlapLists):
+    # Groups of the indices joined by the overlapping pairs in OverlapLists (as GroupOverlaps)
     ObjectGroups = []
     
     for i in range(len(OverlapLists)):
@@ -1021,11 +1630,11 @@ def GroupOverlaps(Data):
         if Appended == 0:
             ObjectGroups.append([OverlapLists[i][0],OverlapLists[i][1]])
             
-    return ObjectGroups, OverlapLists
+    return ObjectGroups
         
 
 
-def ScaleGroups(Counts, Groups, Maxima, OverlapCutoff):
+def ScaleGroups(Counts, Groups, Maxima, OverlapCutoff, Config=None):
     
     #--------------------------------------------------------------------
     # Scales all beams identically so regions of interference can be            
@@ -1034,6 +1643,8 @@ def ScaleGroups(Counts, Groups, Maxima, OverlapCutoff):
     # with this step.
     #--------------------------------------------------------------------
     
+    ProjectionPixel = GetConfig(Config).ProjectionPixel
+    
     DetectorCounts = np.zeros((len(Groups),ProjectionPixel[0],ProjectionPixel[1],ProjectionPixel[2]))
     AddedMaxima = []
     Targets = np.zeros((len(Groups),ProjectionPixel[2]))
@@ -1068,7 +1679,9 @@ def ScaleGroups(Counts, Groups, Maxima, OverlapCutoff):
 
 
 
-def ScaleLayers(Counts, Scale):
+def ScaleLayers(Counts, Scale, Config=None):
+    
+    ProjectionPixel = GetConfig(Config).ProjectionPixel
     
     if Scale == True:
         Shape = np.shape(Counts)
@@ -1096,8 +1709,14 @@ def ScaleLayers(Counts, Scale):
     
 
 
-def ReadDataFiles():
-    '''
+def PromptDataFiles():
+    
+    #--------------------------------------------------------------------
+    # Asks on the command line for the RowData files, positions and 
+    # seperation of each detector (or reuses the last answers) and returns
+    # them as the arguments of ReadDataFiles
+    #--------------------------------------------------------------------
+    
     print('Do you want to use the last input? \n If so, input "yes" otherwise input any string')
 
     Input = input()
@@ -1142,22 +1761,18 @@ def ReadDataFiles():
         dump(XPositions,'XPositions.joblib')
         dump(YPositions,'YPositions.joblib')
         dump(Seperations,'Seperations.joblib')
-        
-    '''    
-    XPositions = [500, -500, 330]
-    YPositions = [-500, 500, 330]
-    
-    Seperations = [25, 25, 25]
     
-    Dir = '/Users/keegan/Desktop/Research/visualisation/useful_data/Fri_May_14_07-01-29_2021/'
+    return RealFiles, SkyFiles, XPositions, YPositions, Seperations
     
-    RealFiles = [Dir+name for name in ['RDR_[500,-500]cm_30m_25cm_0a_0b_0c_[0,0,10]m.out',
-                                       'RDR_[-500,500]cm_30m_25cm_0a_0b_0c_[0,0,10]m.out',
-                                       'RDR_[330,330]cm_30m_25cm_0a_0b_0c_[0,0,10]m.out']]
-    
-    SkyFiles = [Dir+name for name in ['RDS_[500,-500]cm_30m_25cm_0a_0b_0c_[0,0,10]m.out',
-                                      'RDS_[-500,500]cm_30m_25cm_0a_0b_0c_[0,0,10]m.out',
-                                      'RDS_[330,330]cm_30m_25cm_0a_0b_0c_[0,0,10]m.out']]
+
+
+def ReadDataFiles(RealFiles=None, SkyFiles=None, XPositions=None, YPositions=None, Seperations=None, Config=None, Workers=1, Plot=True):
+    #Files, positions [cm] and seperations [cm] of each detector, asked for with PromptDataFiles if not given
+    #Workers > 1 (or None for all cores) reads and counts the detectors in parallel
+    #Plot = False for batch runs
+
+    if RealFiles is None:
+        RealFiles, SkyFiles, XPositions, YPositions, Seperations = PromptDataFiles()
     
     # Dir_name = load('time.joblib')
 
@@ -1168,6 +1783,8 @@ def ReadDataFiles():
     # ZPositions = [float(names[0].split('m_')[1]) for i in range(len(names))] # Accept ZPositions as argument for functions
     # Seperations = [float(names[i].split('cm')[1][-2:]) for i in range(len(names))]
     
+    Config = GetConfig(Config)
+    
     SkyCountList = []
     RealCountList = []
     CountList = []
@@ -1175,15 +1792,22 @@ def ReadDataFiles():
     RowRealList = []
     IterateCountList = []
     
-    for i in range(len(RealFiles)):
-        RDSky = ReadRowDataFileFastest(SkyFiles[i], [XPositions[i],YPositions[i]])
-        RDReal = ReadRowDataFileFastest(RealFiles[i], [XPositions[i],YPositions[i]])
+    from Pipeline import ParallelMap, ReadDetector
     
-        DCS = PazAnalysis(RDSky,Seperations[i],Iterate) 
-        DCR = PazAnalysis(RDReal,Seperations[i],Iterate)
+    Shared = {'Sky Files':SkyFiles, \
+              'Real Files':RealFiles, \
+              'Positions':[[XPositions[i],YPositions[i]] for i in range(len(RealFiles))], \
+              'Seperations':Seperations, \
+              'Config':Config}
+    
+    Detectors = ParallelMap(ReadDetector, len(RealFiles), Shared, Workers)
+    
+    for i in range(len(RealFiles)):
+        RDSky, RDReal, DCS, DCR = Detectors[i]
         
-        PlotQuick(DCS,False)
-        PlotQuick(DCR,False)
+        if Plot:
+            PlotQuick(DCS,False)
+            PlotQuick(DCR,False)
         
 #        DCdatPlus = (DCR-DCS) 
         DCdatPlus = (DCS-DCR) 
@@ -1191,16 +1815,17 @@ def ReadDataFiles():
         
 #        return DCdatPlus
         
-        PlotQuick(DCdatPlus,Iterate)
+        if Plot:
+            PlotQuick(DCdatPlus,Config.Iterate)
         
         RowSkyList.append(RDSky)
         RowRealList.append(RDReal)
         SkyCountList.append(DCS) 
         RealCountList.append(DCR)
         
-        if Iterate == True:
+        if Config.Iterate == True:
             IterateCountList.append(DCdatPlus)    
-            CountList.append(DCdatPlus[:,:,ClusterLayer])
+            CountList.append(DCdatPlus[:,:,Config.ClusterLayer])
             
         else:
             IterateCountList = None
@@ -1217,7 +1842,9 @@ def ReadDataFiles():
     
 
 
-def AnalyseData(ReadDict):   
+def AnalyseData(ReadDict, Config=None):   
+    
+    Config = GetConfig(Config)
     
     HittingData = []
     ClusterList = []
@@ -1242,7 +1869,12 @@ def AnalyseData(ReadDict):
         TempObjectMax = []
         
         
-        Value, Index = LocalMaxIndices(ReadDict['Subtracted Count List'][i], LocalCutoff, Divide)
+        if Config.PyramidLevel > 0:
+            import Pyramid
+            Value, Index = Pyramid.SeedMaxima(ReadDict['Subtracted Count List'][i], Config.LocalCutoff, Config.Divide, Config.PyramidLevel)
+        
+        else:
+            Value, Index = LocalMaxIndices(ReadDict['Subtracted Count List'][i], Config.LocalCutoff, Config.Divide)
 
         ValueList.append(Value)
         IndexList.append(Index)
@@ -1264,7 +1896,7 @@ def AnalyseData(ReadDict):
             if (Index[j][0],Index[j][1]) in Clustered_pixels:
                 continue # this region has already been clustered
             
-            ClusterDict = ClusterAlgorithm(ReadDict['Subtracted Count List'][i][:,:], PercentCutoff * Max, [Index[j][0],Index[j][1]])
+            ClusterDict = ClusterAlgorithm(ReadDict['Subtracted Count List'][i][:,:], Config.PercentCutoff * Max, [Index[j][0],Index[j][1]])
             
             if np.count_nonzero(ClusterDict['Clustered Array']) > 5:
             # just did this
@@ -1326,7 +1958,12 @@ def AnalyseData(ReadDict):
     
     
 
-def VisualiseObjects(AnalysisDict, ReadDict):
+def VisualiseObjects(AnalysisDict, ReadDict, Config=None, Volumetric=False):
+    #Volumetric ==> each group's Detector Counts are clustered as a volume by ClusterVolume() instead of layer by layer
+
+    Config = GetConfig(Config)
+    ProjectionPixel = Config.ProjectionPixel
+    ObjectList = []
 
     #AllClusters = []
     #GroupClusters = []
@@ -1338,13 +1975,19 @@ def VisualiseObjects(AnalysisDict, ReadDict):
         #for i in AnalysisDict['Object Groups'][group]:
         Max = np.max(AnalysisDict['Detector Counts'][i])
         #MaxIndex = [np.where(ProgramDict['Decay Volume Slices'][1] == Max)[0][0]
+        
+        if Volumetric: # objects of more than five voxels, as for the layers below
+            Labels, Objects = ClusterVolume(AnalysisDict['Detector Counts'][i], Max * Config.PercentCutoff3D, Max * Config.LocalCutoff3D, Config.Connectivity, 6)
+            
+            Maximized[i] = np.where(Labels > 0, AnalysisDict['Detector Counts'][i], 0)
+            ObjectList.append(Objects)
 
-        for j in range(ProjectionPixel[2]):
+        for j in range(ProjectionPixel[2] if not Volumetric else 0):
             Layer_Max = np.max(AnalysisDict['Detector Counts'][i,:,:,j])
             
 #            Value, Index = LocalMaxIndices(AnalysisDict['Detector Counts'][i,:,:,j], LocalCutoff3D * Max / Layer_Max, Divide)  
 #            Value, Index = LocalMaxIndices(AnalysisDict['Detector Counts'][i,:,:,j], Layer_Max * LocalCutoff3D, Divide)  
-            Value, Index = LocalMaxIndices(AnalysisDict['Detector Counts'][i,:,:,j], Max * LocalCutoff3D, Divide)  
+            Value, Index = LocalMaxIndices(AnalysisDict['Detector Counts'][i,:,:,j], Max * Config.LocalCutoff3D, Config.Divide)  
 
 
             Clustered_pixels = set()
@@ -1354,7 +1997,7 @@ def VisualiseObjects(AnalysisDict, ReadDict):
 
 #                    LayerDict = ClusterAlgorithm(AnalysisDict['Detector Counts'][i,:,:,j], PercentCutoff3D * Max / Layer_Max, Index[k]) 
 #                    LayerDict = ClusterAlgorithm(AnalysisDict['Detector Counts'][i,:,:,j], Layer_Max * PercentCutoff3D, Index[k]) 
-                    LayerDict = ClusterAlgorithm(AnalysisDict['Detector Counts'][i,:,:,j], Max * PercentCutoff3D, Index[k]) 
+                    LayerDict = ClusterAlgorithm(AnalysisDict['Detector Counts'][i,:,:,j], Max * Config.PercentCutoff3D, Index[k]) 
 
                     if np.count_nonzero(LayerDict['Clustered Array']) > 5:
                         for lists in LayerDict['Active Indices']:
@@ -1399,22 +2042,21 @@ def VisualiseObjects(AnalysisDict, ReadDict):
     
     
     for i in range(len(AnalysisDict['Object Groups'])):   
-        TempHitting = []
-        
-        for j in AnalysisDict['Object Groups'][i]:
-            for k in range(len(AnalysisDict['Hitting Data'][j])):
-                TempHitting.append(AnalysisDict['Hitting Data'][j][k])
+        TempHitting = Tracks.Concatenate([AnalysisDict['Hitting Data'][j] for j in AnalysisDict['Object Groups'][i]])
             
-        AlterHittingPoints(TempHitting, True, 500, Which, [0,0])
+        AlterHittingPoints(TempHitting, True, 500, Config.Which, [0,0], Config)
     
     
-    ScatterDistance(IsolatedObjects, Cutoff, ObjectZ, ImageVolume, ReadDict['Seperations'][0]) 
+    ScatterDistance(IsolatedObjects, Config.Cutoff, Config.ObjectZ, Config.ImageVolume, ReadDict['Seperations'][0], Config) 
     
     
         #GroupHitting.append(TempHitting)
     
     ObjectDict = {'Isolated Objects':IsolatedObjects, \
                   'Maximized':Maximized}
+    
+    if Volumetric:
+        ObjectDict['Objects'] = ObjectList
                  
     return ObjectDict
 
@@ -1474,11 +2116,7 @@ def VisualiseObjects_old(AnalysisDict, ReadDict):
     #GroupHitting = []
     
     for i in range(len(AnalysisDict['Object Groups'])):   
-        TempHitting = []
-        
-        for j in AnalysisDict['Object Groups'][i]:
-            for k in range(len(AnalysisDict['Hitting Data'][j])):
-                TempHitting.append(AnalysisDict['Hitting Data'][j][k])
+        TempHitting = Tracks.Concatenate([AnalysisDict['Hitting Data'][j] for j in AnalysisDict['Object Groups'][i]])
             
         AlterHittingPoints(TempHitting, True, 500, Which, [0,0])
     
@@ -1507,6 +2145,10 @@ def VisualiseObjects_old(AnalysisDict, ReadDict):
 
 if __name__ == "__main__":
 
+    begin_time = datetime.datetime.now()
+    
+    Profiling.SetProgress(Profiling.PrintProgress)
+
     ReadDictionary = ReadDataFiles()
     
     AnalysisDictionary = AnalyseData(ReadDictionary)
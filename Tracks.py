@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Compact container for the tracks of ClusteredHittingPoints. A
+# TrackBundle keeps the [Image, Up, Surf] hitting points of all its
+# tracks in one (N, 3, 3) float array, with the detector, the event
+# (row of the RowData) and the cluster layer pixel of each track as
+# columns beside it:
+#
+#     Bundle.Points[k]      # hitting points of track k
+#     Bundle[a:b]           # TrackBundle of tracks a to b (a view)
+#     Bundle[k][0]          # as PixelHits[k][0] of the old list of [HittingPoints]
+#
+# so code written for the old lists still runs on it, while ObjectView,
+# AlterHittingPoints etc. use Points directly (td.HittingArray).
+# Bundles of several detectors are joined with Concatenate, and written
+# and read (memory-mapped) with Save and Load
+#--------------------------------------------------------------------
+
+import os
+import numpy as np
+from collections.abc import Sequence
+
+
+Columns = ['Points', 'Detector', 'Event', 'Pixel']
+
+
+
+class TrackBundle(Sequence):
+
+    #--------------------------------------------------------------------
+    # Points ((N, 3, 3) hitting points), Detector (index of the detector
+    # of each track, or one for all), Event (row of each track in its
+    # RowData) and Pixel (flat index of the cluster layer pixel the track
+    # crosses in the detector's own frame, before any Pose), -1 if unknown.
+    # Slicing with a slice gives a view, any other index array a copy
+    #--------------------------------------------------------------------
+
+    def __init__(self, Points, Detector=0, Event=None, Pixel=None):
+        self.Points = np.asarray(Points, dtype=float).reshape((-1, 3, 3))
+
+        N = len(self.Points)
+
+        self.Detector = np.asarray(Detector, dtype=np.int32) if np.ndim(Detector) else np.full(N, Detector, dtype=np.int32)
+        self.Event = np.full(N, -1, dtype=np.int64) if Event is None else np.asarray(Event, dtype=np.int64)
+        self.Pixel = np.full(N, -1, dtype=np.int64) if Pixel is None else np.asarray(Pixel, dtype=np.int64)
+
+        if len(self.Detector) != N or len(self.Event) != N or len(self.Pixel) != N:
+            raise ValueError('{} tracks with {} detectors, {} events and {} pixels'.format(N, len(self.Detector), len(self.Event), len(self.Pixel)))
+
+    def __len__(self):
+        return len(self.Points)
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return [self.Points[i]] # as an element of the old list of [HittingPoints]
+
+        return TrackBundle(self.Points[i], self.Detector[i], self.Event[i], self.Pixel[i])
+
+    def __iter__(self):
+        return ([HittingPoints] for HittingPoints in self.Points)
+
+    def __repr__(self):
+        return 'TrackBundle({} tracks from detectors {})'.format(len(self), np.unique(self.Detector).tolist())
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, Name).nbytes for Name in Columns)
+
+
+
+def IsTrackBundle(Value):
+    return isinstance(Value, TrackBundle)
+
+
+
+def FromPixelHits(PixelHits, Detector=0):
+    # TrackBundle of a ClusteredHittingPoints style list of [HittingPoints] (bundles are returned as they are)
+    if IsTrackBundle(PixelHits):
+        return PixelHits
+
+    return TrackBundle(np.array([Hit[0] for Hit in PixelHits], dtype=float).reshape((-1, 3, 3)), Detector)
+
+
+
+def Concatenate(Bundles):
+    # One TrackBundle of the tracks of Bundles (TrackBundles or lists of [HittingPoints]), in order
+    Bundles = [FromPixelHits(Bundle) for Bundle in Bundles]
+
+    if not Bundles:
+        return TrackBundle(np.zeros((0, 3, 3)))
+
+    return TrackBundle(*[np.concatenate([getattr(Bundle, Name) for Bundle in Bundles]) for Name in Columns])
+
+
+
+def Save(Bundle, Directory):
+    # Writes the columns of Bundle to Directory as .npy files
+    os.makedirs(Directory, exist_ok=True)
+
+    for Name in Columns:
+        np.save(os.path.join(Directory, Name + '.npy'), getattr(Bundle, Name))
+
+
+
+def Load(Directory, mmap_mode='r'):
+    # TrackBundle written by Save, memory-mapped (read only) unless mmap_mode is None. Columns not saved are unknown
+    Paths = [os.path.join(Directory, Name + '.npy') for Name in Columns]
+
+    return TrackBundle(*[np.load(Path, mmap_mode=mmap_mode) if os.path.isfile(Path) else None for Path in Paths])
@@ -5,111 +5,48 @@ import numpy as np
 from joblib import dump, load
 from Plot import PlotQuick
 import ThreeD_Tracking as td
+import Pipeline
+import Store
+import SubVolumes
+import Tracks
 
 
-analyse = True
-skip = False
+Config = td.RunConfig.FromGlobals() # edit with Config.Replace(...) to run other parameters
+Workers = None # processes for the per-detector stages, None uses all cores
 
-if not skip:
-    if analyse:
-    #    ReadDict = load("ReadDict2.joblib")
-        ReadDict = load("ReadDict3.joblib")
-        
-        AnalyseDict = td.AnalyseData(ReadDict)
-        
-    #    dump(AnalyseDict,"AnalyseDict2.joblib")
-        dump(AnalyseDict,"AnalyseDict3.joblib")
-    
-    else:
-    #    ReadDict = load("ReadDict2.joblib")
-    #    AnalyseDict = load("AnalyseDict2.joblib")
-        AnalyseDict = load("AnalyseDict3.joblib")
-    
-    
-    
-    shape = np.shape(ReadDict['Subtracted Count List'][0])
-    #print("shape is ",shape)
-    
-    
-    ClusteredList = []
-    HittingData = []
-    ObjectCounts = []
-    ObjectMax = []
-    BinPointList = []
-    ObjectOnes = []
-    
-    for i in range(len(AnalyseDict['All Indices'])):
-        ClusteredArray = np.zeros(shape)
-    
-    #    for j in range(len(AnalyseDict['All Indices'][i])):
-        
-        for ind_tup in AnalyseDict['All Indices'][i]:
-            ClusteredArray[ind_tup[0],ind_tup[1]] += \
-                ReadDict['Subtracted Count List'][i][ind_tup[0],ind_tup[1]]
-    
-        PlotQuick(ReadDict['Subtracted Count List'][i],Save=True,Title='Original {}'.format(i))
-        PlotQuick(ClusteredArray,Save=True,Title='Clustered {}'.format(i))
-    
-        ClusteredList.append(ClusteredArray)
-        
-        PixelHits = td.ClusteredHittingPoints(ReadDict['Row Sky List'][i], AnalyseDict['All Indices'][i], td.ClusterLayer, ReadDict['Seperations'][i])
-        
-        BinPoints = td.AlterHittingPoints(PixelHits, True, 1000, td.Which, ReadDict['Row Sky List'][i]['DetectorPos'])
-                    
-        TempCounts = td.ObjectView(PixelHits, td.ProjectionPixel, td.ObjectZ, td.ImageVolume, ReadDict['Seperations'][i])
-    
-    #    PlotQuick(TempCounts)
-    
-        HittingData.append(PixelHits)
-        BinPointList.append(BinPoints)
-        ObjectCounts.append(TempCounts)
-        
-        TempOnes = np.copy(TempCounts)
-        TempOnes[TempOnes > 0] = 1
+Cache = Pipeline.StageCache('cache') # stages whose inputs and parameters are unchanged are read from here, Enabled=False to always rerun
 
-        ObjectOnes.append(TempOnes)
-        ObjectMax.append(np.max(TempCounts))
-    
-    ObjectCounts = np.array(ObjectCounts)
-    ObjectCounts = td.ScaleLayers(ObjectCounts, True)
-    ObjectGroups, OverlapLists = td.GroupOverlaps(ObjectCounts)
-    DetectorCounts, AddedMaxima, Targets = td.ScaleGroups(ObjectCounts, ObjectGroups, ObjectMax, td.OverlapCutoff) # Scales the array from each beam identically and  
-                                                                                                             # creates Target without need for the classifier          
-    
-    AnalyseDict['Cluster Images'] = ClusteredList
-    AnalyseDict['Hitting Data'] = HittingData
-    AnalyseDict['Object Counts'] = ObjectCounts 
-    AnalyseDict['Object Ones'] = ObjectOnes
-    AnalyseDict['Detector Counts'] = DetectorCounts
-    AnalyseDict['Targets'] = Targets
-    AnalyseDict['Object Groups'] = ObjectGroups
-
-#PlotQuick(np.sum(ObjectOnes,axis=0))
+#ReadDict = load("ReadDict2.joblib")
+ReadDict = Store.ResultStore("ReadDict3")
+ReadKey = Cache.DirectoryKey("ReadDict3")
 
-cut = 3
+AnalyseDict = Pipeline.AnalyseStages(Cache, ReadDict, ReadKey, Config, Workers, Cut=3) # clustering, hitting points, ObjectView and grouping stages
 
-ObjectCuts = np.copy(np.sum(ObjectOnes,axis=0))
-ObjectCuts[ObjectCuts < cut] = 0
+for i in range(len(AnalyseDict['All Indices'])):
+    PlotQuick(ReadDict['Subtracted Count List'][i],Save=True,Title='Original {}'.format(i))
+    PlotQuick(AnalyseDict['Cluster Images'][i],Save=True,Title='Clustered {}'.format(i))
+    
+    PixelHits = AnalyseDict['Hitting Data'][i] # td.ClusteredHittingPoints of detector i (a Tracks.TrackBundle)
+    
+    BinPoints = td.AlterHittingPoints(PixelHits, True, 1000, Config.Which, ReadDict['Row Sky List'][i]['DetectorPos'], Config)
 
-AnalyseDict['Object Cuts'] = ObjectCuts
+ObjectCounts = AnalyseDict['Object Counts']
+ObjectCuts = AnalyseDict['Object Cuts']
 
+#PlotQuick(np.sum(AnalyseDict['Object Ones'],axis=0))
 #PlotQuick(ObjectCuts)
 
-td.ScatterDistance(ObjectCuts, td.Cutoff, td.ObjectZ, td.ImageVolume, ReadDict['Seperations'][0])
+td.ScatterDistance(ObjectCuts, Config.Cutoff, Config.ObjectZ, Config.ImageVolume, ReadDict['Seperations'][0], Config)
 # td.ScatterDistance(np.sum(ObjectCounts,axis=0), td.Cutoff, td.ObjectZ, td.ImageVolume, ReadDict['Seperations'][0])
-td.ScatterDistance(np.sum(ObjectCounts,axis=0) * ObjectCuts, td.Cutoff, td.ObjectZ, td.ImageVolume, ReadDict['Seperations'][0])
+td.ScatterDistance(SubVolumes.Total(ObjectCounts) * ObjectCuts, Config.Cutoff, Config.ObjectZ, Config.ImageVolume, ReadDict['Seperations'][0], Config)
 
 for i in range(len(AnalyseDict['Object Groups'])):   
-        TempHitting = []
-        
-        for j in AnalyseDict['Object Groups'][i]:
-            for k in range(len(AnalyseDict['Hitting Data'][j])):
-                TempHitting.append(AnalyseDict['Hitting Data'][j][k])
+        TempHitting = Tracks.Concatenate([AnalyseDict['Hitting Data'][j] for j in AnalyseDict['Object Groups'][i]])
             
-        td.AlterHittingPoints(TempHitting, True, 1000, td.Which, [0,0])
+        td.AlterHittingPoints(TempHitting, True, 1000, Config.Which, [0,0], Config)
     
 
-dump(AnalyseDict,'AnalyseDict3_full.joblib')
+Store.SaveResults(AnalyseDict,'AnalyseDict3_full')
 
 
 # for k in range(td.ProjectionPixel[2]):
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Times each stage of the pipeline on its own, on runs made with
+# Simulate.py and on the image layers in data/, and reports events/s,
+# voxels/s and peak memory. Results can be saved as a baseline and
+# later runs compared to it:
+#
+#     python bench.py --events 200000 --save baseline.json
+#     python bench.py --events 200000 --compare baseline.json
+#
+# --compare exits with status 1 if a stage is slower than its baseline
+# by more than --tolerance
+#--------------------------------------------------------------------
+
+import os
+import sys
+import json
+import glob
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg') # ScatterDistance without a display
+
+import matplotlib.pyplot as plt
+import ThreeD_Tracking as td
+import Simulate
+
+
+Positions = [[500*i, 0] for i in [1.5, 0.5, -0.5, -1.5]] # as view.py
+Anomaly = {'Centre':[0, 0, 1200], 'Radius':250, 'Contrast':2}
+
+
+
+# ---------------------------------- Inputs -----------------------------------------
+
+
+
+def MakeInputs(Events, Detectors, Directory, Seed=0, Config=None):
+
+    #--------------------------------------------------------------------
+    # Simulated sky and real runs of Events events for each detector and
+    # everything the stages after reading need (counts, clusters, hitting
+    # points, ObjectView counts and groups), made once before timing
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+    Seperation = td.PlanesSeperation
+
+    Inputs = {'Config':Config, 'Seperation':Seperation, 'Events':Events}
+
+    Inputs['File'] = os.path.join(Directory, 'RDS_bench.out')
+    Simulate.SimulateFile(Inputs['File'], Events + 1, Seperation, Positions[0], Seed=Seed, Config=Config)
+
+    Sky, Real = [], []
+
+    for i in range(Detectors):
+        Position = Positions[i % len(Positions)]
+
+        Sky.append(Simulate.EventsToRowData(Simulate.SimulateEvents(Events, Seperation, Position, Seed=[Seed, i, 0], Config=Config), Position))
+        Real.append(Simulate.EventsToRowData(Simulate.SimulateEvents(Events, Seperation, Position, [Anomaly], Seed=[Seed, i, 1], Config=Config), Position))
+
+    Counts = [td.PazAnalysis(Sky[i], Seperation, False, Config) - td.PazAnalysis(Real[i], Seperation, False, Config) for i in range(Detectors)]
+
+    for Count in Counts:
+        Count[Count < 0] = 0
+
+    ReadDict = {'Row Sky List':Sky, 'Subtracted Count List':Counts, 'Seperations':[Seperation] * Detectors}
+
+    Inputs['ReadDict'] = ReadDict
+    Inputs['AnalyseDict'] = td.AnalyseData(ReadDict, Config)
+
+    Inputs['Hitting Data'] = [td.ClusteredHittingPoints(Sky[i], Inputs['AnalyseDict']['All Indices'][i], Config.ClusterLayer, Seperation, Config) \
+                              for i in range(Detectors)]
+
+    Inputs['Object Views'] = [td.ObjectView(PixelHits, Config.ProjectionPixel, Config.ObjectZ, Config.ImageVolume, Seperation, Config) \
+                              for PixelHits in Inputs['Hitting Data']]
+
+    Inputs['Object Counts'] = td.ScaleLayers(np.array(Inputs['Object Views']), True, Config)
+    Inputs['Object Groups'] = td.GroupOverlaps(Inputs['Object Counts'])[0]
+
+    Bundled = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'MTS*Background.txt')))
+    Inputs['Layers'] = [np.loadtxt(Name) - np.loadtxt(Name.replace('Background', 'Signal')) for Name in Bundled] or Counts
+
+    for Layer in Inputs['Layers']:
+        Layer[Layer < 0] = 0
+
+    return Inputs
+
+
+
+# ---------------------------------- Stages -----------------------------------------
+
+
+
+def Stages(Inputs):
+
+    #--------------------------------------------------------------------
+    # Name: (function of no arguments running the stage once, events it
+    # handles, voxels it makes or reads)
+    #--------------------------------------------------------------------
+
+    Config, Seperation = Inputs['Config'], Inputs['Seperation']
+
+    Sky = Inputs['ReadDict']['Row Sky List'][0]
+    Indices = Inputs['AnalyseDict']['All Indices'][0]
+    PixelHits = max(Inputs['Hitting Data'], key=len)
+    Layers = Inputs['Layers']
+    Objects = Inputs['Object Counts']
+
+    Events = len(Sky['BarsReadout'][0])
+    Pixels = int(np.prod(Config.ProjectionPixel[:2]))
+    Voxels = int(np.prod(Config.ProjectionPixel))
+
+    def Clusters():
+        for Layer in Layers:
+            Value, Index = td.LocalMaxIndices(Layer, Config.LocalCutoff, Config.Divide)
+            td.ClusterAlgorithm(Layer, Config.PercentCutoff * np.max(Value), list(Index[0]))
+
+    def Scatter():
+        td.ScatterDistance(np.sum(Objects, axis=0), Config.Cutoff, Config.ObjectZ, Config.ImageVolume, Seperation, Config)
+        plt.close('all')
+
+    StageDict = {'ReadRowDataFileFastest':(lambda: td.ReadRowDataFileFastest(Inputs['File'], Positions[0]), Inputs['Events'], 0),
+                 'PazAnalysis':(lambda: td.PazAnalysis(Sky, Seperation, False, Config), Events, Pixels),
+                 'PazAnalysis Iterate':(lambda: td.PazAnalysis(Sky, Seperation, True, Config), Events, Voxels),
+                 'LocalMaxIndices':(lambda: [td.LocalMaxIndices(Layer, Config.LocalCutoff, Config.Divide) for Layer in Layers], 0, Pixels * len(Layers)),
+                 'ClusterAlgorithm':(Clusters, 0, Pixels * len(Layers)),
+                 'ClusteredHittingPoints':(lambda: td.ClusteredHittingPoints(Sky, Indices, Config.ClusterLayer, Seperation, Config), Events, 0),
+                 'ObjectView':(lambda: td.ObjectView(PixelHits, Config.ProjectionPixel, Config.ObjectZ, Config.ImageVolume, Seperation, Config), len(PixelHits), Voxels),
+                 'GroupOverlaps':(lambda: td.GroupOverlaps(Objects), 0, Voxels * len(Objects)),
+                 'ScaleGroups':(lambda: td.ScaleGroups(Objects, Inputs['Object Groups'], [np.max(View) for View in Inputs['Object Views']], Config.OverlapCutoff, Config), 0, Voxels * len(Objects)),
+                 'ScatterDistance':(Scatter, 0, Voxels)}
+
+    return StageDict
+
+
+
+def TimeStage(Function, Events, Voxels, Repeat=3):
+
+    #--------------------------------------------------------------------
+    # Best and median wall time of Repeat runs of Function and the peak
+    # memory [MB] it allocates (from one more run under tracemalloc)
+    #--------------------------------------------------------------------
+
+    Times = []
+
+    for i in range(Repeat):
+        Begin = time.perf_counter()
+        Function()
+        Times.append(time.perf_counter() - Begin)
+
+    tracemalloc.start()
+    Function()
+    Peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    Best = min(Times)
+
+    Result = {'Seconds':Best, \
+              'Median Seconds':float(np.median(Times)), \
+              'Events/s':Events / Best if Events else None, \
+              'Voxels/s':Voxels / Best if Voxels else None, \
+              'Peak MB':Peak / 2**20}
+
+    return Result
+
+
+
+def Compare(Results, Baseline, Tolerance=0.2):
+    # Stages at least Tolerance (a fraction) slower than in Baseline, as {Name: time / baseline time}
+    Slower = {}
+
+    for Name, Result in Results['Stages'].items():
+        if Name in Baseline['Stages']:
+            Ratio = Result['Seconds'] / Baseline['Stages'][Name]['Seconds']
+
+            if Ratio > 1 + Tolerance:
+                Slower[Name] = Ratio
+
+    return Slower
+
+
+
+def Main(Arguments=None):
+    Parser = argparse.ArgumentParser(description='Times each pipeline stage on simulated runs and the bundled data')
+
+    Parser.add_argument('-n', '--events', type=int, default=100000, help='events per simulated run (default 100000)')
+    Parser.add_argument('-d', '--detectors', type=int, default=4, help='simulated detectors (default 4)')
+    Parser.add_argument('-r', '--repeat', type=int, default=3, help='timed runs of each stage (default 3)')
+    Parser.add_argument('--stages', nargs='+', default=None, help='only time these stages')
+    Parser.add_argument('--seed', type=int, default=0)
+    Parser.add_argument('--save', default=None, help='write the results to this JSON file')
+    Parser.add_argument('--compare', default=None, help='baseline JSON file to flag regressions against')
+    Parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown flagged as a regression (default 0.2 = 20%%)')
+
+    Args = Parser.parse_args(Arguments)
+
+    with tempfile.TemporaryDirectory() as Directory:
+        print('Simulating', Args.detectors, 'detectors of', Args.events, 'events')
+        Inputs = MakeInputs(Args.events, Args.detectors, Directory, Args.seed)
+
+        Results = {'Meta':{'Events':Args.events, 'Detectors':Args.detectors, 'Repeat':Args.repeat, \
+                           'Python':platform.python_version(), 'NumPy':np.__version__, \
+                           'Machine':platform.platform(), 'CPUs':os.cpu_count(), 'Date':time.strftime('%Y-%m-%d %H:%M:%S')}, \
+                   'Stages':{}}
+
+        for Name, (Function, Events, Voxels) in Stages(Inputs).items():
+            if Args.stages and Name not in Args.stages:
+                continue
+
+            Results['Stages'][Name] = TimeStage(Function, Events, Voxels, Args.repeat)
+
+    Format = lambda Value: '{:12.4g}'.format(Value) if Value is not None else '{:>12}'.format('-')
+
+    print('\n{:<24}{:>12}{:>12}{:>12}{:>12}'.format('Stage', 'Seconds', 'Events/s', 'Voxels/s', 'Peak MB'))
+
+    for Name, Result in Results['Stages'].items():
+        print('{:<24}'.format(Name) + ''.join(Format(Result[Key]) for Key in ['Seconds', 'Events/s', 'Voxels/s', 'Peak MB']))
+
+    if Args.save:
+        with open(Args.save, 'w') as File:
+            json.dump(Results, File, indent=1)
+
+    if Args.compare:
+        with open(Args.compare) as File:
+            Slower = Compare(Results, json.load(File), Args.tolerance)
+
+        for Name, Ratio in Slower.items():
+            print('REGRESSION: {} is {:.2f}x slower than the baseline'.format(Name, Ratio))
+
+        if Slower:
+            sys.exit(1)
+
+        print('No stage is more than {:.0%} slower than the baseline'.format(Args.tolerance))
+
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Runs the original implementations of the rewritten stages (Legacy.py)
+# and the current ones side by side on the same simulated runs, and
+# reports every output that differs by more than the tolerances:
+#
+#     python golden.py --events 20000 --detectors 3
+#
+# Exits with status 1 if any stage diverges. New fast paths of a stage
+# are checked by adding them to Comparisons
+#--------------------------------------------------------------------
+
+import os
+import sys
+import numbers
+import json
+import argparse
+import tempfile
+import numpy as np
+import ThreeD_Tracking as td
+import Simulate
+import Legacy
+import Histograms
+import Reconstruction
+import Pose
+
+
+Positions = [[500*i, 0] for i in [1.5, 0.5, -0.5, -1.5]] # as view.py
+Anomaly = {'Centre':[0, 0, 1200], 'Radius':250, 'Contrast':2}
+
+
+
+def MakeInputs(Events, Detectors, Seed=0, Config=None):
+
+    #--------------------------------------------------------------------
+    # Simulated sky runs and subtracted counts (sky - real, the real runs
+    # with a buried anomaly) of each detector
+    #--------------------------------------------------------------------
+
+    Config = td.GetConfig(Config)
+    Seperation = td.PlanesSeperation
+
+    Sky, Counts = [], []
+
+    for i in range(Detectors):
+        Position = Positions[i % len(Positions)]
+
+        RDSky = Simulate.EventsToRowData(Simulate.SimulateEvents(Events, Seperation, Position, Seed=[Seed, i, 0], Config=Config), Position)
+        RDReal = Simulate.EventsToRowData(Simulate.SimulateEvents(Events, Seperation, Position, [Anomaly], Seed=[Seed, i, 1], Config=Config), Position)
+
+        Count = td.PazAnalysis(RDSky, Seperation, False, Config) - td.PazAnalysis(RDReal, Seperation, False, Config)
+        Count[Count < 0] = 0
+
+        Sky.append(RDSky)
+        Counts.append(Count)
+
+    Inputs = {'Config':Config, \
+              'Seperation':Seperation, \
+              'ReadDict':{'Row Sky List':Sky, 'Subtracted Count List':Counts, 'Seperations':[Seperation] * Detectors}}
+
+    return Inputs
+
+
+
+# ---------------------------------- Comparison -----------------------------------------
+
+
+
+def Flatten(Value):
+    # Comparable leaves (arrays, numbers, sets) of nested lists, tuples and dicts
+    if isinstance(Value, dict):
+        return [Leaf for Key in sorted(Value) for Leaf in Flatten(Value[Key])]
+
+    if isinstance(Value, (list, tuple)):
+        if all(isinstance(v, (numbers.Number, np.generic)) for v in Value):
+            return [np.asarray(Value)]
+
+        return [Leaf for v in Value for Leaf in Flatten(v)]
+
+    return [Value]
+
+
+
+def Difference(Old, New, RTol=0, ATol=0):
+
+    #--------------------------------------------------------------------
+    # Compares two outputs leaf by leaf (see Flatten). Returns whether
+    # they match within the tolerances, the largest absolute difference
+    # and the number of differing elements (or leaves of other types)
+    #--------------------------------------------------------------------
+
+    OldLeaves, NewLeaves = Flatten(Old), Flatten(New)
+
+    if len(OldLeaves) != len(NewLeaves):
+        return {'Match':False, 'Max Difference':None, 'Differing':abs(len(OldLeaves) - len(NewLeaves)), \
+                'Note':'{} outputs against {}'.format(len(OldLeaves), len(NewLeaves))}
+
+    MaxDifference, Differing = 0.0, 0
+
+    for A, B in zip(OldLeaves, NewLeaves):
+        if isinstance(A, set) or isinstance(B, set):
+            Differing += len(set(A) ^ set(B))
+            continue
+
+        try:
+            A, B = np.asarray(A, dtype=float), np.asarray(B, dtype=float)
+
+        except (TypeError, ValueError):
+            Differing += int(A != B)
+            continue
+
+        if A.shape != B.shape:
+            Differing += max(A.size, B.size)
+            continue
+
+        Close = np.isclose(A, B, rtol=RTol, atol=ATol, equal_nan=True)
+
+        Differing += int(np.count_nonzero(~Close))
+
+        if A.size:
+            with np.errstate(invalid='ignore'):
+                Gap = np.abs(A - B)
+
+            MaxDifference = max(MaxDifference, float(np.nanmax(Gap, initial=0)))
+
+    return {'Match':Differing == 0, 'Max Difference':MaxDifference, 'Differing':Differing}
+
+
+
+def CountPaths(Sky, Seperation, Config, Chunk=1000):
+
+    #--------------------------------------------------------------------
+    # Name: (PazAnalysis Iterate, same counts by another path) for the
+    # parallel, accumulated and time sliced counts of the Histograms
+    # module, with the Projection of Config. PazAnalysis and
+    # ParallelPazAnalysis sum blocks of Chunk events, and must give the
+    # same bits with 1 and 3 workers
+    #--------------------------------------------------------------------
+
+    Direct = [td.PazAnalysis(RowData, Seperation, True, Config, Chunk) for RowData in Sky]
+
+    Accumulated = []
+
+    for RowData in Sky:
+        Accumulator = Histograms.CountAccumulator(RowData['DetectorPos'], Seperation, True, Config=Config)
+        Accumulator.AddSky(RowData)
+
+        Accumulated.append(Accumulator.Counts['Sky'])
+
+    Serial = [Histograms.ParallelPazAnalysis(RowData, Seperation, True, 1, Chunk, Config) for RowData in Sky]
+    Parallel = [Histograms.ParallelPazAnalysis(RowData, Seperation, True, 3, Chunk, Config) for RowData in Sky]
+
+    Name = ' ' + Config.Projection
+
+    Pairs = {'ParallelPazAnalysis' + Name:(Direct, Serial), \
+             'ParallelPazAnalysis 3' + Name:([1] * len(Sky), [int(np.array_equal(Serial[i], Parallel[i])) for i in range(len(Sky))]), \
+             'CountAccumulator' + Name:(Direct, Accumulated), \
+             'TimeSlicedCounts' + Name:(Direct, [Histograms.TimeSlicedCounts(RowData, Seperation, 3, True, Config)['Counts'].sum(axis=0) for RowData in Sky])}
+
+    return Pairs
+
+
+
+def PosePaths(RowData, Seperation, Config, Directory):
+
+    #--------------------------------------------------------------------
+    # Name: (expected, found) for the reconstruction operators of a
+    # detector with a Pose: a level pose at the detector gives the same
+    # matrices and layout key as none, a turned one other matrices and
+    # its own OperatorCache entry (in Directory)
+    #--------------------------------------------------------------------
+
+    DetectorPos = RowData['DetectorPos']
+    Level, Turned = Pose.DetectorPose(DetectorPos), Pose.DetectorPose(DetectorPos, Yaw=30, Pitch=5)
+
+    Parts = lambda Matrix: [Matrix.data, Matrix.indices, Matrix.indptr]
+
+    Matrix, Tracks = Reconstruction.DetectorMatrix(RowData, Seperation, Config)
+    LevelMatrix, LevelTracks = Reconstruction.DetectorMatrix(RowData, Seperation, Config, DetectorPose=Level)
+    TurnedMatrix, TurnedTracks = Reconstruction.DetectorMatrix(RowData, Seperation, Config, DetectorPose=Turned)
+
+    Operators = Reconstruction.OperatorCache(Directory)
+    Layout = Operators.Get(DetectorPos, Seperation, Config, 1)
+    TurnedLayout = Operators.Get(DetectorPos, Seperation, Config, 1, Turned)
+
+    Found = [Operators.Key(DetectorPos, Seperation, Config, 1, Level) == Operators.Key(DetectorPos, Seperation, Config, 1), \
+             Operators.Key(DetectorPos, Seperation, Config, 1, Turned) != Operators.Key(DetectorPos, Seperation, Config, 1), \
+             len([Name for Name in os.listdir(Directory) if Name.startswith('Layout_')]) == 2, \
+             abs(TurnedLayout - Layout).max() > 0, abs(TurnedMatrix - Matrix).max() > 0, np.array_equal(TurnedTracks, Tracks)]
+
+    Pairs = {'DetectorMatrix Pose':(Parts(Matrix) + [Tracks], Parts(LevelMatrix) + [LevelTracks]), \
+             'OperatorCache Pose':([1] * len(Found), [int(Check) for Check in Found])}
+
+    return Pairs
+
+
+
+def RejectedPaths(RowData, Seperation, Config):
+
+    #--------------------------------------------------------------------
+    # Name: (expected, found) for a run with a rejected event (its second
+    # layer of bars has no signal). PazAnalysis leaves the event out,
+    # giving the counts of the run without it. The original looked as if
+    # it gave up on the run with -9999, but compared the list of hitting
+    # points to -9999 (never all True), so it left the event out as well
+    #--------------------------------------------------------------------
+
+    Bars, Lengths = RowData['BarsReadout']
+    Kept = [n for n in range(len(Bars[0])) if Bars[0][n] // 100 != 2]
+
+    Rejected = dict(RowData, BarsReadout=[[Bars[0], [Bars[0][n] for n in Kept]] + list(Bars[1:]), [Lengths[0], [Lengths[0][n] for n in Kept]] + list(Lengths[1:])], \
+                    NumberOfEvents=RowData['NumberOfEvents'] + 1)
+
+    Counts = [td.PazAnalysis(Rejected, Seperation, Iterate, Config) for Iterate in (False, True)]
+
+    Pairs = {'PazAnalysis Rejected':([Legacy.PazAnalysis(Rejected, Seperation, Iterate) for Iterate in (False, True)], Counts), \
+             'PazAnalysis Rejected Left':([td.PazAnalysis(RowData, Seperation, Iterate, Config) for Iterate in (False, True)], Counts)}
+
+    return Pairs
+
+
+
+def Comparisons(Inputs, Events=2000):
+
+    #--------------------------------------------------------------------
+    # Name: (legacy output, current output) of each stage on the same
+    # inputs, with the globals of Legacy set from the input Config
+    #--------------------------------------------------------------------
+
+    Config, Seperation = Inputs['Config'], Inputs['Seperation']
+    ReadDict = Inputs['ReadDict']
+    Sky = ReadDict['Row Sky List']
+    Counts = ReadDict['Subtracted Count List']
+
+    Legacy.UseConfig(Config)
+
+    Pairs = {}
+
+    Bars, Lengths = Sky[0]['BarsReadout']
+    ZImage = Config.ZUp(Seperation) + Config.ClusterOffset
+    Events = range(min(Events, len(Bars)))
+
+    Pairs['CalcEventHittingPoints'] = (np.array([Legacy.CalcEventHittingPoints(Bars[k], Lengths[k], ZImage, Sky[0]['DetectorPos'], Seperation) for k in Events]), \
+                                       np.array([td.CalcEventHittingPoints(Bars[k], Lengths[k], ZImage, Sky[0]['DetectorPos'], Seperation, Config) for k in Events]))
+
+    Pairs['PazAnalysis'] = ([Legacy.PazAnalysis(RowData, Seperation, False) for RowData in Sky], \
+                            [td.PazAnalysis(RowData, Seperation, False, Config) for RowData in Sky])
+
+    Pairs['PazAnalysis Iterate'] = ([Legacy.PazAnalysis(RowData, Seperation, True) for RowData in Sky], \
+                                    [td.PazAnalysis(RowData, Seperation, True, Config) for RowData in Sky])
+
+    Pairs.update(RejectedPaths(Sky[0], Seperation, Config))
+    Pairs.update(CountPaths(Sky, Seperation, Config.Replace(Projection='Count')))
+    Pairs.update(CountPaths(Sky, Seperation, Config.Replace(Projection='Length')))
+
+    with tempfile.TemporaryDirectory() as Directory:
+        Pairs.update(PosePaths(Sky[0], Seperation, Config, Directory))
+
+    Starts = [list(np.unravel_index(np.argmax(Count), Count.shape)) for Count in Counts]
+    Clusters = lambda Module: [Module.ClusterAlgorithm(Counts[i], Config.PercentCutoff * np.max(Counts[i]), Starts[i]) for i in range(len(Counts))]
+    Pixels = lambda ClusterList: [[Cluster['Clustered Array'], set(tuple(Index) for Layer in Cluster['Active Indices'] for Index in Layer)] \
+                                  for Cluster in ClusterList]
+
+    Pairs['ClusterAlgorithm'] = (Pixels(Clusters(Legacy)), Pixels(Clusters(td)))
+
+    Seeds = [td.LocalMaxIndices(Count, Config.LocalCutoff, Config.Divide) for Count in Counts]
+    Nested = [(Value, [Index[k:k+3] for k in range(0, len(Index), 3)]) for Value, Index in Seeds] # several seeds per element of Index
+
+    Pairs['ClusterMaxima'] = ([Legacy.ClusterMaxima(Counts[i], *Nested[i], Config.PercentCutoff) for i in range(len(Counts))], \
+                              [td.ClusterMaxima(Counts[i], *Nested[i], Config.PercentCutoff) for i in range(len(Counts))])
+
+    LegacyAnalyse = Legacy.AnalyseData(ReadDict)
+    Analyse = td.AnalyseData(ReadDict, Config)
+
+    Pairs['AnalyseData'] = ([LegacyAnalyse['All Indices'], LegacyAnalyse['Cluster Values']], \
+                            [Analyse['All Indices'], Analyse['Cluster Values']])
+
+    Indices = Analyse['All Indices']
+
+    LegacyHits = [Legacy.ClusteredHittingPoints(Sky[i], Indices[i], Config.ClusterLayer, Seperation) for i in range(len(Sky))]
+    Hits = [td.ClusteredHittingPoints(Sky[i], Indices[i], Config.ClusterLayer, Seperation, Config) for i in range(len(Sky))]
+
+    Pairs['ClusteredHittingPoints'] = ([td.HittingArray(PixelHits) for PixelHits in LegacyHits], [td.HittingArray(PixelHits) for PixelHits in Hits])
+
+    LegacyViews = [Legacy.ObjectView(PixelHits, Config.ProjectionPixel, Config.ObjectZ, Config.ImageVolume, Seperation) for PixelHits in Hits]
+    Views = [td.ObjectView(PixelHits, Config.ProjectionPixel, Config.ObjectZ, Config.ImageVolume, Seperation, Config) for PixelHits in Hits]
+
+    Pairs['ObjectView'] = (LegacyViews, Views)
+
+    Objects = td.ScaleLayers(np.array(Views), True, Config)
+    Maxima = [np.max(View) for View in Views]
+
+    Pairs['ScaleLayers'] = (Legacy.ScaleLayers(np.array(Views), True), td.ScaleLayers(np.array(Views), True, Config))
+
+    LegacyGroups = Legacy.GroupOverlaps(np.copy(Objects))
+    Groups = td.GroupOverlaps(np.copy(Objects))
+
+    Pairs['GroupOverlaps'] = (LegacyGroups, Groups)
+
+    Pairs['ScaleGroups'] = (Legacy.ScaleGroups(np.copy(Objects), Groups[0], Maxima, Config.OverlapCutoff), \
+                            td.ScaleGroups(np.copy(Objects), Groups[0], Maxima, Config.OverlapCutoff, Config))
+
+    return Pairs
+
+
+
+def Main(Arguments=None):
+    Parser = argparse.ArgumentParser(description='Checks the current stages against their original implementations')
+
+    Parser.add_argument('-n', '--events', type=int, default=20000, help='events per simulated run (default 20000)')
+    Parser.add_argument('-d', '--detectors', type=int, default=3, help='simulated detectors (default 3)')
+    Parser.add_argument('--seed', type=int, default=0)
+    Parser.add_argument('--rtol', type=float, default=1e-9, help='relative tolerance (default 1e-9)')
+    Parser.add_argument('--atol', type=float, default=1e-9, help='absolute tolerance (default 1e-9)')
+    Parser.add_argument('--report', default=None, help='write the comparison to this JSON file')
+
+    Args = Parser.parse_args(Arguments)
+
+    Inputs = MakeInputs(Args.events, Args.detectors, Args.seed)
+
+    Report = {}
+
+    for Name, (Old, New) in Comparisons(Inputs).items():
+        Report[Name] = Difference(Old, New, Args.rtol, Args.atol)
+
+    print('\n{:<28}{:>8}{:>16}{:>12}'.format('Stage', 'Match', 'Max Difference', 'Differing'))
+
+    for Name, Result in Report.items():
+        Gap = '{:16.3g}'.format(Result['Max Difference']) if Result['Max Difference'] is not None else '{:>16}'.format('-')
+        print('{:<28}{:>8}'.format(Name, 'yes' if Result['Match'] else 'NO') + Gap + '{:12d}'.format(Result['Differing']))
+
+    if Args.report:
+        with open(Args.report, 'w') as File:
+            json.dump(Report, File, indent=1)
+
+    Diverged = [Name for Name in Report if not Report[Name]['Match']]
+
+    if Diverged:
+        print('\nDIVERGED:', ', '.join(Diverged))
+        sys.exit(1)
+
+    print('\nAll stages match their original implementations')
+
+
+
+if __name__ == '__main__':
+    Main()
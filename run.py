@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+#--------------------------------------------------------------------
+# Batch entry point for the view -> analyse pipeline. Reads the detector
+# runs listed in a JSON manifest, counts, clusters and images them
+# without plotting windows or prompts, and writes the ReadDict and
+# AnalyseDict (as Store directories) to the output directory:
+#
+#     python run.py manifest.json --output results --workers 8
+#
+# The manifest lists each detector's RowData files, position [cm] and
+# layer seperation [cm], and optionally RunConfig changes:
+#
+#     {"Detectors": [{"Real": "RDR_[500,-500]cm.out",
+#                     "Sky": "RDS_[500,-500]cm.out",
+#                     "X": 500, "Y": -500, "Seperation": 25}, ...],
+#      "Config": {"OverlapCutoff": 0.4}}
+#
+# A detector turned from level can also be given "Yaw", "Pitch" and
+# "Roll" [degrees] (see Pose.py), its tracks are then rotated to match.
+# Relative file names are taken from the directory of the manifest.
+# --profile FILE writes the time, events/s etc. of each stage to FILE
+# (see Profiling.py)
+#--------------------------------------------------------------------
+
+import os
+import json
+import argparse
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg') # no display on batch nodes
+
+import matplotlib.pyplot as plt
+import ThreeD_Tracking as td
+import Pipeline
+import Profiling
+import Reconstruction
+import Beams
+import Pose
+import Store
+import SubVolumes
+
+
+
+def ReadManifest(FileName):
+
+    #--------------------------------------------------------------------
+    # Returns the ReadDataFiles arguments (RealFiles, SkyFiles, XPositions,
+    # YPositions, Seperations), RunConfig changes and the Pose.DetectorPose
+    # of each detector (None if no detector is turned) of a manifest
+    #--------------------------------------------------------------------
+
+    with open(FileName) as File:
+        Manifest = json.load(File)
+
+    Dir = os.path.dirname(os.path.abspath(FileName))
+    Path = lambda Name: os.path.join(Dir, os.path.expanduser(Name))
+
+    Detectors = Manifest['Detectors']
+
+    if len(Detectors) == 0:
+        raise ValueError('{} lists no detectors'.format(FileName))
+
+    for i, Detector in enumerate(Detectors):
+        Missing = [Key for Key in ['Real', 'Sky', 'X', 'Y', 'Seperation'] if Key not in Detector]
+
+        if Missing:
+            raise ValueError('Detector {} of {} has no {}'.format(i, FileName, ', '.join(Missing)))
+
+    Files = ([Path(Detector['Real']) for Detector in Detectors], \
+             [Path(Detector['Sky']) for Detector in Detectors], \
+             [float(Detector['X']) for Detector in Detectors], \
+             [float(Detector['Y']) for Detector in Detectors], \
+             [float(Detector['Seperation']) for Detector in Detectors])
+
+    Poses = None
+
+    if any(Angle in Detector for Detector in Detectors for Angle in ['Yaw', 'Pitch', 'Roll']):
+        Poses = [Pose.DetectorPose([float(Detector['X']), float(Detector['Y'])], \
+                                   *[float(Detector.get(Angle, 0)) for Angle in ['Yaw', 'Pitch', 'Roll']]) for Detector in Detectors]
+
+    return Files, Manifest.get('Config', {}), Poses
+
+
+
+def Run(ManifestFile, Output='results', Workers=None, CacheDir=None, UseCache=True, Cut=3, Plots=False, Method=None, Iterations=50, OperatorDir=None, Locate=False):
+
+    #--------------------------------------------------------------------
+    # Runs ReadDataFiles and the analyse.py stages on the runs of
+    # ManifestFile through a StageCache (in Output/cache unless CacheDir
+    # is given) and writes Output/ReadDict and Output/AnalyseDict. Plots
+    # saves the ScatterDistance figures of the imaged objects to Output.
+    # Method ('SIRT', 'ART' or 'OSEM') also reconstructs the deficit 
+    # volume with Iterations iterations into Output/Reconstruction, with
+    # the layout operators kept in OperatorDir if given. Locate also
+    # writes the cluster beams and where they cross (see Beams.py) to
+    # Output/Beams
+    #--------------------------------------------------------------------
+
+    Files, Changes, Poses = ReadManifest(ManifestFile)
+    RealFiles, SkyFiles, XPositions, YPositions, Seperations = Files
+
+    Config = td.RunConfig.FromGlobals().Replace(**Changes)
+
+    os.makedirs(Output, exist_ok=True)
+
+    Cache = Pipeline.StageCache(CacheDir or os.path.join(Output, 'cache'), UseCache)
+
+    ReadInputs = [Cache.FileKey(Name) for Name in RealFiles + SkyFiles] + [XPositions, YPositions, Seperations]
+
+    ReadDict, ReadKey = Cache.Run('Read', td.ReadDataFiles, Config, ReadInputs, \
+                                  RealFiles, SkyFiles, XPositions, YPositions, Seperations, Config, Workers, False)
+
+    AnalyseDict = Pipeline.AnalyseStages(Cache, ReadDict, ReadKey, Config, Workers, Cut, Poses)
+
+    Store.SaveResults(ReadDict, os.path.join(Output, 'ReadDict'))
+    Store.SaveResults(AnalyseDict, os.path.join(Output, 'AnalyseDict'))
+
+    Figures = [('Object Cuts', AnalyseDict['Object Cuts']),
+               ('Object Counts', SubVolumes.Total(AnalyseDict['Object Counts']) * AnalyseDict['Object Cuts'])]
+
+    if Method:
+        Operators = Reconstruction.OperatorCache(OperatorDir) if OperatorDir else None
+
+        Result = Pipeline.ReconstructStages(Cache, ReadDict, ReadKey, Config, Method, Iterations, Operators=Operators, Poses=Poses)
+        Store.SaveResults(Result, os.path.join(Output, 'Reconstruction'))
+
+        Figures.append(('Reconstruction', np.asarray(Result['Volume'])))
+
+    if Locate:
+        BeamDict = Beams.LocateObjects(ReadDict, AnalyseDict, Config)
+        Store.SaveResults(BeamDict, os.path.join(Output, 'Beams'))
+
+        for Object in BeamDict['Objects'][:5]:
+            print('Object at [{:.0f}, {:.0f}, {:.0f}] cm, {:.0f} cm deep, weight {:.1f}'.format(*Object['Position'], Object['Depth'], Object['Weight']))
+
+    if Plots:
+        for Title, Data in Figures:
+            td.ScatterDistance(Data, Config.Cutoff, Config.ObjectZ, Config.ImageVolume, Seperations[0], Config)
+
+            plt.savefig(os.path.join(Output, Title.replace(' ', '_') + '.png'))
+            plt.close('all')
+
+    print('Imaged', len(RealFiles), 'detectors, results written to', Output)
+
+    return AnalyseDict
+
+
+
+def Main(Arguments=None):
+    Parser = argparse.ArgumentParser(description='Images the detector runs of a manifest without user input')
+
+    Parser.add_argument('manifest', help='JSON file listing the sky and real RowData files, X/Y position and seperation of each detector')
+    Parser.add_argument('-o', '--output', default='results', help='directory for the ReadDict and AnalyseDict results (default results)')
+    Parser.add_argument('-w', '--workers', type=int, default=None, help='processes for the per-detector stages (default all cores)')
+    Parser.add_argument('--cache', default=None, help='stage cache directory (default OUTPUT/cache)')
+    Parser.add_argument('--no-cache', action='store_true', help='rerun every stage without reading or writing the cache')
+    Parser.add_argument('--cut', type=int, default=3, help='voxels seen by fewer detectors are left out of Object Cuts (default 3)')
+    Parser.add_argument('--plots', action='store_true', help='save the ScatterDistance figures to OUTPUT')
+    Parser.add_argument('--reconstruct', default=None, choices=['SIRT', 'ART', 'OSEM'], help='also solve for the deficit volume with this method')
+    Parser.add_argument('--iterations', type=int, default=50, help='iterations of --reconstruct (default 50)')
+    Parser.add_argument('--operators', default=None, metavar='DIR', help='reconstruct with the projection operators of the detector layouts kept in DIR (traced once per layout) instead of the tracks of the run')
+    Parser.add_argument('--beams', action='store_true', help='also locate objects from where the beams of the clusters of different detectors cross')
+    Parser.add_argument('--progress', action='store_true', help='show the events read and fitted, events/s and ETA of each file while it runs')
+    Parser.add_argument('--profile', default=None, metavar='FILE', help='write a JSON report of the time spent in each stage to FILE')
+    Parser.add_argument('--profile-functions', action='store_true', help='add the slowest functions (cProfile) to the report')
+    Parser.add_argument('--profile-memory', action='store_true', help='add the peak memory of each stage (tracemalloc) to the report')
+
+    Args = Parser.parse_args(Arguments)
+
+    if Args.progress:
+        Profiling.SetProgress(Profiling.PrintProgress)
+
+    if Args.profile:
+        Profiling.Enable(Args.profile_functions, Args.profile_memory)
+
+    Run(Args.manifest, Args.output, Args.workers, Args.cache, not Args.no_cache, Args.cut, Args.plots, Args.reconstruct, Args.iterations, Args.operators, Args.beams)
+
+    if Args.profile:
+        Profiling.SaveReport(Args.profile)
+        Profiling.PrintReport()
+
+
+
+if __name__ == '__main__':
+    Main()
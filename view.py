@@ -5,6 +5,7 @@ import glob
 from joblib import dump, load
 from Plot import PlotQuick
 import ThreeD_Tracking as td
+import Store
 
 
 Directory = "/Users/keegan/Desktop/Research/visualisation/Gilad_Builds_and_data/real_det_data/second_set/"
@@ -54,7 +55,7 @@ ReadDict = {'Row Sky List':RowSkyList, \
             'Seperations':Seperations}
 
 #dump(ReadDict,"ReadDict3.joblib")
-dump(ReadDict,"ReadDict3.joblib")
+Store.SaveResults(ReadDict,"ReadDict3") # one file per detector and key, read back lazily with Store.ResultStore
 
 
 